@@ -1,19 +1,48 @@
 # app/dynamodb.py
-import os, time, uuid
-from typing import Optional, List, Dict
+import base64, json, os, threading, time, uuid
+from decimal import Decimal
+from typing import Any, Optional, List, Dict, Iterable, Tuple
 import boto3
-from boto3.dynamodb.conditions import Key, Attr
+from boto3.dynamodb.conditions import Key
+from botocore.config import Config
+from botocore.exceptions import ClientError
 
 TABLE = os.getenv("VIDEOS_TABLE", "videos")
 PK = os.getenv("VIDEOS_PK", "owner")      # allow overriding if table differs
 SK = os.getenv("VIDEOS_SK", "video_id")
+# GSI (hash key: owner, range key: created_at) used when the table isn't keyed by owner
+OWNER_INDEX = os.getenv("VIDEOS_OWNER_INDEX", "owner-created_at-index")
+DDB_ENDPOINT = os.getenv("DYNAMODB_ENDPOINT")  # DynamoDB Local only, e.g. http://localhost:8000
+DDB_MAX_CONNECTIONS = int(os.getenv("DYNAMODB_MAX_CONNECTIONS", "32"))
+BATCH_GET_LIMIT = 100  # DynamoDB's BatchGetItem cap
+BATCH_RETRIES = 5
+
+# boto3 resources are not thread-safe, so each thread builds its own once and
+# keeps it (and its connection pool) for every later call.
+_local = threading.local()
 
 def _ddb():
-    region = (os.getenv("AWS_REGION") or os.getenv("AWS_DEFAULT_REGION") or "ap-southeast-2").replace("_", "-")
-    return boto3.resource("dynamodb", region_name=region)
+    res = getattr(_local, "resource", None)
+    if res is None:
+        region = (os.getenv("AWS_REGION") or os.getenv("AWS_DEFAULT_REGION") or "ap-southeast-2").replace("_", "-")
+        kwargs: Dict[str, Any] = {
+            "region_name": region,
+            "config": Config(
+                max_pool_connections=DDB_MAX_CONNECTIONS,
+                retries={"max_attempts": 5, "mode": "adaptive"},
+                tcp_keepalive=True,
+            ),
+        }
+        if DDB_ENDPOINT:
+            kwargs["endpoint_url"] = DDB_ENDPOINT
+        res = _local.resource = boto3.session.Session().resource("dynamodb", **kwargs)
+    return res
 
 def table():
-    return _ddb().Table(TABLE)
+    t = getattr(_local, "table", None)
+    if t is None:
+        t = _local.table = _ddb().Table(TABLE)
+    return t
 
 def new_video(owner: str, s3_key: str, title: Optional[str] = None) -> str:
     vid = str(uuid.uuid4())
@@ -28,6 +57,8 @@ def new_video(owner: str, s3_key: str, title: Optional[str] = None) -> str:
         "created_at": now,
         "updated_at": now,
     }
+    if PK != "owner":
+        item["owner"] = owner  # the owner GSI's hash key
     table().put_item(Item=item)
     return vid
 
@@ -49,21 +80,99 @@ def get_video(owner: str, video_id: str) -> Optional[Dict]:
     resp = table().get_item(Key={PK: owner, SK: video_id})
     return resp.get("Item")
 
-def list_videos(owner: str) -> List[Dict]:
-    # If the table's PK is 'owner', we can Query efficiently.
-    # If the table's PK is something else (e.g., 'video_id'), fall back to a Scan + filter.
-    if PK == "owner":
-        resp = table().query(
-            KeyConditionExpression=Key(PK).eq(owner),
-            ScanIndexForward=False,
-            Limit=100,
-        )
-        return resp.get("Items", [])
+def _json_default(v: Any) -> Any:
+    if isinstance(v, Decimal):  # numeric key attributes, e.g. the GSI's created_at
+        return int(v) if v == v.to_integral_value() else float(v)
+    raise TypeError(f"cannot encode {type(v).__name__} in a cursor")
 
-    # Fallback for mismatched PK: use Scan filtered by the owner attribute.
-    # (OK for small datasets; for scale, add a GSI on 'owner' and query that.)
-    resp = table().scan(
-        FilterExpression=Attr("owner").eq(owner),
-        Limit=100
-    )
-    return resp.get("Items", [])
+def _encode_cursor(last_key: Optional[Dict]) -> Optional[str]:
+    if not last_key:
+        return None
+    raw = json.dumps(last_key, default=_json_default, separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+def _decode_cursor(cursor: str) -> Dict:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        key = json.loads(raw, parse_float=Decimal)
+    except ValueError as e:
+        raise ValueError("invalid cursor") from e
+    if not isinstance(key, dict):
+        raise ValueError("invalid cursor")
+    return key
+
+def list_videos(owner: str, limit: int = 100, cursor: Optional[str] = None) -> Tuple[List[Dict], Optional[str]]:
+    """
+    One page of the owner's videos plus an opaque cursor for the next page
+    (None on the last page). Raises ValueError for a malformed cursor.
+    """
+    kwargs: Dict[str, Any] = {
+        "KeyConditionExpression": Key("owner").eq(owner),
+        "ScanIndexForward": False,
+        "Limit": limit,
+    }
+    key_attrs = {PK, SK}
+    if PK != "owner":
+        # Table keyed by something else: query the owner GSI instead of scanning
+        kwargs["IndexName"] = OWNER_INDEX
+        key_attrs |= {"owner", "created_at"}
+    if cursor:
+        start = _decode_cursor(cursor)
+        if set(start) != key_attrs or start.get("owner", owner) != owner:
+            raise ValueError("invalid cursor")
+        kwargs["ExclusiveStartKey"] = start
+    try:
+        resp = table().query(**kwargs)
+    except ClientError as e:
+        if cursor and e.response.get("Error", {}).get("Code") == "ValidationException":
+            raise ValueError("invalid cursor") from e  # well-formed, but not a key of this table/index
+        raise
+    return resp.get("Items", []), _encode_cursor(resp.get("LastEvaluatedKey"))
+
+def batch_get_videos(owner: str, video_ids: Iterable[str]) -> List[Dict]:
+    """BatchGetItem in chunks of 100, retrying UnprocessedKeys with backoff."""
+    ids = list(dict.fromkeys(video_ids))
+    items: List[Dict] = []
+    for i in range(0, len(ids), BATCH_GET_LIMIT):
+        request = {TABLE: {"Keys": [{PK: owner, SK: vid} for vid in ids[i:i + BATCH_GET_LIMIT]]}}
+        for attempt in range(BATCH_RETRIES + 1):
+            resp = _ddb().batch_get_item(RequestItems=request)
+            items.extend(resp.get("Responses", {}).get(TABLE, []))
+            request = resp.get("UnprocessedKeys") or {}
+            if not request:
+                break
+            time.sleep(0.05 * 2 ** attempt)
+        if request:
+            raise RuntimeError(f"batch_get_item left {len(request[TABLE]['Keys'])} keys unprocessed")
+    return items
+
+def batch_put_videos(items: Iterable[Dict]) -> int:
+    """BatchWriteItem (25 per request; unprocessed items are resent by the batch writer)."""
+    n = 0
+    with table().batch_writer(overwrite_by_pkeys=[PK, SK]) as batch:
+        for item in items:
+            batch.put_item(Item=item)
+            n += 1
+    return n
+
+def batch_update_status(
+    owner: str,
+    video_ids: Iterable[str],
+    status: str,
+    outputs: Optional[List[Dict]] = None,
+) -> List[str]:
+    """
+    Set status on many videos with one BatchGetItem + BatchWriteItem round
+    per 100/25 items instead of an UpdateItem each. Items are rewritten
+    whole, so a concurrent update_status() on the same video can be lost.
+    Returns the ids that were found and updated.
+    """
+    now = int(time.time())
+    items = batch_get_videos(owner, video_ids)
+    for item in items:
+        item["status"] = status
+        item["updated_at"] = now
+        if outputs is not None:
+            item["outputs"] = outputs
+    batch_put_videos(items)
+    return [item[SK] for item in items]
@@ -0,0 +1,106 @@
+# app/events.py
+"""
+Server-Sent Events fan-out for job progress.
+
+Workers write throttled progress into jobs.progress_json (they may run in
+another process or on another host). Here, one poller per watched job reads
+that row and pushes changes to every connected client, so DB load depends
+on the number of jobs being watched, not the number of watchers.
+"""
+from __future__ import annotations
+from typing import Any, AsyncIterator, Dict, Optional, Set
+import asyncio
+import json
+import os
+
+from starlette.concurrency import run_in_threadpool
+
+from .models import Job, SessionLocal
+
+POLL_SECONDS = float(os.getenv("EVENTS_POLL_SECONDS", "1"))
+KEEPALIVE_SECONDS = 15.0
+TERMINAL = {"done", "failed", "cancelled"}
+
+def _snapshot(job_id: int) -> Optional[Dict[str, Any]]:
+    db = SessionLocal()
+    try:
+        j = db.get(Job, job_id)
+        if not j:
+            return None
+        return {
+            "id": j.id,
+            "status": j.status,
+            "progress": json.loads(j.progress_json) if j.progress_json else {},
+            "error": j.error,
+            "attempts": j.attempts,
+        }
+    finally:
+        db.close()
+
+def _offer(q: "asyncio.Queue[Optional[Dict[str, Any]]]", item: Optional[Dict[str, Any]]) -> None:
+    # Slow clients only need the latest state, so replace anything unread
+    while not q.empty():
+        q.get_nowait()
+    q.put_nowait(item)
+
+class _Topic:
+    def __init__(self) -> None:
+        self.subscribers: Set[asyncio.Queue] = set()
+        self.last: Optional[Dict[str, Any]] = None
+
+class JobEvents:
+    def __init__(self, poll_seconds: float = POLL_SECONDS):
+        self.poll_seconds = poll_seconds
+        self._topics: Dict[int, _Topic] = {}
+
+    def watchers(self) -> int:
+        return sum(len(t.subscribers) for t in self._topics.values())
+
+    async def _poll(self, job_id: int, topic: _Topic) -> None:
+        try:
+            while topic.subscribers:
+                snap = await run_in_threadpool(_snapshot, job_id)
+                if snap != topic.last:
+                    topic.last = snap
+                    for q in list(topic.subscribers):
+                        _offer(q, snap)
+                if snap is None or snap["status"] in TERMINAL:
+                    break
+                await asyncio.sleep(self.poll_seconds)
+        finally:
+            self._topics.pop(job_id, None)
+            for q in list(topic.subscribers):
+                q.put_nowait(None)  # end of stream, after any unread final state
+
+    async def subscribe(self, job_id: int) -> AsyncIterator[Optional[Dict[str, Any]]]:
+        """Yield job snapshots as they change; None is a keep-alive tick."""
+        topic = self._topics.get(job_id)
+        if topic is None:
+            topic = self._topics[job_id] = _Topic()
+            asyncio.get_running_loop().create_task(self._poll(job_id, topic))
+        q: asyncio.Queue = asyncio.Queue()
+        topic.subscribers.add(q)
+        if topic.last is not None:
+            _offer(q, topic.last)
+        try:
+            while True:
+                try:
+                    item = await asyncio.wait_for(q.get(), timeout=KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    yield None
+                    continue
+                if item is None:
+                    return
+                yield item
+        finally:
+            topic.subscribers.discard(q)
+
+    async def sse(self, job_id: int) -> AsyncIterator[str]:
+        async for snap in self.subscribe(job_id):
+            if snap is None:
+                yield ": keep-alive\n\n"
+            else:
+                yield f"event: job\ndata: {json.dumps(snap)}\n\n"
+        yield "event: end\ndata: {}\n\n"
+
+EVENTS = JobEvents()
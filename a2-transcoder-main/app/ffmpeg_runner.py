@@ -1,98 +1,1075 @@
 # app/ffmpeg_runner.py
 from __future__ import annotations
-import subprocess, time, os
+import json, math, signal, subprocess, time, os, threading, shutil, tempfile
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Callable, Iterable, Optional, Set, Tuple, Union
 
-def _args_for_intensity(level: str) -> list[str]:
+from . import metrics
+from .scheduler import get_budget
+
+SEGMENT_SECONDS = float(os.getenv("SEGMENT_SECONDS", "10"))  # target chunk length for mode="segmented"
+SEGMENT_THREADS = int(os.getenv("SEGMENT_THREADS", "2"))     # x264 is most efficient with few threads per chunk
+STREAM_SEGMENT_SECONDS = int(os.getenv("STREAM_SEGMENT_SECONDS", "4"))  # HLS/DASH segment length
+PACKAGINGS = {"hls", "dash", "cmaf"}  # cmaf = both manifests over the same segments
+# Stream-copy a rendition that already matches the source (H.264 yuv420p, same size) and
+# is no bigger than encoding it would be: source bitrate within REMUX_BITRATE_SLACK x what
+# the rung's CRF typically yields (and under REMUX_MAX_BITRATE, if set)
+REMUX_FAST_PATH = os.getenv("REMUX_FAST_PATH", "1") in {"1", "true", "True"}
+REMUX_MAX_BITRATE = int(os.getenv("REMUX_MAX_BITRATE", "0"))  # bits/s; absolute cap (0 = none)
+REMUX_BITRATE_SLACK = float(os.getenv("REMUX_BITRATE_SLACK", "1.5"))
+REMUX_BITS_PER_PIXEL_CRF23 = 0.1  # typical x264 output at CRF 23; halves every +6 CRF
+REMUX_CODECS = {"h264"}
+REMUX_PIX_FMTS = {"yuv420p"}
+# Optional thumbnails stage: poster image, sprite sheets and a WebVTT track pointing into them
+THUMB_INTERVAL = float(os.getenv("THUMB_INTERVAL", "10"))  # seconds of video per sprite tile / VTT cue
+THUMB_WIDTH = int(os.getenv("THUMB_WIDTH", "160"))         # tile width; height follows the source aspect
+SPRITE_COLUMNS = int(os.getenv("SPRITE_COLUMNS", "10"))
+SPRITE_ROWS = int(os.getenv("SPRITE_ROWS", "10"))
+POSTER_MAX_WIDTH = 1280
+POSTER_FORMATS = {"jpg", "webp"}
+
+# A local file, or anything ffmpeg can open itself (http(s) URL, pipe:0)
+Source = Union[Path, str]
+
+def _args_for_intensity(level: str, threads: int = 0) -> list[str]:
+    # threads=0 lets x264 use every core; the scheduler passes its grant instead
     level = (level or "high").lower()
+    t = str(threads)
     if level == "low":
-        return ["-c:v", "libx264", "-preset", "faster",  "-threads", "0"]
+        return ["-c:v", "libx264", "-preset", "faster",  "-threads", t]
     if level == "medium":
-        return ["-c:v", "libx264", "-preset", "slow",    "-threads", "0"]
+        return ["-c:v", "libx264", "-preset", "slow",    "-threads", t]
     if level == "max":
         # Extremely heavy – only use for short demos
         return [
-            "-c:v", "libx264", "-preset", "placebo", "-tune", "film", "-threads", "0",
+            "-c:v", "libx264", "-preset", "placebo", "-tune", "film", "-threads", t,
             "-x264-params", "me=tesa:subme=10:merange=64:ref=6:rc-lookahead=60"
         ]
     # default: "high"
-    return ["-c:v", "libx264", "-preset", "veryslow", "-threads", "0"]
+    return ["-c:v", "libx264", "-preset", "veryslow", "-threads", t]
+
+def _check_input(src: Source) -> None:
+    """Local paths must exist; URLs and pipes are left for ffmpeg to open."""
+    if isinstance(src, Path) and (not src.exists() or not src.is_file()):
+        raise FileNotFoundError(f"Input not found: {src}")
+
+def _float(v: Any) -> Optional[float]:
+    try:
+        return float(v)
+    except (TypeError, ValueError):
+        return None
+
+def _rate(v: Optional[str]) -> Optional[float]:
+    """ffprobe frame rates are fractions ("30000/1001")."""
+    if not v or v in {"0/0", "N/A"}:
+        return None
+    num, _, den = v.partition("/")
+    n, d = _float(num), _float(den or "1")
+    return round(n / d, 3) if n and d else None
+
+def probe(src: Source, timeout: float = 60) -> Optional[Dict[str, Any]]:
+    """
+    ffprobe the first video stream: {duration_sec, width, height, video_codec,
+    pix_fmt, fps, bitrate}. width/height are as displayed (rotation applied, as
+    ffmpeg autorotates when encoding). Returns None when ffprobe is missing
+    or can't read the source; callers treat the metadata as optional.
+    """
+    if not shutil.which("ffprobe"):
+        return None
+    cmd = [
+        "ffprobe", "-v", "error", "-print_format", "json",
+        "-select_streams", "v:0", "-show_streams", "-show_format",
+        str(src),
+    ]
+    try:
+        out = subprocess.run(cmd, capture_output=True, timeout=timeout, check=True).stdout
+        data = json.loads(out or b"{}")
+    except (subprocess.SubprocessError, OSError, ValueError):
+        return None
+    streams = data.get("streams") or []
+    if not streams:
+        return None
+    v, fmt = streams[0], data.get("format") or {}
+    width, height = int(v.get("width") or 0), int(v.get("height") or 0)
+    rotation = _float(v.get("tags", {}).get("rotate"))
+    for sd in v.get("side_data_list") or []:
+        rotation = _float(sd.get("rotation")) if "rotation" in sd else rotation
+    if rotation and int(rotation) % 180:
+        width, height = height, width
+    bitrate = _float(v.get("bit_rate")) or _float(fmt.get("bit_rate"))
+    return {
+        "duration_sec": _float(fmt.get("duration")) or _float(v.get("duration")),
+        "width": width or None,
+        "height": height or None,
+        "video_codec": v.get("codec_name"),
+        "pix_fmt": v.get("pix_fmt"),
+        "fps": _rate(v.get("avg_frame_rate")) or _rate(v.get("r_frame_rate")),
+        "bitrate": int(bitrate) if bitrate else None,
+    }
+
+def _even(x: float) -> int:
+    return max(2, int(x) // 2 * 2)  # round down: never above the box or the source
+
+def fit_ladder(
+    specs: List[Dict[str, Any]],
+    src_width: int,
+    src_height: int,
+) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """
+    Fit each rendition's width x height box to the source's aspect ratio
+    without upscaling. Rungs whose box is at or above the source collapse
+    into one: the smallest such box, clamped to the source size. Rungs that
+    would come out identical are dropped as well. Returns (kept, dropped),
+    with kept specs carrying the actual output width/height (marked
+    "fitted", so they are scaled to exactly that size).
+    """
+    kept: List[Dict[str, Any]] = []
+    dropped: List[Dict[str, Any]] = []
+    native: Optional[Dict[str, Any]] = None
+    seen = set()
+    for r in specs:
+        w, h = int(r.get("width", 1280)), int(r.get("height", 720))
+        scale = min(w / src_width, h / src_height)
+        if scale >= 1:
+            if native is None or w * h < int(native["width"]) * int(native["height"]):
+                if native is not None:
+                    dropped.append(native)
+                native = r
+            else:
+                dropped.append(r)
+            continue
+        dims = (_even(src_width * scale), _even(src_height * scale))
+        if dims in seen:
+            dropped.append(r)
+            continue
+        seen.add(dims)
+        kept.append({**r, "width": dims[0], "height": dims[1], "fitted": True})
+    if native is not None:
+        dims = (_even(src_width), _even(src_height))
+        if dims in seen:
+            dropped.append(native)
+        else:
+            kept.insert(0, {**native, "width": dims[0], "height": dims[1], "fitted": True})
+    return kept, dropped
+
+def _crf_bitrate(width: int, height: int, fps: Optional[float], crf: int) -> float:
+    """Rough bits/s x264 produces for this size at this CRF (the rung's size budget)."""
+    bpp = REMUX_BITS_PER_PIXEL_CRF23 * 2 ** ((23 - crf) / 6)
+    return bpp * width * height * (fps or 30.0)
+
+def can_remux(source: Optional[Dict[str, Any]], width: int, height: int, crf: int = 23) -> bool:
+    """
+    True when the probed source can be served as this rendition by copying
+    its video stream: H.264, 8-bit 4:2:0, already exactly width x height,
+    and with a known bitrate no more than REMUX_BITRATE_SLACK times what
+    encoding at crf would give. A heavier source is re-encoded so the rung
+    keeps the size its CRF asks for.
+    """
+    if not REMUX_FAST_PATH or not source:
+        return False
+    bitrate = source.get("bitrate")
+    if not bitrate or bitrate > REMUX_BITRATE_SLACK * _crf_bitrate(width, height, source.get("fps"), crf):
+        return False
+    if REMUX_MAX_BITRATE and bitrate > REMUX_MAX_BITRATE:
+        return False
+    return (
+        source.get("video_codec") in REMUX_CODECS
+        and source.get("pix_fmt") in REMUX_PIX_FMTS
+        and (source.get("width"), source.get("height")) == (width, height)
+    )
+
+def _scale(width: int, height: int, keep_aspect: bool = True, square_pixels: bool = True) -> str:
+    # setsar=1: square pixels, rather than a SAR that absorbs the rounding.
+    # Without it scale keeps the input's display aspect ratio exactly (a SAR
+    # like 640:639 absorbs the even-size rounding), which DASH needs: every
+    # representation in one adaptation set must share the same ratio.
+    sar = ",setsar=1" if square_pixels else ""
+    if not keep_aspect:
+        return f"scale={width}:{height}:flags=lanczos{sar}"  # already fitted to the source
+    # Fit inside the box keeping the input's aspect ratio; x264 needs even sizes
+    return f"scale={width}:{height}:force_original_aspect_ratio=decrease:force_divisible_by=2:flags=lanczos{sar}"
+
+# on_progress(rendition_name, info) - info as built by _parse_progress
+ProgressFn = Callable[[str, Dict[str, Any]], None]
+
+def _parse_progress(block: Dict[str, str], duration: Optional[float], fps: Optional[float] = None) -> Dict[str, Any]:
+    """
+    Turn one `-progress` key=value block into fps/speed/out_time/ETA. With
+    the source's fps, position is frames written / fps: `frame` counts the
+    first video output (a rendition), while out_time and speed follow the
+    slowest output, e.g. a sprite sheet that is only written at the end.
+    """
+    def _num(v: Optional[str]) -> Optional[float]:
+        try:
+            return float((v or "").rstrip("x"))
+        except ValueError:
+            return None  # "N/A" until ffmpeg has enough samples
+
+    frame = int(_num(block.get("frame")) or 0)
+    rate = _num(block.get("fps"))
+    if fps and frame:
+        out_time = frame / fps
+        speed = round(rate / fps, 3) if rate else None
+    else:
+        out_us = _num(block.get("out_time_us")) or _num(block.get("out_time_ms")) or 0.0
+        out_time = max(0.0, out_us / 1_000_000)
+        speed = _num(block.get("speed"))
+    info: Dict[str, Any] = {
+        "frame": frame,
+        "fps": rate,
+        "speed": speed,
+        "out_time": round(out_time, 2),
+        "done": block.get("progress") == "end",
+    }
+    if duration:
+        info["percent"] = 100.0 if info["done"] else round(min(100.0, 100 * out_time / duration), 1)
+        if speed:
+            info["eta"] = 0.0 if info["done"] else round(max(0.0, (duration - out_time) / speed), 1)
+    return info
+
+def _wait(p: subprocess.Popen) -> Dict[str, float]:
+    """
+    Reap ffmpeg with wait4() so we get its own rusage (CPU seconds, peak RSS)
+    rather than the running total over every child of this process.
+    """
+    try:
+        _pid, status, ru = os.wait4(p.pid, 0)
+    except (AttributeError, ChildProcessError):  # no wait4 on this platform, or already reaped
+        p.wait()
+        return {}
+    p.returncode = os.waitstatus_to_exitcode(status)
+    return {"cpu_seconds": round(ru.ru_utime + ru.ru_stime, 3), "max_rss_mb": round(ru.ru_maxrss / 1024, 1)}  # KiB on Linux
+
+class Stopped(RuntimeError):
+    """ffmpeg was killed on purpose. reason: cancelled | preempted | timeout | lease lost."""
+
+    def __init__(self, reason: str, message: Optional[str] = None):
+        super().__init__(message or reason)
+        self.reason = reason
+
+class Children:
+    """The ffmpeg processes this process is running; stop() kills them and refuses new ones until reset()."""
+
+    def __init__(self) -> None:
+        self._procs: Set[subprocess.Popen] = set()
+        self._lock = threading.Lock()
+        self.reason: Optional[str] = None
+        self.message: Optional[str] = None
+        self.timeout = 0.0  # wall seconds per rendition one ffmpeg run may take (0 = no limit)
+
+    def reset(self, timeout: float = 0.0) -> None:
+        with self._lock:
+            self.reason = self.message = None
+            self.timeout = timeout
+
+    def check(self) -> None:
+        """Raise Stopped if stop() has been called since the last reset()."""
+        if self.reason:
+            raise Stopped(self.reason, self.message)
+
+    def stop(self, reason: str, message: Optional[str] = None) -> None:
+        with self._lock:
+            if self.reason is None:
+                self.reason, self.message = reason, message
+            for p in self._procs:
+                _killpg(p)
+
+    def _add(self, p: subprocess.Popen) -> None:
+        with self._lock:
+            self._procs.add(p)
+            if self.reason:  # stop() ran while this one was starting
+                _killpg(p)
+
+    def _discard(self, p: subprocess.Popen) -> None:
+        # Before the child is reaped, so its pid (= process group) can't be reused under a kill
+        with self._lock:
+            self._procs.discard(p)
+
+def _killpg(p: subprocess.Popen) -> None:
+    try:
+        os.killpg(p.pid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        pass
+
+CHILDREN = Children()
+
+def _run(
+    cmd: List[str],
+    stdin: Optional[Iterable[bytes]] = None,
+    on_progress: Optional[Callable[[Dict[str, Any]], None]] = None,
+    duration: Optional[float] = None,
+    op: str = "encode",
+    renditions: int = 1,
+    fps: Optional[float] = None,
+) -> Tuple[int, str, Dict[str, float]]:
+    """
+    Run ffmpeg and return (returncode, stderr, usage). Optionally feed stdin
+    from a chunk iterator, and/or stream `-progress` updates to on_progress
+    as the encode runs instead of learning nothing until exit (fps: the
+    source's, see _parse_progress). usage is the
+    child's {cpu_seconds, max_rss_mb}; it is also exported as metrics under
+    op (encode, remux, split, concat, package).
+
+    The child is tracked in CHILDREN: raises Stopped if it was killed by
+    CHILDREN.stop(). A run that outlives CHILDREN.timeout x renditions (the
+    number of renditions this one process writes) stops the whole transcode:
+    its sibling encodes would only be thrown away.
+    """
+    CHILDREN.check()
+    if on_progress is not None:
+        cmd = [cmd[0], "-progress", "pipe:1", "-nostats", *cmd[1:]]
+    p = subprocess.Popen(
+        cmd,
+        stdin=subprocess.PIPE if stdin is not None else subprocess.DEVNULL,
+        stdout=subprocess.PIPE if on_progress is not None else subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        start_new_session=True,  # own process group: killable as a unit
+    )
+    CHILDREN._add(p)
+    limit = CHILDREN.timeout * max(1, renditions)
+    timer: Optional[threading.Timer] = None
+    if limit > 0:
+        timer = threading.Timer(limit, CHILDREN.stop, ("timeout", f"ffmpeg {op} ran past its {limit:g}s limit"))
+        timer.daemon = True
+        timer.start()
+    threads: List[threading.Thread] = []
+
+    def _feed() -> None:
+        try:
+            for chunk in stdin:  # type: ignore[union-attr]
+                p.stdin.write(chunk)  # type: ignore[union-attr]
+        except (BrokenPipeError, OSError):
+            pass  # ffmpeg exited early; its stderr says why
+        finally:
+            try:
+                p.stdin.close()  # type: ignore[union-attr]
+            except OSError:
+                pass
+
+    errs: List[bytes] = []
+
+    def _drain_stderr() -> None:
+        errs.append(p.stderr.read())  # type: ignore[union-attr]
+
+    if stdin is not None:
+        threads.append(threading.Thread(target=_feed, daemon=True))
+    threads.append(threading.Thread(target=_drain_stderr, daemon=True))
+    for t in threads:
+        t.start()
+
+    if on_progress is not None:
+        block: Dict[str, str] = {}
+        for raw in p.stdout:  # type: ignore[union-attr]
+            key, _, value = raw.decode("utf-8", "replace").strip().partition("=")
+            block[key] = value
+            if key == "progress":  # last key of each block
+                try:
+                    on_progress(_parse_progress(block, duration, fps))
+                except Exception:
+                    pass  # progress reporting must never break the encode
+                block = {}
+
+    try:
+        os.waitid(os.P_PID, p.pid, os.WEXITED | os.WNOWAIT)  # exited, not yet reaped
+    except (AttributeError, ChildProcessError):
+        pass
+    CHILDREN._discard(p)
+    if timer:
+        timer.cancel()
+    usage = _wait(p)
+    for t in threads:
+        t.join()
+    if p.stdout:
+        p.stdout.close()
+    p.stderr.close()  # type: ignore[union-attr]
+
+    outcome = "stopped" if CHILDREN.reason else "ok" if p.returncode == 0 else "error"
+    metrics.inc("transcoder_ffmpeg_runs_total", op=op, outcome=outcome)
+    if usage:
+        metrics.inc("transcoder_ffmpeg_cpu_seconds_total", usage["cpu_seconds"], op=op)
+        metrics.observe("transcoder_ffmpeg_max_rss_bytes", usage["max_rss_mb"] * 1024 * 1024, op=op)
+    CHILDREN.check()
+    return p.returncode, b"".join(errs).decode("utf-8", "replace"), usage
 
 def _one(
-    in_path: Path,
+    in_path: Source,
     out_path: Path,
     width: int,
     height: int,
     crf: int,
     intensity: str,
+    cores: Optional[int] = None,
+    on_progress: Optional[ProgressFn] = None,
+    duration: Optional[float] = None,
+    keep_aspect: bool = True,
+    thumbs: Optional[_Thumbs] = None,
+    fps: Optional[float] = None,
 ) -> dict:
-    """Run a single ffmpeg transcode and return result dict."""
-    if not in_path.exists() or not in_path.is_file():
-        raise FileNotFoundError(f"Input not found: {in_path}")
+    """
+    Run a single ffmpeg transcode and return result dict. With thumbs, the
+    same process also writes the thumbnail outputs (under "thumbnails").
+    """
+    _check_input(in_path)
 
     out_path.parent.mkdir(parents=True, exist_ok=True)
 
-    scale = f"scale={width}:{height}:flags=lanczos"
-    extra = _args_for_intensity(intensity)
+    scale = _scale(width, height, keep_aspect)
+    budget = get_budget()
+
+    # Wait for cores in the shared budget; run with exactly that many threads
+    with budget.slot(cores or budget.threads_for(width, height, intensity)) as threads:
+        extra = _args_for_intensity(intensity, threads)
+
+        video = ["-filter_complex", thumbs.graph(f"[0:v]{scale}[v0]"), "-map", "[v0]"] if thumbs else ["-vf", scale]
+        cmd = [
+            "ffmpeg", "-y", "-hide_banner", "-loglevel", "error",
+            "-i", str(in_path),
+            *video,
+            *extra,
+            "-crf", str(crf),
+            "-pix_fmt", "yuv420p",
+            "-movflags", "+faststart",
+            "-an",  # drop audio to keep CPU on video; remove to encode audio too
+            str(out_path),
+            *(thumbs.args() if thumbs else []),
+        ]
+
+        report = (lambda info: on_progress(out_path.name, info)) if on_progress else None
+        t0 = time.time()
+        returncode, stderr, usage = _run(cmd, on_progress=report, duration=duration, fps=fps)
+        dt = round(time.time() - t0, 2)
 
+    if returncode != 0:
+        raise RuntimeError(stderr.strip() or "ffmpeg failed")
+
+    res = {
+        "path": str(out_path),
+        "name": out_path.name,
+        "cmd": " ".join(cmd),
+        "seconds": dt,
+        "width": width,
+        "height": height,
+        "crf": crf,
+        "intensity": intensity,
+        "threads": threads,
+        **usage,
+    }
+    if thumbs:
+        res["thumbnails"] = thumbs.results(cmd, dt)
+    return res
+
+def _remux(
+    in_path: Source,
+    out_path: Path,
+    width: int,
+    height: int,
+    on_progress: Optional[ProgressFn] = None,
+    duration: Optional[float] = None,
+    fps: Optional[float] = None,
+) -> dict:
+    """
+    Fast path: copy the source's video stream into a faststart MP4 (also fixes
+    up MOV/MKV containers and moov-at-end files). No decode or encode, so
+    it takes no cores from the budget.
+    """
+    _check_input(in_path)
+    out_path.parent.mkdir(parents=True, exist_ok=True)
     cmd = [
         "ffmpeg", "-y", "-hide_banner", "-loglevel", "error",
         "-i", str(in_path),
-        "-vf", scale,
-        *extra,
-        "-crf", str(crf),
-        "-pix_fmt", "yuv420p",
+        "-map", "0:v:0",
+        "-c:v", "copy",
+        "-tag:v", "avc1",
         "-movflags", "+faststart",
-        "-an",  # drop audio to keep CPU on video; remove to encode audio too
+        "-an",  # match the encoded renditions
         str(out_path),
     ]
-
+    report = (lambda info: on_progress(out_path.name, info)) if on_progress else None
     t0 = time.time()
-    proc = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-    dt = round(time.time() - t0, 2)
-
-    if proc.returncode != 0:
-        stderr = (proc.stderr or "").strip()
-        raise RuntimeError(stderr or "ffmpeg failed")
-
+    returncode, stderr, usage = _run(cmd, on_progress=report, duration=duration, op="remux", fps=fps)
+    if returncode != 0:
+        raise RuntimeError(stderr.strip() or "ffmpeg remux failed")
     return {
         "path": str(out_path),
         "name": out_path.name,
         "cmd": " ".join(cmd),
-        "seconds": dt,
+        "seconds": round(time.time() - t0, 2),
         "width": width,
         "height": height,
-        "crf": crf,
-        "intensity": intensity,
+        "crf": None,
+        "threads": 0,
+        "fast_path": "remux",
+        **usage,
     }
 
+def _plan(stem: str, out_dir: Path, specs: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Normalize rendition specs into {width, height, crf, keep_aspect, out_path} entries."""
+    plan: List[Dict[str, Any]] = []
+    for r in specs:
+        w = int(r.get("width", 1280))
+        h = int(r.get("height", 720))
+        crf = int(r.get("crf", 23))
+        suffix = r.get("suffix", f"{w}x{h}")
+        plan.append({
+            "width": w,
+            "height": h,
+            "crf": crf,
+            "keep_aspect": not r.get("fitted"),  # box only, unless fit_ladder sized it
+            "out_path": out_dir / f"{stem}_{suffix}.mp4",
+        })
+    return plan
+
+def _filter_graph(plan: List[Dict[str, Any]], cascade: bool, square_pixels: bool = True) -> str:
+    """
+    Build a filter_complex that decodes once and exposes [v0], [v1], ...
+    (one labelled output per plan entry, in plan order). square_pixels=False
+    keeps the source's display aspect ratio on every rung instead (packaging).
+
+    Flat:    [0:v]split=N -> scale each branch from the source.
+    Cascade: scale the largest rung from the source, then each smaller rung
+             from the previous one (1080 -> 720 -> 480), so only the top rung
+             pays for a full-resolution scale.
+    """
+    n = len(plan)
+    if not cascade:
+        parts = ["[0:v]split=%d%s" % (n, "".join(f"[s{i}]" for i in range(n)))]
+        for i, p in enumerate(plan):
+            parts.append(f"[s{i}]{_scale(p['width'], p['height'], p['keep_aspect'], square_pixels)}[v{i}]")
+        return ";".join(parts)
+
+    order = sorted(range(n), key=lambda i: plan[i]["width"] * plan[i]["height"], reverse=True)
+    parts = []
+    src = "[0:v]"
+    for pos, i in enumerate(order):
+        p = plan[i]
+        last = pos == n - 1
+        scaled = f"[v{i}]" if last else f"[c{i}]"
+        parts.append(f"{src}{_scale(p['width'], p['height'], p['keep_aspect'], square_pixels)}{scaled}")
+        if not last:
+            parts.append(f"[c{i}]split=2[v{i}][n{i}]")
+            src = f"[n{i}]"
+    return ";".join(parts)
+
+def thumbnail_options(opts: Any) -> Optional[Dict[str, Any]]:
+    """
+    Normalize the thumbnails stage options (True for defaults, or a dict of
+    poster: jpg|webp|None, poster_at, sprite: bool, interval, width, columns,
+    rows). Returns None when nothing is requested; ValueError if invalid.
+    """
+    if not opts:
+        return None
+    if opts is True:
+        opts = {}
+    if not isinstance(opts, dict):
+        raise ValueError("thumbnails must be true or an object")
+    poster = opts.get("poster", "jpg") or None
+    if poster is not None and poster not in POSTER_FORMATS:
+        raise ValueError(f"thumbnails.poster must be one of {sorted(POSTER_FORMATS)} or null")
+    try:
+        out = {
+            "poster": poster,
+            "poster_at": float(opts["poster_at"]) if opts.get("poster_at") is not None else None,
+            "sprite": bool(opts.get("sprite", True)),
+            "interval": float(opts.get("interval", THUMB_INTERVAL)),
+            "width": _even(int(opts.get("width", THUMB_WIDTH))),
+            "columns": int(opts.get("columns", SPRITE_COLUMNS)),
+            "rows": int(opts.get("rows", SPRITE_ROWS)),
+        }
+    except (TypeError, ValueError):
+        raise ValueError("thumbnails options must be numbers")
+    if out["interval"] <= 0 or not 16 <= out["width"] <= 1920 or not (1 <= out["columns"] <= 50 and 1 <= out["rows"] <= 50):
+        raise ValueError("thumbnails: interval > 0, width 16-1920, columns/rows 1-50")
+    if not poster and not out["sprite"]:
+        return None
+    return out
+
+def _vtt_time(t: float) -> str:
+    ms = int(round(t * 1000))
+    return f"{ms // 3_600_000:02d}:{ms // 60_000 % 60:02d}:{ms // 1000 % 60:02d}.{ms % 1000:03d}"
+
+class _Thumbs:
+    """Poster / sprite outputs fed from an ffmpeg that is already decoding the source."""
+
+    def __init__(
+        self,
+        opts: Dict[str, Any],
+        out_dir: Path,
+        stem: str,
+        duration: Optional[float],
+        source: Optional[Dict[str, Any]],
+    ):
+        self.opts = opts
+        self.out_dir = out_dir
+        self.stem = stem
+        self.duration = duration
+        w = opts["width"]
+        sw, sh = (source or {}).get("width"), (source or {}).get("height")
+        self.tile = (w, _even(w * sh / sw) if sw and sh else _even(w * 9 / 16))
+        at = opts["poster_at"] if opts["poster_at"] is not None else (duration or 0) * 0.1
+        # A start past the end would leave the poster output without a frame
+        self.poster_at = max(0.0, min(at, duration - 0.5)) if duration else max(0.0, at)
+        self.poster = out_dir / f"{stem}_poster.{opts['poster']}" if opts["poster"] else None
+        self.sprite_pattern = f"{stem}_sprite_%03d.jpg"
+
+    def branches(self) -> int:
+        return int(self.poster is not None) + int(self.opts["sprite"])
+
+    def graph(self, renditions: str = "") -> str:
+        """Wrap a rendition graph that reads [0:v] so it shares the decode with the thumbnail branches."""
+        k = self.branches()
+        main = "[src]" if renditions else ""
+        parts = [f"[0:v]split={k + int(bool(renditions))}{main}" + "".join(f"[t{i}]" for i in range(k))]
+        if renditions:
+            parts.append(renditions.replace("[0:v]", "[src]", 1))
+        i = 0
+        if self.poster is not None:
+            parts.append(f"[t{i}]trim=start={self.poster_at:.3f},setpts=PTS-STARTPTS,"
+                         f"scale='min({POSTER_MAX_WIDTH},iw)':-2,setsar=1[tp]")
+            i += 1
+        if self.opts["sprite"]:
+            w, h = self.tile
+            # eof_action=pass: a source shorter than one interval still gets its first tile
+            parts.append(f"[t{i}]fps=1/{self.opts['interval']:g}:eof_action=pass,"
+                         f"scale={w}:{h}:force_original_aspect_ratio=decrease,pad={w}:{h}:(ow-iw)/2:(oh-ih)/2,"
+                         f"setsar=1,tile={self.opts['columns']}x{self.opts['rows']}[ts]")
+        return ";".join(parts)
+
+    def args(self) -> List[str]:
+        out: List[str] = []
+        if self.poster is not None:
+            codec = ["-c:v", "libwebp", "-quality", "80"] if self.opts["poster"] == "webp" else ["-c:v", "mjpeg", "-q:v", "3"]
+            out += ["-map", "[tp]", "-frames:v", "1", *codec, str(self.poster)]
+        if self.opts["sprite"]:
+            out += ["-map", "[ts]", "-c:v", "mjpeg", "-q:v", "5", "-f", "image2", "-start_number", "1",
+                    str(self.out_dir / self.sprite_pattern)]
+        return out
+
+    def results(self, cmd: List[str], seconds: float) -> List[dict]:
+        """Describe what ffmpeg wrote (and write the VTT track over the sprite sheets)."""
+        base = {"cmd": " ".join(cmd), "seconds": seconds}
+        results: List[dict] = []
+        if self.poster is not None and self.poster.exists():
+            results.append({**base, "path": str(self.poster), "name": self.poster.name, "kind": "poster"})
+        if not self.opts["sprite"]:
+            return results
+        sheets = sorted(self.out_dir.glob(self.sprite_pattern.replace("%03d", "[0-9][0-9][0-9]")))
+        for p in sheets:
+            results.append({**base, "path": str(p), "name": p.name, "kind": "sprite"})
+        if sheets:
+            vtt = self._write_vtt(sheets)
+            results.append({**base, "path": str(vtt), "name": vtt.name, "kind": "thumbnails"})
+        return results
+
+    def _write_vtt(self, sheets: List[Path]) -> Path:
+        cols, rows, step = self.opts["columns"], self.opts["rows"], self.opts["interval"]
+        (w, h), per_sheet = self.tile, cols * rows
+        n = math.ceil(self.duration / step) if self.duration else len(sheets) * per_sheet
+        lines = ["WEBVTT", ""]
+        for i in range(min(n, len(sheets) * per_sheet)):
+            sheet, cell = divmod(i, per_sheet)
+            end = (i + 1) * step if not self.duration else min((i + 1) * step, self.duration)
+            lines += [
+                f"{_vtt_time(i * step)} --> {_vtt_time(end)}",
+                f"{sheets[sheet].name}#xywh={cell % cols * w},{cell // cols * h},{w},{h}",
+                "",
+            ]
+        vtt = self.out_dir / f"{self.stem}_thumbnails.vtt"
+        vtt.write_text("\n".join(lines))
+        return vtt
+
+def _thumbnails(in_path: Source, thumbs: _Thumbs) -> List[dict]:
+    """The thumbnails stage on its own, for when no encode is decoding the source (all rungs remuxed, segmented)."""
+    _check_input(in_path)
+    with get_budget().slot(1):
+        cmd = [
+            "ffmpeg", "-y", "-hide_banner", "-loglevel", "error",
+            "-i", str(in_path),
+            "-filter_complex", thumbs.graph(),
+            *thumbs.args(),
+        ]
+        t0 = time.time()
+        returncode, stderr, usage = _run(cmd, op="thumbnails")
+    if returncode != 0:
+        raise RuntimeError(stderr.strip() or "ffmpeg thumbnails failed")
+    return [{**r, **usage} for r in thumbs.results(cmd, round(time.time() - t0, 2))]
+
+def _multi(
+    in_path: Source,
+    plan: List[Dict[str, Any]],
+    intensity: str,
+    cascade: bool = False,
+    on_result: Optional[Callable[[dict], None]] = None,
+    stdin: Optional[Iterable[bytes]] = None,
+    on_progress: Optional[ProgressFn] = None,
+    duration: Optional[float] = None,
+    thumbs: Optional[_Thumbs] = None,
+    fps: Optional[float] = None,
+) -> List[dict]:
+    """Decode the input once and encode every rendition (and any thumbnails) from one ffmpeg process."""
+    if stdin is not None:
+        in_path = "pipe:0"
+    _check_input(in_path)
+
+    # One process encodes every rung: ask for their combined cores, then
+    # split whatever is granted across the encoders proportionally.
+    budget = get_budget()
+    want = [budget.threads_for(p["width"], p["height"], intensity) for p in plan]
+    with budget.slot(sum(want)) as granted:
+        for p, w in zip(plan, want):
+            p["threads"] = max(1, w * granted // sum(want))
+
+        graph = _filter_graph(plan, cascade) if plan else ""  # no rungs: a piped source for thumbnails only
+        cmd = [
+            "ffmpeg", "-y", "-hide_banner", "-loglevel", "error",
+            "-i", str(in_path),
+            "-filter_complex", thumbs.graph(graph) if thumbs else graph,
+        ]
+        for i, p in enumerate(plan):
+            p["out_path"].parent.mkdir(parents=True, exist_ok=True)
+            cmd += [
+                "-map", f"[v{i}]",
+                *_args_for_intensity(intensity, p["threads"]),
+                "-crf", str(p["crf"]),
+                "-pix_fmt", "yuv420p",
+                "-movflags", "+faststart",
+                "-an",
+                str(p["out_path"]),
+            ]
+        if thumbs:
+            cmd += thumbs.args()
+
+        def report(info: Dict[str, Any]) -> None:
+            # One process, one clock: every rung is at the same position
+            for p in plan:
+                on_progress(p["out_path"].name, info)  # type: ignore[misc]
+
+        t0 = time.time()
+        returncode, stderr, usage = _run(cmd, stdin=stdin, on_progress=report if on_progress else None,
+                                         duration=duration, renditions=len(plan), fps=fps)
+        dt = round(time.time() - t0, 2)
+
+    if returncode != 0:
+        raise RuntimeError(stderr.strip() or "ffmpeg failed")
+
+    # One process produced every rung, so they share the wall-clock time.
+    results = [
+        {
+            "path": str(p["out_path"]),
+            "name": p["out_path"].name,
+            "cmd": " ".join(cmd),
+            "seconds": dt,
+            "width": p["width"],
+            "height": p["height"],
+            "crf": p["crf"],
+            "intensity": intensity,
+            "threads": p["threads"],
+            "shared_decode": True,
+            **usage,  # of the one process, not this rung alone
+        }
+        for p in plan
+    ]
+    if thumbs:
+        results += thumbs.results(cmd, dt)
+    if on_result:
+        for r in results:
+            on_result(r)
+    return results
+
+def _split(in_path: Source, work_dir: Path, seconds: float) -> List[Path]:
+    """Cut the video stream at keyframes into ~`seconds` chunks, without re-encoding."""
+    _check_input(in_path)
+    cmd = [
+        "ffmpeg", "-y", "-hide_banner", "-loglevel", "error",
+        "-i", str(in_path),
+        "-map", "0:v:0", "-c", "copy", "-an",
+        "-f", "segment", "-segment_time", str(seconds),
+        "-reset_timestamps", "1", "-segment_format", "matroska",
+        str(work_dir / "src_%05d.mkv"),
+    ]
+    returncode, stderr, _usage = _run(cmd, op="split")
+    if returncode != 0:
+        raise RuntimeError(stderr.strip() or "ffmpeg segment split failed")
+    return sorted(work_dir.glob("src_*.mkv"))
+
+def _concat(parts: List[Path], out_path: Path) -> None:
+    """Join encoded chunks losslessly (stream copy) into a faststart MP4."""
+    listing = out_path.with_suffix(".txt")
+    listing.write_text("".join(f"file '{p.as_posix()}'\n" for p in parts))
+    cmd = [
+        "ffmpeg", "-y", "-hide_banner", "-loglevel", "error",
+        "-f", "concat", "-safe", "0", "-i", str(listing),
+        "-c", "copy",
+        "-movflags", "+faststart",
+        str(out_path),
+    ]
+    returncode, stderr, _usage = _run(cmd, op="concat")
+    listing.unlink(missing_ok=True)
+    if returncode != 0:
+        raise RuntimeError(stderr.strip() or "ffmpeg concat failed")
+
+def _segmented(
+    in_path: Source,
+    plan: List[Dict[str, Any]],
+    intensity: str,
+    on_result: Optional[Callable[[dict], None]] = None,
+    seconds: float = SEGMENT_SECONDS,
+    on_progress: Optional[ProgressFn] = None,
+) -> List[dict]:
+    """
+    Split once at keyframes, encode every (rendition, chunk) pair as its own
+    ffmpeg process in parallel (bounded by the CPU budget), then concat each
+    rendition's chunks. Lets one long source use the whole machine even at
+    slow presets, where a single x264 process stops scaling.
+    """
+    work = Path(tempfile.mkdtemp(prefix="seg_", dir=plan[0]["out_path"].parent))
+    try:
+        t0 = time.time()
+        chunks = _split(in_path, work, seconds)
+        if not chunks:
+            raise RuntimeError("ffmpeg produced no segments")
+
+        pending = {i: len(chunks) for i in range(len(plan))}
+        parts = {i: [work / f"r{i}_{j:05d}.mp4" for j in range(len(chunks))] for i in range(len(plan))}
+        results: List[Optional[dict]] = [None] * len(plan)
+        cpu = {i: 0.0 for i in range(len(plan))}  # summed over the rendition's chunk encodes
+        rss = {i: 0.0 for i in range(len(plan))}
+
+        budget = get_budget()
+        with ThreadPoolExecutor(max_workers=max(1, budget.total)) as ex:
+            futures = {
+                ex.submit(_one, c, parts[i][j], p["width"], p["height"], p["crf"], intensity, SEGMENT_THREADS,
+                          keep_aspect=p["keep_aspect"]): i
+                for i, p in enumerate(plan)
+                for j, c in enumerate(chunks)
+            }
+            for fut in as_completed(futures):
+                part = fut.result()
+                i = futures[fut]
+                pending[i] -= 1
+                cpu[i] += part.get("cpu_seconds", 0.0)
+                rss[i] = max(rss[i], part.get("max_rss_mb", 0.0))
+                p = plan[i]
+                if on_progress:
+                    done = len(chunks) - pending[i]
+                    elapsed = time.time() - t0
+                    on_progress(p["out_path"].name, {
+                        "segments_done": done,
+                        "segments": len(chunks),
+                        "percent": round(100 * done / len(chunks), 1),
+                        "eta": round(elapsed / done * pending[i], 1),
+                        "done": not pending[i],
+                    })
+                if pending[i]:
+                    continue
+                _concat(parts[i], p["out_path"])
+                res = {
+                    "path": str(p["out_path"]),
+                    "name": p["out_path"].name,
+                    "cmd": f"segmented x{len(chunks)} ({seconds}s chunks)",
+                    "seconds": round(time.time() - t0, 2),
+                    "width": p["width"],
+                    "height": p["height"],
+                    "crf": p["crf"],
+                    "intensity": intensity,
+                    "segments": len(chunks),
+                    "cpu_seconds": round(cpu[i], 3),
+                    "max_rss_mb": rss[i],
+                }
+                results[i] = res
+                if on_result:
+                    on_result(res)
+        return [r for r in results if r]
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+
 def transcode(
-    in_path: Path,
+    in_path: Source,
     out_dir: Path,
     specs: List[Dict[str, Any]],
     intensity: str = "high",
+    mode: str = "parallel",
+    on_result: Optional[Callable[[dict], None]] = None,
+    stdin: Optional[Iterable[bytes]] = None,
+    name: Optional[str] = None,
+    on_progress: Optional[ProgressFn] = None,
+    duration: Optional[float] = None,
+    source: Optional[Dict[str, Any]] = None,
+    thumbnails: Any = None,
 ) -> List[dict]:
     """
     specs: list like [{"width":1920,"height":1080,"crf":24,"suffix":"1080p"}, ...]
+    mode:  "parallel" - one ffmpeg per rendition (each decodes the source)
+           "single"   - decode once, split/scale to every rendition in one ffmpeg
+           "cascade"  - like "single", but each rung is scaled from the next larger one
+           "segmented" - split at keyframes, encode chunks in parallel, concat losslessly
+    on_result: called with each result dict as soon as that rendition is written
+    in_path:   a local file, or a URL ffmpeg can range-read (e.g. a presigned GET)
+    stdin:     byte chunks piped into ffmpeg instead of reading in_path
+               (single/cascade only, since one stream can feed only one process)
+    name:      output file stem; defaults to the input's stem
+    on_progress: called as on_progress(output_name, info) while encoding, with
+               fps/speed/out_time (and percent/eta when `duration` is known)
+    source:    probe() data for the input (its fps also times progress);
+               rungs it already matches, at no more than the bitrate their
+               CRF calls for (see can_remux), are stream-copied instead of
+               encoded and their result carries "fast_path": "remux"
+    thumbnails: True or options (see thumbnail_options) to also write a
+               poster, sprite sheets and a WebVTT track; they ride on an
+               encode's decode (single/cascade: the one process; parallel:
+               the smallest rung's) and come back as extra results with
+               "kind": "poster" | "sprite" | "thumbnails". Segmented jobs, and
+               jobs where every rung was remuxed, run them as their own pass.
     Returns: list of {"path": str, "name": str, "cmd": str, "seconds": float, ...}
     """
     out_dir.mkdir(parents=True, exist_ok=True)
-    results: List[dict] = []
+    stem = name or Path(str(in_path).split("?", 1)[0]).stem
+    plan = _plan(stem, out_dir, specs)
+    topts = thumbnail_options(thumbnails)
+    if not plan and not topts:
+        return []
+    if mode not in {"parallel", "single", "cascade", "segmented"}:
+        raise ValueError(f"Unknown transcode mode: {mode}")
+    if stdin is not None and mode not in {"single", "cascade"}:
+        raise ValueError("Piped input needs mode 'single' or 'cascade'")
+    thumbs = _Thumbs(topts, out_dir, stem, duration, source) if topts else None
+    fps = (source or {}).get("fps")
+
+    def _emit(results: List[dict]) -> List[dict]:
+        if on_result:
+            for r in results:
+                on_result(r)
+        return results
+
+    # Rungs the source already is: remux them, encode the rest (a pipe can only be read once)
+    copied: List[dict] = []
+    if stdin is None:
+        for p in [p for p in plan if can_remux(source, p["width"], p["height"], p["crf"])]:
+            res = _remux(in_path, p["out_path"], p["width"], p["height"], on_progress=on_progress, duration=duration,
+                         fps=fps)
+            if on_result:
+                on_result(res)
+            copied.append(res)
+            plan.remove(p)
+        if not plan:
+            return copied + (_emit(_thumbnails(in_path, thumbs)) if thumbs else [])
+
+    if mode in {"single", "cascade"}:
+        return copied + _multi(in_path, plan, intensity, cascade=(mode == "cascade"), on_result=on_result,
+                               stdin=stdin, on_progress=on_progress, duration=duration, thumbs=thumbs,
+                               fps=fps)
+    if mode == "segmented":
+        # Chunks never see the whole source, so thumbnails decode it alongside them
+        with ThreadPoolExecutor(max_workers=1) as ex:
+            extra = ex.submit(_thumbnails, in_path, thumbs) if thumbs else None
+            encoded = _segmented(in_path, plan, intensity, on_result=on_result, on_progress=on_progress)
+            return copied + encoded + (_emit(extra.result()) if extra else [])
+
+    results: List[dict] = copied
     futures = []
+    smallest = min(plan, key=lambda p: p["width"] * p["height"])
 
     max_workers = min(8, os.cpu_count() or 2)
     with ThreadPoolExecutor(max_workers=max_workers) as ex:
-        for r in specs:
-            w = int(r.get("width", 1280))
-            h = int(r.get("height", 720))
-            crf = int(r.get("crf", 23))
-            suffix = r.get("suffix", f"{w}x{h}")
-            out_path = out_dir / f"{in_path.stem}_{suffix}.mp4"
-            futures.append(ex.submit(_one, in_path, out_path, w, h, crf, intensity))
+        for p in plan:
+            futures.append(ex.submit(_one, in_path, p["out_path"], p["width"], p["height"], p["crf"], intensity,
+                                     on_progress=on_progress, duration=duration, keep_aspect=p["keep_aspect"],
+                                     thumbs=thumbs if p is smallest else None, fps=fps))
 
         for fut in as_completed(futures):
-            results.append(fut.result())
+            res = fut.result()
+            extra = res.pop("thumbnails", [])
+            results += _emit([res, *extra])
 
     return results
+
+def package(
+    in_path: Source,
+    out_dir: Path,
+    specs: List[Dict[str, Any]],
+    intensity: str = "high",
+    packaging: str = "cmaf",
+    segment_seconds: int = STREAM_SEGMENT_SECONDS,
+    stdin: Optional[Iterable[bytes]] = None,
+    on_progress: Optional[ProgressFn] = None,
+    duration: Optional[float] = None,
+) -> Dict[str, Any]:
+    """
+    Adaptive-streaming ladder: decode once, scale to every rung and write
+    CMAF (fMP4) segments into out_dir. Both manifests reference the same
+    segments: manifest.mpd (DASH) and master.m3u8 with media_<n>.m3u8
+    variants (HLS). Keyframes are forced every segment_seconds with scenecut
+    disabled, so segment boundaries line up across rungs and players can
+    switch at any boundary.
+
+    packaging: "hls" | "dash" | "cmaf" - picks which manifest(s) are reported.
+    Returns {"dir", "manifests": {"hls": path, "dash": path}, "seconds", "renditions"}.
+    """
+    if packaging not in PACKAGINGS:
+        raise ValueError(f"Unknown packaging: {packaging}")
+    if stdin is not None:
+        in_path = "pipe:0"
+    _check_input(in_path)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    plan = _plan("stream", out_dir, specs)
+    if not plan:
+        raise ValueError("No renditions to package")
+
+    budget = get_budget()
+    want = [budget.threads_for(p["width"], p["height"], intensity) for p in plan]
+    with budget.slot(sum(want)) as granted:
+        cmd = [
+            "ffmpeg", "-y", "-hide_banner", "-loglevel", "error",
+            "-i", str(in_path),
+            # one adaptation set, so rungs keep the source's display aspect ratio (see _scale)
+            "-filter_complex", _filter_graph(plan, cascade=False, square_pixels=False),
+        ]
+        for i in range(len(plan)):
+            cmd += ["-map", f"[v{i}]"]
+        cmd += _args_for_intensity(intensity)
+        for i, (p, w) in enumerate(zip(plan, want)):
+            # per-stream overrides of the shared encoder args
+            cmd += [f"-threads:v:{i}", str(max(1, w * granted // sum(want))), f"-crf:v:{i}", str(p["crf"])]
+        cmd += [
+            "-pix_fmt", "yuv420p",
+            "-force_key_frames", f"expr:gte(t,n_forced*{segment_seconds})",
+            "-sc_threshold", "0",
+            "-an",
+            "-f", "dash",
+            "-seg_duration", str(segment_seconds),
+            "-use_template", "1", "-use_timeline", "0",
+            "-adaptation_sets", "id=0,streams=v",
+            "-init_seg_name", "init-$RepresentationID$.m4s",
+            "-media_seg_name", "chunk-$RepresentationID$-$Number%05d$.m4s",
+            "-hls_playlist", "1",
+            str(out_dir / "manifest.mpd"),
+        ]
+
+        def report(info: Dict[str, Any]) -> None:
+            on_progress(packaging, info)  # type: ignore[misc]
+
+        t0 = time.time()
+        returncode, stderr, usage = _run(cmd, stdin=stdin, on_progress=report if on_progress else None,
+                                         duration=duration, op="package", renditions=len(plan))
+        dt = round(time.time() - t0, 2)
+
+    if returncode != 0:
+        raise RuntimeError(stderr.strip() or "ffmpeg packaging failed")
+
+    manifests: Dict[str, str] = {}
+    if packaging in {"hls", "cmaf"}:
+        manifests["hls"] = str(out_dir / "master.m3u8")
+    if packaging in {"dash", "cmaf"}:
+        manifests["dash"] = str(out_dir / "manifest.mpd")
+    return {
+        "dir": str(out_dir),
+        "manifests": manifests,
+        "seconds": dt,
+        "cmd": " ".join(cmd),
+        **usage,
+        "renditions": [
+            {"width": p["width"], "height": p["height"], "crf": p["crf"], "playlist": f"media_{i}.m3u8"}
+            for i, p in enumerate(plan)
+        ],
+    }
+
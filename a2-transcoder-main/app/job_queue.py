@@ -0,0 +1,412 @@
+# app/job_queue.py
+"""
+Durable job queue on the `jobs` table: leased claims, stale-lease recovery,
+retries with backoff, fair-share ordering and cooperative stops.
+"""
+from __future__ import annotations
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+import logging
+import multiprocessing
+import os
+import socket
+import threading
+import time
+import uuid
+
+from sqlalchemy import func, or_, update
+from sqlalchemy.orm import Session
+
+from .models import Job
+from .state_store import write
+
+log = logging.getLogger(__name__)
+
+LEASE_SECONDS = int(os.getenv("JOB_LEASE_SECONDS", "60"))
+MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+RETRY_BACKOFF = float(os.getenv("JOB_RETRY_BACKOFF", "10"))  # seconds; doubles each attempt
+POLL_SECONDS = float(os.getenv("JOB_POLL_SECONDS", "2"))
+WORKERS = int(os.getenv("JOB_WORKERS", str(min(8, os.cpu_count() or 2))))
+CONTROL_POLL_SECONDS = float(os.getenv("JOB_CONTROL_POLL_SECONDS", "2"))  # how soon a cancel takes effect
+# Queued jobs at or above this priority may preempt lower-priority running ones (when the pool is full)
+PREEMPT_PRIORITY = int(os.getenv("JOB_PREEMPT_PRIORITY", "1"))
+FAIR_SHARE_WINDOW = float(os.getenv("FAIR_SHARE_WINDOW", "600"))  # seconds of recent starts counted as usage
+
+def _weights(spec: str) -> Dict[str, float]:
+    """FAIR_SHARE_WEIGHTS="alice=4,batch-bot=0.5"; owners not listed weigh 1."""
+    out: Dict[str, float] = {}
+    for part in filter(None, (p.strip() for p in spec.split(","))):
+        owner, _, weight = part.partition("=")
+        out[owner.strip()] = max(0.01, float(weight))
+    return out
+
+FAIR_SHARE_WEIGHTS = _weights(os.getenv("FAIR_SHARE_WEIGHTS", ""))
+
+def new_worker_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+
+def _skip_locked(db: Session) -> bool:
+    return db.get_bind().dialect.name == "postgresql"
+
+def _runnable(q, now: datetime):
+    return q.filter(Job.status == "queued").filter(or_(Job.next_attempt_at.is_(None), Job.next_attempt_at <= now))
+
+def _owners_by_share(db: Session, now: datetime) -> List[str]:
+    """Owners with runnable jobs, in claim order: top priority, then least share used, then oldest job."""
+    waiting = (
+        _runnable(db.query(Job.owner, func.max(Job.priority), func.min(Job.id)), now)
+        .group_by(Job.owner)
+        .all()
+    )
+    if len(waiting) <= 1:
+        return [owner for owner, _, _ in waiting]
+    cutoff = now - timedelta(seconds=FAIR_SHARE_WINDOW)
+    used = dict(
+        db.query(Job.owner, func.count(Job.id))
+        .filter(Job.owner.in_([owner for owner, _, _ in waiting]))
+        .filter(or_(Job.status == "running", Job.started_at >= cutoff))
+        .group_by(Job.owner)
+        .all()
+    )
+    waiting.sort(key=lambda r: (-r[1], used.get(r[0], 0) / FAIR_SHARE_WEIGHTS.get(r[0], 1.0), r[2]))
+    return [owner for owner, _, _ in waiting]
+
+def claim(db: Session, worker_id: str) -> Optional[int]:
+    """Atomically move the next runnable queued job (see module doc for the order) to running; return its id."""
+    now = datetime.utcnow()
+    locking = _skip_locked(db)
+    for owner in _owners_by_share(db, now)[:4]:  # the next owner only if every candidate was taken
+        q = _runnable(db.query(Job.id), now).filter(Job.owner == owner).order_by(Job.priority.desc(), Job.id.asc())
+        if locking:
+            candidates = q.limit(1).with_for_update(skip_locked=True).all()  # held until the commit below
+        else:
+            candidates = q.limit(4).all()  # unlocked: a lost compare-and-swap moves on to the next
+        for (job_id,) in candidates:
+            res = db.execute(
+                update(Job)
+                .where(Job.id == job_id, Job.status == "queued")
+                .values(
+                    status="running",
+                    lease_owner=worker_id,
+                    lease_expires_at=now + timedelta(seconds=LEASE_SECONDS),
+                    attempts=Job.attempts + 1,
+                    started_at=now,
+                    preempted_job_id=None,
+                )
+            )
+            db.commit()
+            if res.rowcount == 1:
+                return job_id
+    db.commit()
+    return None
+
+def heartbeat(db: Session, job_id: int, worker_id: str) -> bool:
+    """Extend our lease; False means another worker has taken the job over."""
+    res = db.execute(
+        update(Job)
+        .where(Job.id == job_id, Job.status == "running", Job.lease_owner == worker_id)
+        .values(lease_expires_at=datetime.utcnow() + timedelta(seconds=LEASE_SECONDS))
+    )
+    db.commit()
+    return res.rowcount == 1
+
+def stop_requested(db: Session, job_id: int, worker_id: str) -> Optional[str]:
+    """Why our running job should stop now: its stop_reason, "lease lost", or None to carry on."""
+    row = db.query(Job.status, Job.lease_owner, Job.stop_reason).filter(Job.id == job_id).first()
+    if not row or row.status != "running" or row.lease_owner != worker_id:
+        return "lease lost"
+    return row.stop_reason
+
+def release(db: Session, job_id: int, worker_id: str) -> None:
+    """Hand a claimed job straight back to the queue without counting the attempt."""
+    db.execute(
+        update(Job)
+        .where(Job.id == job_id, Job.status == "running", Job.lease_owner == worker_id)
+        .values(status="queued", lease_owner=None, lease_expires_at=None, attempts=Job.attempts - 1,
+                stop_reason=None)
+    )
+    db.commit()
+
+def cancel(db: Session, job_id: int) -> Optional[str]:
+    """
+    Cancel a queued job outright, or flag a running one for its worker to
+    stop. Returns the job's status afterwards (None if it doesn't exist).
+    Caller commits.
+    """
+    now = datetime.utcnow()
+    res = db.execute(
+        update(Job)
+        .where(Job.id == job_id, Job.status == "queued")
+        .values(status="cancelled", finished_at=now, next_attempt_at=None, error="cancelled")
+    )
+    if res.rowcount == 0:
+        db.execute(update(Job).where(Job.id == job_id, Job.status == "running").values(stop_reason="cancelled"))
+    return db.query(Job.status).filter(Job.id == job_id).scalar()
+
+def preempt(db: Session, worker_id: str) -> Optional[int]:
+    """
+    If a runnable queued job of at least PREEMPT_PRIORITY outranks one of
+    worker_id's running jobs, flag the lowest-priority (then most recently
+    started, so the least work is lost) of them "preempted". The urgent job
+    records its victim (preempted_job_id, set by compare-and-swap), so however
+    many dispatchers see it, it gets one victim until that one has unwound.
+    One at a time per worker, too. Returns the flagged job's id. Caller commits.
+    """
+    mine = db.query(Job.id).filter(Job.status == "running", Job.lease_owner == worker_id)
+    if mine.filter(Job.stop_reason.isnot(None)).first():
+        return None
+    unwinding = {
+        job_id for (job_id,) in
+        db.query(Job.id).filter(Job.status == "running", Job.stop_reason == "preempted")
+    }
+    for urgent in (
+        _runnable(db.query(Job.id, Job.priority, Job.preempted_job_id), datetime.utcnow())
+        .filter(Job.priority >= PREEMPT_PRIORITY)
+        .order_by(Job.priority.desc(), Job.id.asc())
+    ):
+        if urgent.preempted_job_id in unwinding:
+            continue  # room is already being made for it
+        victim = (
+            mine.filter(Job.priority < urgent.priority, Job.stop_reason.is_(None))
+            .order_by(Job.priority.asc(), Job.started_at.desc())
+            .first()
+        )
+        if victim is None:
+            return None  # nothing of ours ranks below the most urgent job left
+        taken = db.execute(
+            update(Job)
+            .where(Job.id == urgent.id, Job.status == "queued",
+                   Job.preempted_job_id.is_not_distinct_from(urgent.preempted_job_id))
+            .values(preempted_job_id=victim.id)
+        )
+        if taken.rowcount != 1:
+            return None  # another dispatcher got there first
+        res = db.execute(
+            update(Job)
+            .where(Job.id == victim.id, Job.status == "running", Job.stop_reason.is_(None))
+            .values(stop_reason="preempted")
+        )
+        if res.rowcount == 1:
+            return victim.id
+        db.execute(update(Job).where(Job.id == urgent.id).values(preempted_job_id=urgent.preempted_job_id))
+        return None
+    return None
+
+def _retry_or_fail(attempts: Optional[int], stop_reason: Optional[str], error: str) -> Dict[str, Any]:
+    """Column values ending a running attempt: requeue with backoff while attempts remain, else failed (or cancelled, if asked)."""
+    now = datetime.utcnow()
+    values: Dict[str, Any] = {"error": error, "lease_owner": None, "lease_expires_at": None, "stop_reason": None}
+    if stop_reason == "cancelled":
+        values.update(status="cancelled", finished_at=now)
+    elif (attempts or 0) < MAX_ATTEMPTS:
+        values.update(status="queued", next_attempt_at=now + timedelta(seconds=RETRY_BACKOFF * 2 ** max(0, (attempts or 1) - 1)))
+    else:
+        values.update(status="failed", finished_at=now)
+    return values
+
+def finish(db: Session, job_id: int, worker_id: str, status: str, **values: Any) -> bool:
+    """
+    Terminal transition (done/failed) as one UPDATE guarded by our lease, so
+    a worker that lost the job can't overwrite its new owner. Caller commits.
+    """
+    res = db.execute(
+        update(Job)
+        .where(Job.id == job_id, Job.status == "running", Job.lease_owner == worker_id)
+        .values(status=status, finished_at=datetime.utcnow(), lease_owner=None, lease_expires_at=None,
+                stop_reason=None, **values)
+    )
+    return res.rowcount == 1
+
+def fail_attempt(db: Session, job_id: int, worker_id: str, error: str, **values: Any) -> bool:
+    """End our attempt at a job we still hold the lease on (retry or fail), also setting values. Caller commits."""
+    mine = (Job.id == job_id, Job.status == "running", Job.lease_owner == worker_id)
+    row = db.query(Job.attempts, Job.stop_reason).filter(*mine).first()
+    if row is None:
+        return False
+    res = db.execute(update(Job).where(*mine).values(**_retry_or_fail(row.attempts, row.stop_reason, error), **values))
+    return res.rowcount == 1
+
+def recover_stale(db: Session) -> int:
+    """
+    Requeue (or fail) running jobs whose lease has expired. Each UPDATE is
+    guarded by the lease it saw, so a job renewed or reclaimed since the
+    read is left alone; on Postgres, rows another recoverer holds are skipped.
+    """
+    now = datetime.utcnow()
+    q = (
+        db.query(Job.id, Job.attempts, Job.stop_reason, Job.lease_owner, Job.lease_expires_at)
+        .filter(Job.status == "running")
+        .filter(or_(Job.lease_expires_at.is_(None), Job.lease_expires_at < now))
+    )
+    if _skip_locked(db):
+        q = q.with_for_update(skip_locked=True)
+    recovered = 0
+    for row in q.all():
+        error = f"lease expired (worker {row.lease_owner or 'unknown'})"
+        res = db.execute(
+            update(Job)
+            .where(
+                Job.id == row.id,
+                Job.status == "running",
+                Job.lease_owner.is_not_distinct_from(row.lease_owner),
+                Job.lease_expires_at.is_not_distinct_from(row.lease_expires_at),
+            )
+            .values(**_retry_or_fail(row.attempts, row.stop_reason, error))
+        )
+        recovered += res.rowcount
+    db.commit()
+    if recovered:
+        log.warning("recovered %d job(s) with expired leases", recovered)
+    return recovered
+
+class Heartbeat:
+    """
+    Background lease renewal for one running job. Every CONTROL_POLL_SECONDS
+    it also checks whether the job should stop (stop_requested(), or running
+    past `timeout` seconds) and if so calls on_stop(reason, message) once.
+    """
+
+    def __init__(
+        self,
+        job_id: int,
+        worker_id: str,
+        on_stop: Optional[Callable[[str, str], None]] = None,
+        timeout: Optional[float] = None,
+    ):
+        self.job_id = job_id
+        self.worker_id = worker_id
+        self.on_stop = on_stop
+        self.timeout = timeout
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+
+    def _loop(self) -> None:
+        started = renewed = time.monotonic()
+        stopping = self.on_stop is None
+        while not self._stop.wait(CONTROL_POLL_SECONDS if not stopping else LEASE_SECONDS / 3):
+            now = time.monotonic()
+            try:
+                if now - renewed >= LEASE_SECONDS / 3:
+                    renewed = now
+                    if not write(lambda db: heartbeat(db, self.job_id, self.worker_id)):
+                        log.warning("job %s: lease lost", self.job_id)
+                if stopping:
+                    continue
+                reason = write(lambda db: stop_requested(db, self.job_id, self.worker_id))
+                message = reason or ""
+                if not reason and self.timeout and now - started > self.timeout:
+                    reason, message = "timeout", f"job ran past its {self.timeout:g}s limit"
+                if reason:
+                    log.info("job %s: stopping (%s)", self.job_id, message)
+                    stopping = True
+                    self.on_stop(reason, message)  # type: ignore[misc]
+            except Exception:
+                log.exception("job %s: heartbeat failed", self.job_id)
+
+    def __enter__(self) -> "Heartbeat":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._stop.set()
+        self._thread.join()
+
+class Dispatcher:
+    """Claims queued jobs and runs them in a process pool."""
+
+    def __init__(
+        self,
+        run: Callable[[int, str], None],
+        max_workers: int = WORKERS,
+        initializer: Optional[Callable[..., None]] = None,
+        initargs: Union[Tuple[Any, ...], Callable[[], Tuple[Any, ...]]] = (),
+    ):
+        self.run = run
+        self.max_workers = max_workers
+        self.initializer = initializer
+        self.initargs = initargs
+        self.worker_id = new_worker_id()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._slots = threading.BoundedSemaphore(max_workers)
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._thread: Optional[threading.Thread] = None
+
+    def _new_pool(self) -> ProcessPoolExecutor:
+        # spawn: don't fork the API's threads, sockets and DB connections.
+        # A callable initargs is called per pool, for state that dies with the old one.
+        return ProcessPoolExecutor(
+            max_workers=self.max_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=self.initializer,
+            initargs=self.initargs() if callable(self.initargs) else self.initargs,
+        )
+
+    def start(self) -> None:
+        if self._thread:
+            return
+        self._pool = self._new_pool()
+        self._thread = threading.Thread(target=self._loop, name="job-dispatcher", daemon=True)
+        self._thread.start()
+
+    def stop(self, drain: bool = False) -> None:
+        """Stop claiming. drain=True waits for running jobs to finish; otherwise they are left to lease recovery."""
+        self._stop.set()
+        self._wake.set()
+        if self._thread:
+            self._thread.join()
+        if self._pool:
+            # Without draining, running jobs keep their lease and are recovered once it lapses
+            self._pool.shutdown(wait=drain, cancel_futures=True)
+
+    def wake(self) -> None:
+        """Called after enqueueing so the job starts without waiting for the next poll."""
+        self._wake.set()
+
+    def _done(self, fut: Future, pool: ProcessPoolExecutor) -> None:
+        self._slots.release()
+        if fut.cancelled():
+            return
+        exc = fut.exception()
+        if isinstance(exc, BrokenProcessPool):
+            # Its jobs' leases lapse and recover_stale() requeues them
+            if pool is self._pool and not self._stop.is_set():
+                log.error("worker process died; recreating pool")
+                self._pool = self._new_pool()
+        elif exc:
+            log.error("job runner raised: %r", exc)
+        self._wake.set()
+
+    def _loop(self) -> None:
+        while not self._stop.is_set():
+            try:
+                write(recover_stale)
+                while True:
+                    if not self._slots.acquire(blocking=False):
+                        # Pool full: make room if an urgent job is waiting behind less urgent ones
+                        victim = write(lambda db: preempt(db, self.worker_id))
+                        if victim is not None:
+                            log.info("preempting job %s for a higher-priority job", victim)
+                        break
+                    try:
+                        job_id = write(lambda db: claim(db, self.worker_id))
+                    except Exception:
+                        self._slots.release()
+                        raise
+                    if job_id is None:
+                        self._slots.release()
+                        break
+                    pool = self._pool
+                    try:
+                        fut = pool.submit(self.run, job_id, self.worker_id)  # type: ignore[union-attr]
+                    except Exception:
+                        self._slots.release()
+                        write(lambda db: release(db, job_id, self.worker_id))
+                        raise
+                    fut.add_done_callback(lambda f, pool=pool: self._done(f, pool))
+            except Exception:
+                log.exception("dispatcher loop failed")
+            self._wake.wait(POLL_SECONDS)
+            self._wake.clear()
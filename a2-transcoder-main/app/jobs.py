@@ -4,22 +4,46 @@ import json
 import os
 import shutil
 import tempfile
-from concurrent.futures import ThreadPoolExecutor
-from datetime import datetime
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, Future, wait
+from datetime import datetime, timedelta
 from pathlib import Path
-from typing import List, Dict, Any, Optional, Tuple, Iterator
+from typing import Callable, List, Dict, Any, Optional, Tuple, Iterator
 
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
+from fastapi.responses import StreamingResponse
+from sqlalchemy import func
 from sqlalchemy.orm import Session
 
 from .auth import get_current_user
-from .models import Video, Job, get_session
-from .ffmpeg_runner import transcode
-from .services.storage import get_stream, put_bytes, presign_get
+from .models import Video, Job, SessionLocal, get_session
+from .job_queue import Dispatcher, Heartbeat, cancel, fail_attempt, finish, release
+from . import metrics, scheduler, state_store
+from .state_store import UPDATES, write
+from .events import EVENTS
+from .media_response import object_response
+from .pagination import keyset_page
+from .ffmpeg_runner import transcode, package, fit_ladder, thumbnail_options, CHILDREN, PACKAGINGS, Stopped
+from .services.storage import get_stream, put_file, presign_get, local_path
+from .services import encode_stats, input_cache, media_info, result_cache
 
 
 router = APIRouter(prefix="/jobs", tags=["jobs"])
-EXECUTOR = ThreadPoolExecutor(max_workers=min(8, os.cpu_count() or 2))  # scale with CPU
+DEFAULT_MODE = os.getenv("TRANSCODE_MODE", "parallel")  # parallel|single|cascade|segmented
+TRANSCODE_MODES = {"parallel", "single", "cascade", "segmented"}
+PACKAGING_CHOICES = {"mp4"} | PACKAGINGS  # mp4 = standalone progressive files
+# How a job's input reaches ffmpeg: auto (link/input cache/URL, else copy) | cache | copy | url | pipe
+INPUT_HANDOFF = os.getenv("INPUT_HANDOFF", "auto")
+# Shared by all jobs so total concurrent output uploads stay bounded
+UPLOADER = ThreadPoolExecutor(max_workers=int(os.getenv("UPLOAD_CONCURRENCY", "4")))
+PROGRESS_INTERVAL = float(os.getenv("PROGRESS_INTERVAL", "1"))  # min seconds between progress writes
+# Wall-clock limits per attempt (0 = none); jobs may set their own timeout_seconds / rendition_timeout_seconds
+JOB_TIMEOUT = float(os.getenv("JOB_TIMEOUT_SECONDS", "0"))
+RENDITION_TIMEOUT = float(os.getenv("RENDITION_TIMEOUT_SECONDS", "0"))
+MAX_PRIORITY = 10  # priorities run -MAX_PRIORITY..MAX_PRIORITY; above 0 is admin-only
+TERMINAL_STATUSES = {"done", "failed", "cancelled"}
+BATCH_MAX_JOBS = int(os.getenv("BATCH_MAX_JOBS", "1000"))  # per POST /jobs/transcode:batch
 
 def _iso(dt: Optional[datetime]) -> Optional[str]:
     return dt.isoformat() if dt else None
@@ -44,153 +68,671 @@ def _stream_to_tempfile(key: str, suffix: str = "") -> str:
         raise
     return tmp_path
 
-def _collect_outputs_and_upload(out_dir: Path, job_id: int) -> List[Dict[str, Any]]:
+class _ProgressWriter:
+    """
+    Collects per-rendition ffmpeg progress and hands it to the process-wide
+    state_store.UPDATES buffer at most once per PROGRESS_INTERVAL (plus once
+    when a rendition ends); the buffer commits all running jobs together.
+    """
+
+    def __init__(self, job_id: int):
+        self.job_id = job_id
+        self._state: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        self._last = 0.0
+
+    def __call__(self, name: str, info: Dict[str, Any]) -> None:
+        with self._lock:
+            self._state[name] = info
+            now = time.monotonic()
+            if now - self._last < PROGRESS_INTERVAL and not info.get("done"):
+                return
+            self._last = now
+            UPDATES.put(self.job_id, progress_json=json.dumps(self._state))
+
+def _remove(path: str) -> None:
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+def _open_input(key: str, suffix: str, mode: str) -> Tuple[Any, Callable[[], None], Optional[Iterator[bytes]]]:
+    """
+    Decide how ffmpeg reads the job input without duplicating it on disk.
+    Returns (source, release, stdin_chunks):
+      - local backend: hardlink the object into a temp path (same inode, no
+        copy; survives the object being replaced) or, across filesystems,
+        read the object's path directly;
+      - remote backend: use this node's input cache (the object is fetched
+        once and pinned while the job reads it), else hand ffmpeg a
+        presigned URL it can range-read, or pipe the stream into its stdin
+        (single/cascade modes only; stdin is not seekable, so this needs a
+        streamable container such as faststart MP4, MKV or MPEG-TS);
+      - otherwise fall back to copying into a temp file.
+    The caller must call release() once ffmpeg is done with the source.
+    """
+    handoff = INPUT_HANDOFF
+    if handoff != "copy":
+        src = local_path(key)
+        if src:
+            fd, tmp_path = tempfile.mkstemp(suffix=suffix)
+            os.close(fd)
+            os.remove(tmp_path)
+            try:
+                os.link(src, tmp_path)
+                return Path(tmp_path), lambda: _remove(tmp_path), None
+            except OSError:
+                return Path(src), lambda: None, None
+        if handoff in {"auto", "cache"}:
+            pin = input_cache.acquire(key, suffix)
+            if pin:
+                return pin.path, pin.release, None
+        if handoff in {"auto", "url"}:
+            url = presign_get(key, ttl=6 * 3600)
+            if url:
+                return url, lambda: None, None
+        if handoff == "pipe" and mode in {"single", "cascade"}:
+            stream, _content_type = get_stream(key)
+            return "pipe:0", lambda: None, stream
+
+    tmp_path = _stream_to_tempfile(key, suffix=suffix)
+    return Path(tmp_path), lambda: _remove(tmp_path), None
+
+# Basic content-type guess by extension (keep simple; codecs set container)
+_CONTENT_TYPES = {
+    ".mp4": "video/mp4",
+    ".m4v": "video/mp4",
+    ".m4s": "video/iso.segment",
+    ".m3u8": "application/vnd.apple.mpegurl",
+    ".mpd": "application/dash+xml",
+    ".jpg": "image/jpeg",
+    ".jpeg": "image/jpeg",
+    ".webp": "image/webp",
+    ".vtt": "text/vtt",
+}
+
+def _upload_output(p: Path, job_id: int, rel: Optional[str] = None) -> Dict[str, Any]:
+    name = rel or p.name  # path relative to the job's output root
+    key = f"outputs/job_{job_id}/{name}"
+    content_type = _CONTENT_TYPES.get(p.suffix.lower(), "application/octet-stream")
+    size, _sha256 = put_file(key, str(p), content_type)  # chunked; never holds the whole file
+
+    url = presign_get(key, ttl=300)
+    return {
+        "key": key,        # object key in storage (e.g., S3 key)
+        "name": name,      # filename
+        "size_bytes": size,
+        "url": url,        # may be None on local-temp backend
+    }
+
+def _upload_package(out_dir: Path, job_id: int, pkg: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """
+    Upload a packaged segment tree (bounded by the shared UPLOADER pool) and
+    describe the job by its manifests rather than every segment.
+    """
+    files = [p for p in sorted(out_dir.rglob("*")) if p.is_file()]
+    futures = [UPLOADER.submit(_upload_output, p, job_id, p.relative_to(out_dir).as_posix()) for p in files]
+    uploaded = {Path(r["name"]): r for r in (f.result() for f in futures)}
+    total = sum(r["size_bytes"] for r in uploaded.values())
+
+    outputs: List[Dict[str, Any]] = []
+    for kind, path in pkg["manifests"].items():
+        m = uploaded[Path(path).relative_to(out_dir)]
+        outputs.append({
+            **m,
+            "type": kind,                      # hls | dash
+            "renditions": pkg["renditions"],
+            "files": len(files),
+            "package_bytes": total,
+        })
+    return outputs
+
+def _collect_outputs_and_upload(
+    out_dir: Path,
+    job_id: int,
+    started: Optional[Dict[str, Future]] = None,
+) -> List[Dict[str, Any]]:
     """
     Upload every file in out_dir to storage under outputs/job_<id>/.
-    Return a list of dicts describing each rendition with object keys
-    and an optional presigned URL if available.
+    `started` maps file names to uploads already submitted (e.g. as each
+    rendition finished); the rest are submitted here. Uploads run on the
+    shared UPLOADER pool. Return a list of dicts describing each rendition
+    with object keys and an optional presigned URL if available.
     """
-    results: List[Dict[str, Any]] = []
+    futures: Dict[str, Future] = dict(started or {})
     for p in sorted(out_dir.glob("*")):
-        if not p.is_file():
-            continue
-        key = f"outputs/job_{job_id}/{p.name}"
-        with p.open("rb") as f:
-            data = f.read()
-        # Basic content-type guess (keep simple; codecs set container)
-        content_type = "video/mp4" if p.suffix.lower() in {".mp4", ".m4v"} else "application/octet-stream"
-        put_bytes(key, data, content_type)
-
-        url = presign_get(key, ttl=300)
-        results.append({
-            "key": key,        # object key in storage (e.g., S3 key)
-            "name": p.name,    # filename
-            "size_bytes": p.stat().st_size,
-            "url": url,        # may be None on local-temp backend
-        })
-    return results
+        if p.is_file() and p.name not in futures:
+            futures[p.name] = UPLOADER.submit(_upload_output, p, job_id)
+    return [futures[name].result() for name in sorted(futures)]
 
-def _run_job(job_id: int) -> None:
-    """Runs inside threadpool; opens its own DB session."""
-    from .models import SessionLocal  # local import to avoid circulars
+def _rendition_timings(
+    outs: List[Dict[str, Any]],
+    duration: Optional[float],
+    mode: str,
+    intensity: str,
+) -> Dict[str, Dict[str, Any]]:
+    """Per-output timings for the job row; each is also exported as a metric."""
+    timings: Dict[str, Dict[str, Any]] = {}
+    for r in outs:
+        if r.get("kind"):
+            continue  # poster/sprite/VTT: not a rendition
+        rung = f"{r['height']}p" if r.get("height") else r["name"]
+        path = r.get("fast_path") or "encode"
+        keys = ("seconds", "intensity", "threads", "cpu_seconds", "max_rss_mb", "fast_path")
+        entry = {k: r[k] for k in keys if r.get(k) is not None}
+        metrics.observe("transcoder_encode_seconds", r["seconds"], rung=rung, mode=mode,
+                        intensity=r.get("intensity") or intensity, path=path)
+        if duration and r["seconds"]:
+            entry["realtime_factor"] = round(duration / r["seconds"], 2)
+            metrics.observe("transcoder_encode_realtime_factor", entry["realtime_factor"], rung=rung, mode=mode, path=path)
+        timings[r["name"]] = entry
+    return timings
+
+def _replan(
+    specs: List[Dict[str, Any]],
+    mode: str,
+    duration: float,
+    fps: Optional[float],
+    deadline_at: datetime,
+    slowest: str,
+    source: Optional[Dict[str, Any]],
+) -> Tuple[str, float, bool]:
+    """encode_stats.choose() against the time left now, with the latest history."""
     db = SessionLocal()
-    tmp_in: Optional[str] = None
+    try:
+        history = encode_stats.history(db)
+    finally:
+        db.close()
+    left = (deadline_at - datetime.utcnow()).total_seconds()
+    return encode_stats.choose(history, specs, mode, duration, fps, left, slowest, source)
+
+def _record_throughput(intensity: str, mode: str, work: float, seconds: float) -> None:
+    try:
+        write(lambda s: encode_stats.record(s, intensity, mode, work, seconds))
+    except Exception:
+        pass  # history is advisory; never fail the job over it
+
+def _stopped(job_id: int, worker_id: str, e: Stopped, timings: Dict[str, Any]) -> str:
+    """Settle a job whose encodes were killed on purpose; returns the metrics outcome."""
+    timings_json = json.dumps(timings)
+    if e.reason == "cancelled":
+        write(lambda s: finish(s, job_id, worker_id, "cancelled", error="cancelled", timings_json=timings_json))
+    elif e.reason == "preempted":
+        write(lambda s: release(s, job_id, worker_id))  # back in the queue; the attempt doesn't count
+    elif e.reason == "timeout":
+        # Not retried: another attempt would run into the same limit
+        write(lambda s: finish(s, job_id, worker_id, "failed", error=str(e), timings_json=timings_json))
+    # "lease lost": another worker owns the job now; leave its row alone
+    return e.reason.replace(" ", "_")
+
+def _run_job(job_id: int, worker_id: str) -> None:
+    """
+    Runs in a worker process after job_queue.claim() marked the job running
+    under worker_id's lease. Reads what it needs in one short session (so no
+    connection or read snapshot is held while ffmpeg runs) and writes each
+    state change as a single retried unit through state_store.write().
+    Phase timings are stored on the job (timings_json) and exported as metrics.
+    A cancel, preemption or timeout kills the job's ffmpeg processes
+    (ffmpeg_runner.CHILDREN) and unwinds through the same cleanup.
+    """
+    from .models import SessionLocal  # local import to avoid circulars
+    t_start = time.perf_counter()
+    timings: Dict[str, Any] = {}
+    release_input: Callable[[], None] = lambda: None
     tmp_out_dir: Optional[str] = None
+    uploads: Dict[str, Future] = {}
+    db = SessionLocal()
     try:
         job: Optional[Job] = db.get(Job, job_id)
-        if not job:
-            return
-
+        if not job or job.status != "running" or job.lease_owner != worker_id:
+            return  # lease was lost (recovered by someone else)
         video: Optional[Video] = db.get(Video, job.video_id)
+        spec_json, options_json = job.spec_json, job.options_json
+        runnable_at = job.next_attempt_at or job.queued_at  # a retry waits from when it became due
+        if job.started_at and runnable_at:
+            timings["queue_wait"] = round(max(0.0, (job.started_at - runnable_at).total_seconds()), 3)
+            metrics.observe("transcoder_job_queue_wait_seconds", timings["queue_wait"])
+        if video:
+            in_key, orig_name = video.filename, video.orig_name
+            duration, fps, content_hash = video.duration_sec, video.fps, video.content_hash
+            source = media_info.describe(video)  # lets matching rungs take the remux fast path
+    finally:
+        db.close()
+
+    try:
         if not video:
-            job.status = "failed"
-            job.error = "Video not found"
-            job.finished_at = datetime.utcnow()
-            db.commit()
+            write(lambda s: finish(s, job_id, worker_id, "failed", error="Video not found"))
+            metrics.inc("transcoder_jobs_finished_total", outcome="failed")
             return
 
-        # Mark running
-        job.status = "running"
-        job.started_at = datetime.utcnow()
-        db.commit(); db.refresh(job)
-
-        # Fetch input from storage to a temp file
-        # NOTE: video.filename stores an object key (not a local path)
-        in_key = video.filename
-        suffix = Path(video.orig_name or "").suffix or ".mp4"
         try:
-            tmp_in = _stream_to_tempfile(in_key, suffix=suffix)
-        except FileNotFoundError:
-            job.status = "failed"
-            job.error = f"Input object missing: {in_key}"
-            job.finished_at = datetime.utcnow()
-            db.commit()
+            # Parse specs (renditions)
+            specs: List[Dict[str, Any]] = json.loads(spec_json)
+
+            # Job options; older rows carried intensity on the first spec instead
+            options: Dict[str, Any] = json.loads(options_json) if options_json else {}
+            if not isinstance(specs, list) or not isinstance(options, dict):
+                raise TypeError("expected a list of renditions and an options object")
+            try:
+                intensity = options.get("intensity") or (specs[0].get("intensity") if specs and isinstance(specs, list) else None) or "high"
+            except Exception:
+                intensity = "high"
+            mode = options.get("mode") or DEFAULT_MODE
+            packaging = options.get("packaging") or "mp4"
+            # Deadline jobs re-pick their preset with the time left (queue wait included)
+            deadline_at = datetime.fromisoformat(options["deadline_at"]) if options.get("deadline_at") and duration else None
+            slowest = options.get("max_intensity") or intensity
+            rendition_timeout = float(options.get("rendition_timeout_seconds") or RENDITION_TIMEOUT)
+            job_timeout = float(options.get("timeout_seconds") or JOB_TIMEOUT) or None
+        except (ValueError, TypeError, KeyError, AttributeError) as e:
+            # A malformed row reads the same on every attempt: fail now, don't retry
+            error = f"Invalid job spec or options: {e}"
+            write(lambda s: finish(s, job_id, worker_id, "failed", error=error))
+            metrics.inc("transcoder_jobs_finished_total", outcome="failed")
             return
 
-        # Prepare a temp output directory
-        tmp_out_dir = tempfile.mkdtemp(prefix=f"job_{job.id}_")
+        CHILDREN.reset(timeout=rendition_timeout)
+        try:
+            # Hand the input to ffmpeg (link, URL or pipe where possible; copy otherwise)
+            # NOTE: video.filename stores an object key (not a local path)
+            suffix = Path(orig_name or "").suffix or ".mp4"
+            t0 = time.perf_counter()
+            try:
+                src, release_input, stdin = _open_input(in_key, suffix, mode)
+            except FileNotFoundError:
+                write(lambda s: finish(s, job_id, worker_id, "failed", error=f"Input object missing: {in_key}"))
+                metrics.inc("transcoder_jobs_finished_total", outcome="failed")
+                return
+            timings["input"] = round(time.perf_counter() - t0, 3)
 
-        # Parse specs (renditions)
-        specs: List[Dict[str, Any]] = json.loads(job.spec_json)
+            # Prepare a temp output directory
+            tmp_out_dir = tempfile.mkdtemp(prefix=f"job_{job_id}_")
 
-        # Optional intensity control (default high)
-        try:
-            payload = json.loads(job.spec_json)
-            intensity = (payload[0].get("intensity") if payload and isinstance(payload, list) else None) or "high"
-        except Exception:
-            intensity = "high"
+            # Start each rendition's upload as soon as ffmpeg has written it
+            def _upload_when_ready(res: Dict[str, Any]) -> None:
+                p = Path(res["path"])
+                uploads[p.name] = UPLOADER.submit(_upload_output, p, job_id)
 
-        # Do the transcode (paths are temp-only; will be uploaded immediately)
-        try:
-            outs = transcode(Path(tmp_in), Path(tmp_out_dir), specs, intensity=intensity)
-            # outs is expected to be a list of dicts containing at least {"path": "..."} for each rendition
-            outs_uploaded = _collect_outputs_and_upload(Path(tmp_out_dir), job.id)
+            # Do the transcode (paths are temp-only; will be uploaded immediately)
+            with Heartbeat(job_id, worker_id, on_stop=CHILDREN.stop, timeout=job_timeout):
+                t0 = time.perf_counter()
+                if packaging != "mp4":
+                    # Segmented HLS/DASH ladder; outputs point at the manifests
+                    if deadline_at:
+                        intensity = _replan(specs, packaging, duration, fps, deadline_at, slowest, None)[0]
+                    pkg = package(src, Path(tmp_out_dir) / "stream", specs, intensity=intensity,
+                                  packaging=packaging, stdin=stdin,
+                                  on_progress=_ProgressWriter(job_id), duration=duration)
+                    t1 = time.perf_counter()
+                    _record_throughput(intensity, packaging, encode_stats.encoded_work(pkg["renditions"], duration, fps), t1 - t0)
+                    outs = [{**pkg, "name": packaging, "intensity": intensity}]  # one process wrote every rung
+                    CHILDREN.check()  # stopped meanwhile: don't upload what nobody wants
+                    outs_uploaded = _upload_package(Path(tmp_out_dir), job_id, pkg)
+                else:
+                    # The ladder stays whole (single/cascade share one decode): re-pick the
+                    # preset once with the time left, and record one whole-ladder sample
+                    if deadline_at:
+                        intensity = _replan(specs, mode, duration, fps, deadline_at, slowest, source)[0]
+                    outs = transcode(src, Path(tmp_out_dir), specs, intensity=intensity, mode=mode,
+                                     on_result=_upload_when_ready, stdin=stdin, name=f"job{job_id}",
+                                     on_progress=_ProgressWriter(job_id), duration=duration, source=source,
+                                     thumbnails=options.get("thumbnails"))
+                    if duration:
+                        _record_throughput(intensity, mode, encode_stats.encoded_work(outs, duration, fps),
+                                           time.perf_counter() - t0)
+                    t1 = time.perf_counter()
+                    CHILDREN.check()
+                    # outs is expected to be a list of dicts containing at least {"path": "..."} for each rendition
+                    outs_uploaded = _collect_outputs_and_upload(Path(tmp_out_dir), job_id, started=uploads)
+                    by_name = {r["name"]: r for r in outs}
+                    for o in outs_uploaded:
+                        r = by_name.get(o["name"], {})
+                        o["fast_path"] = r.get("fast_path")  # "remux" when the encode was skipped
+                        o["remuxed"] = r.get("fast_path") == "remux"
+                        o["intensity"] = r.get("intensity")
+                        if r.get("kind"):
+                            o["kind"] = r["kind"]  # poster | sprite | thumbnails
+                timings["encode"] = round(t1 - t0, 3)
+                timings["upload"] = round(time.perf_counter() - t1, 3)  # what was left after the last encode
+            UPDATES.flush()  # final progress lands before the job reads as done
+            # Renditions of one process (single/cascade) share its CPU time; count it once
+            timings["cpu_seconds"] = round(sum({r["cmd"]: r["cpu_seconds"] for r in outs if r.get("cpu_seconds")}.values()), 3)
+            timings["renditions"] = _rendition_timings(outs, duration, packaging if packaging != "mp4" else mode, intensity)
+            timings["total"] = round(time.perf_counter() - t_start, 3)
+            if deadline_at:
+                timings["deadline_met"] = datetime.utcnow() <= deadline_at
+            # Cache only uniform-preset results, under the preset actually used
+            presets = {r["intensity"] for r in outs if r.get("intensity") and not r.get("kind")} or {intensity}
+
+            # Store only storage metadata (object keys and optional URLs);
+            # done + result-cache entry commit together
+            def _complete(s: Session) -> None:
+                if finish(s, job_id, worker_id, "done", error=None, outputs_json=json.dumps(outs_uploaded),
+                          timings_json=json.dumps(timings)) and content_hash and len(presets) == 1:
+                    key = result_cache.cache_key(content_hash, specs, next(iter(presets)), mode, packaging,
+                                                 options.get("thumbnails"))
+                    result_cache.store(s, key, content_hash, job_id, outs_uploaded)
 
-            # Store only storage metadata (object keys and optional URLs)
-            job.status = "done"
-            job.outputs_json = json.dumps(outs_uploaded)
+            write(_complete)
+            outcome = "done"
         except Exception as e:
-            job.status = "failed"
-            job.error = str(e)
-        finally:
-            job.finished_at = datetime.utcnow()
-            db.commit()
+            # Anything from opening the input on (storage/network errors included) gets an attempt's retry
+            wait(list(uploads.values()))  # let in-flight uploads finish before temp cleanup
+            timings["total"] = round(time.perf_counter() - t_start, 3)
+            if CHILDREN.reason:  # whatever raised, the job was being stopped
+                stop = e if isinstance(e, Stopped) else Stopped(CHILDREN.reason, CHILDREN.message)
+                outcome = _stopped(job_id, worker_id, stop, timings)
+            else:
+                # requeue with backoff, or fail after JOB_MAX_ATTEMPTS
+                msg = str(e)  # `e` is unbound once the except block ends; don't close over it
+                write(lambda s: fail_attempt(s, job_id, worker_id, msg, timings_json=json.dumps(timings)))
+                outcome = "error"
+        metrics.inc("transcoder_jobs_finished_total", outcome=outcome)
+        for phase in ("input", "encode", "upload", "total"):
+            if phase in timings:
+                metrics.observe("transcoder_job_phase_seconds", timings[phase], phase=phase)
     finally:
         # Cleanup temporaries
-        if tmp_in and os.path.exists(tmp_in):
-            try:
-                os.remove(tmp_in)
-            except OSError:
-                pass
+        release_input()
         if tmp_out_dir and os.path.isdir(tmp_out_dir):
             try:
                 shutil.rmtree(tmp_out_dir, ignore_errors=True)
             except OSError:
                 pass
+
+def _init_worker(
+    budget: scheduler.CoreBudget,
+    counters: state_store.Counters,
+    forwarder: metrics.Forwarder,
+) -> None:
+    """Process-pool initializer: share the parent's CPU budget, DB contention counters and metrics."""
+    scheduler.install(budget)
+    state_store.install(counters)
+    metrics.install(forwarder)
+
+def _pool_initargs() -> Tuple[scheduler.CoreBudget, state_store.Counters, metrics.Forwarder]:
+    # A fresh budget per pool: one rebuilt after a worker died starts with no cores held
+    return scheduler.reset(), state_store.get_counters(), metrics.get_forwarder()
+
+# Claims queued jobs from the DB and runs _run_job in a process pool; every
+# worker process draws encoder cores from the same shared budget, counts
+# DB contention into the same shared counters and forwards its metrics here.
+# Started by the API (unless JOB_WORKERS_IN_API=0) and by python -m app.worker.
+WORKERS_IN_API = os.getenv("JOB_WORKERS_IN_API", "1") in {"1", "true", "True"}
+DISPATCHER = Dispatcher(_run_job, initializer=_init_worker, initargs=_pool_initargs)
+
+def _queue_samples():
+    """Queue depth, running jobs and the oldest runnable job's wait, read at scrape time."""
+    db = SessionLocal()
+    try:
+        rows = (
+            db.query(Job.status, func.count(Job.id), func.min(func.coalesce(Job.next_attempt_at, Job.queued_at)))
+            .filter(Job.status.in_(("queued", "running")))
+            .group_by(Job.status)
+            .all()
+        )
+    finally:
         db.close()
+    by_status = {status: (n, since) for status, n, since in rows}
+    queued, oldest = by_status.get("queued", (0, None))
+    yield "transcoder_jobs_queued", {}, queued
+    yield "transcoder_jobs_running", {}, by_status.get("running", (0, None))[0]
+    age = (datetime.utcnow() - oldest).total_seconds() if oldest else 0.0
+    yield "transcoder_job_queue_oldest_seconds", {}, max(0.0, age)
 
-@router.post("/transcode")
-def create_transcode_job(
-    payload: Dict[str, Any],
-    user=Depends(get_current_user),
-    db: Session = Depends(get_session),
-):
-    vid_id = payload.get("video_id")
-    if vid_id is None:
-        raise HTTPException(400, "video_id is required")
+def _budget_samples():
+    st = scheduler.get_budget().stats()
+    yield "transcoder_cpu_budget_cores", {"state": "total"}, st["total_cores"]
+    yield "transcoder_cpu_budget_cores", {"state": "used"}, st["used_cores"]
+    yield "transcoder_cpu_budget_waiting", {}, st["queue_depth"]
 
-    vid: Optional[Video] = db.get(Video, vid_id)
+metrics.add_collector(_queue_samples)
+metrics.add_collector(_budget_samples)
+
+def _deadline_seconds(payload: Dict[str, Any], duration: Optional[float]) -> Optional[float]:
+    """deadline_seconds and/or target_realtime_factor (source seconds per wall second) as one deadline."""
+    deadline, target = payload.get("deadline_seconds"), payload.get("target_realtime_factor")
+    if deadline is None and target is None:
+        return None
+    try:
+        limits = [float(v) for v in (deadline, target) if v is not None]
+    except (TypeError, ValueError):
+        raise HTTPException(400, "deadline_seconds and target_realtime_factor must be numbers")
+    if any(v <= 0 for v in limits):
+        raise HTTPException(400, "deadline_seconds and target_realtime_factor must be positive")
+    if not duration:
+        raise HTTPException(400, "Source duration is unknown (not probed); can't plan for a deadline")
+    if target is not None:
+        limits[-1] = duration / float(target)
+    return min(limits)
+
+def _check_video(vid: Optional[Video], user) -> Video:
     if not vid:
         raise HTTPException(404, "Video not found")
     if user["role"] != "admin" and vid.owner != user["username"]:
         raise HTTPException(403, "Not allowed to transcode this video")
+    return vid
 
+def _new_job(payload: Dict[str, Any], vid: Video, user, db: Session) -> Tuple[Job, Dict[str, Any]]:
+    """
+    Validate one transcode request for a (probed) video and build its Job
+    row, not yet added to the session. A result-cache hit comes back
+    already done. Returns (job, response fields); raises HTTPException.
+    """
     # Use provided renditions or sensible defaults
     specs = payload.get("renditions") or [
         {"width": 1920, "height": 1080, "crf": 18, "suffix": "1080p"},
         {"width": 1280, "height": 720,  "crf": 20, "suffix": "720p"},
         {"width": 854,  "height": 480,  "crf": 22, "suffix": "480p"},
     ]
+    # Never upscale: fit the ladder to the probed source (keeps aspect ratio)
+    dropped: List[Dict[str, Any]] = []
+    if vid.width and vid.height and payload.get("fit_to_source", True):
+        specs, dropped = fit_ladder(specs, vid.width, vid.height)
     intensity = payload.get("intensity", "high")
+    mode = payload.get("mode") or DEFAULT_MODE
+    if mode not in TRANSCODE_MODES:
+        raise HTTPException(400, f"mode must be one of {sorted(TRANSCODE_MODES)}")
+    packaging = payload.get("packaging") or "mp4"
+    if packaging not in PACKAGING_CHOICES:
+        raise HTTPException(400, f"packaging must be one of {sorted(PACKAGING_CHOICES)}")
+    options: Dict[str, Any] = {"intensity": intensity, "mode": mode, "packaging": packaging}
+    priority = payload.get("priority", 0)
+    if not isinstance(priority, int) or isinstance(priority, bool) or abs(priority) > MAX_PRIORITY:
+        raise HTTPException(400, f"priority must be an integer from {-MAX_PRIORITY} to {MAX_PRIORITY}")
+    if priority > 0 and user["role"] != "admin":
+        raise HTTPException(403, "Only admins can submit jobs above priority 0")
+    for limit in ("timeout_seconds", "rendition_timeout_seconds"):
+        if payload.get(limit) is not None:
+            try:
+                options[limit] = float(payload[limit])
+            except (TypeError, ValueError):
+                raise HTTPException(400, f"{limit} must be a number")
+            if options[limit] <= 0:
+                raise HTTPException(400, f"{limit} must be positive")
+    try:
+        thumbnails = thumbnail_options(payload.get("thumbnails"))
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+    if thumbnails and packaging != "mp4":
+        raise HTTPException(400, "thumbnails are only produced with packaging 'mp4'")
+    if thumbnails:
+        options["thumbnails"] = thumbnails
+
+    # Deadline: the slowest preset (no slower than `intensity`) predicted to make it
+    plan = None
+    deadline = _deadline_seconds(payload, vid.duration_sec)
+    if deadline is not None:
+        now = datetime.utcnow()
+        chosen, predicted, meets = encode_stats.choose(
+            encode_stats.history(db), specs, packaging if packaging != "mp4" else mode,
+            vid.duration_sec, vid.fps, deadline, slowest=intensity, source=media_info.describe(vid),
+        )
+        deadline_at = now + timedelta(seconds=deadline)
+        options.update(intensity=chosen, max_intensity=intensity, deadline_at=deadline_at.isoformat())
+        plan = {
+            "deadline_seconds": round(deadline, 1),
+            "deadline_at": deadline_at.isoformat(),
+            "requested_intensity": intensity,
+            "predicted_seconds": round(predicted, 1),  # encoding only; excludes queue wait
+            "predicted_finish_at": (now + timedelta(seconds=predicted)).isoformat(),
+            "meets_deadline": meets,
+        }
+        intensity = chosen
 
     job = Job(
         owner=user["username"],
         video_id=vid.id,
         status="queued",
+        priority=priority,
         spec_json=json.dumps(specs),
+        options_json=json.dumps(options),
     )
+
+    # Same bytes, ladder and preset already encoded? Reuse those outputs.
+    cached = None
+    if vid.content_hash and not payload.get("no_cache"):
+        key = result_cache.cache_key(vid.content_hash, specs, intensity, mode, packaging, thumbnails)
+        cached = result_cache.lookup(db, key, commit=False)  # hit stats commit with the job
+    if cached is not None:
+        now = datetime.utcnow()
+        for o in cached:
+            o["url"] = presign_get(o["key"], ttl=300)
+        job.status = "done"
+        job.outputs_json = json.dumps(cached)
+        job.started_at = job.finished_at = now
+
+    return job, {
+        "intensity": intensity,
+        "mode": mode,
+        "packaging": packaging,
+        "priority": priority,
+        "cached": cached is not None,
+        "thumbnails": thumbnails,
+        "plan": plan,
+        "source": media_info.describe(vid),
+        "renditions": specs,
+        "dropped": [r.get("suffix") or f"{r.get('width')}x{r.get('height')}" for r in dropped],
+    }
+
+@router.post("/transcode")
+def create_transcode_job(
+    payload: Dict[str, Any],
+    user=Depends(get_current_user),
+    db: Session = Depends(get_session),
+):
+    """
+    Enqueue a transcode of one video. Renditions are fitted to the source
+    unless fit_to_source is false. A rendition the source already is (H.264
+    4:2:0 at exactly that size, at no more than the bitrate its crf would
+    give) is stream-copied instead of encoded: its output then carries
+    "remuxed": true and "fast_path": "remux", and keeps the source's quality
+    and bitrate rather than re-encoding at crf.
+    """
+    vid_id = payload.get("video_id")
+    if vid_id is None:
+        raise HTTPException(400, "video_id is required")
+    vid = _check_video(db.get(Video, vid_id), user)
+    if media_info.ensure_probed(vid):
+        db.commit()
+
+    job, info = _new_job(payload, vid, user, db)
     db.add(job); db.commit(); db.refresh(job)
 
-    EXECUTOR.submit(_run_job, job.id)
+    if job.status == "queued":
+        DISPATCHER.wake()  # durable: the row itself is the queue entry
+
+    return {"job_id": job.id, "status": job.status, **info}
+
+@router.post("/transcode:batch")
+def create_transcode_jobs(
+    payload: Dict[str, Any],
+    user=Depends(get_current_user),
+    db: Session = Depends(get_session),
+):
+    """
+    Enqueue many transcodes at once: {"jobs": [{"video_id": ..., ...}, ...],
+    "defaults": {...}}. Each entry takes the fields of POST /jobs/transcode,
+    falling back to `defaults`. Every entry is validated first and all rows
+    insert in one transaction: one bad entry rejects the whole batch, with
+    its index in the error. Dispatch is fair-shared across owners (see
+    job_queue.claim), so a large batch doesn't starve other users.
+    """
+    entries, defaults = payload.get("jobs"), payload.get("defaults") or {}
+    if not isinstance(entries, list) or not entries or not isinstance(defaults, dict):
+        raise HTTPException(400, "jobs must be a non-empty list (defaults, if given, an object)")
+    if len(entries) > BATCH_MAX_JOBS:
+        raise HTTPException(400, f"At most {BATCH_MAX_JOBS} jobs per batch")
+    if not all(isinstance(e, dict) for e in entries):
+        raise HTTPException(400, "Each job must be an object")
+    requests = [{**defaults, **e} for e in entries]
+    try:
+        ids = {int(r["video_id"]) for r in requests}
+    except (KeyError, TypeError, ValueError):
+        raise HTTPException(400, "Each job needs an integer video_id")
+    videos = {v.id: v for v in db.query(Video).filter(Video.id.in_(ids))}
+
+    built: List[Tuple[Job, Dict[str, Any]]] = []
+    for i, req in enumerate(requests):
+        try:
+            vid = _check_video(videos.get(int(req["video_id"])), user)
+            media_info.ensure_probed(vid)
+            built.append(_new_job(req, vid, user, db))
+        except HTTPException as e:
+            db.rollback()
+            raise HTTPException(e.status_code, f"jobs[{i}]: {e.detail}")
+
+    db.add_all(job for job, _ in built)
+    db.flush()  # one multi-row INSERT; ids come back without a refresh per row
+    out = [
+        {"job_id": job.id, "video_id": job.video_id, "status": job.status, "cached": info["cached"]}
+        for job, info in built
+    ]
+    db.commit()
+
+    queued = sum(1 for o in out if o["status"] == "queued")
+    if queued:
+        DISPATCHER.wake()
+    return {"count": len(out), "queued": queued, "cached": len(out) - queued, "jobs": out}
+
+@router.get("/cache/stats")
+def cache_stats(user=Depends(get_current_user), db: Session = Depends(get_session)):
+    if user["role"] != "admin":
+        raise HTTPException(403, "Admins only")
+    entries, size = result_cache.usage(db)
+    return {**result_cache.stats(), "entries": entries, "size_bytes": size,
+            "max_bytes": result_cache.MAX_BYTES, "input": input_cache.stats()}
 
-    return {"job_id": job.id, "status": job.status, "intensity": intensity}
+@router.get("/scheduler")
+def scheduler_stats(user=Depends(get_current_user), db: Session = Depends(get_session)):
+    if user["role"] != "admin":
+        raise HTTPException(403, "Admins only")
+    return {
+        **scheduler.get_budget().stats(),
+        "queued_jobs": db.query(Job).filter(Job.status == "queued").count(),
+        "running_jobs": db.query(Job).filter(Job.status == "running").count(),
+        "job_workers": DISPATCHER.max_workers if WORKERS_IN_API else 0,  # in this API process
+        "encode_rates": [  # measured megapixel-frames/s per preset, used for deadline planning
+            {"intensity": r.intensity, "mode": r.mode, "samples": r.samples, "mpx_per_second": round(r.mpx_per_second, 2)}
+            for r in encode_stats.history(db).values()
+        ],
+    }
+
+@router.get("/store/stats")
+def store_stats(user=Depends(get_current_user)):
+    """Job-state write path: commits, lock retries/wait, coalescing, pool usage."""
+    if user["role"] != "admin":
+        raise HTTPException(403, "Admins only")
+    return state_store.stats()
 
 @router.get("")
 def list_jobs(
+    response: Response,
     status: Optional[str] = None,
     owner: Optional[str] = None,
     limit: int = 20,
     offset: int = 0,
+    cursor: Optional[str] = None,  # X-Next-Cursor from the previous page
     user=Depends(get_current_user),
     db: Session = Depends(get_session),
 ):
@@ -203,13 +745,14 @@ def list_jobs(
         if owner:
             q = q.filter(Job.owner == owner)
 
-    items = q.order_by(Job.id.desc()).offset(offset).limit(limit).all()
+    items = keyset_page(q, Job.id, limit, cursor=cursor, offset=offset, response=response)
     return [
         {
             "id": j.id,
             "owner": j.owner,
             "video_id": j.video_id,
             "status": j.status,
+            "priority": j.priority,
             "started_at": _iso(j.started_at),
             "finished_at": _iso(j.finished_at),
         }
@@ -227,9 +770,79 @@ def get_job(job_id: int, user=Depends(get_current_user), db: Session = Depends(g
         "id": j.id,
         "video_id": j.video_id,
         "status": j.status,
+        "stopping": j.stop_reason,  # cancelled | preempted, until the worker has acted on it
+        "priority": j.priority,
         "spec": json.loads(j.spec_json),
+        "options": json.loads(j.options_json) if j.options_json else {},
         "outputs": json.loads(j.outputs_json) if j.outputs_json else [],
+        "progress": json.loads(j.progress_json) if j.progress_json else {},
+        "timings": json.loads(j.timings_json) if j.timings_json else {},
         "error": j.error,
+        "attempts": j.attempts,
         "started_at": _iso(j.started_at),
         "finished_at": _iso(j.finished_at),
-    }
\ No newline at end of file
+    }
+
+@router.post("/{job_id}/cancel", status_code=202)
+def cancel_job(job_id: int, user=Depends(get_current_user), db: Session = Depends(get_session)):
+    """
+    Cancel a job. A queued job is cancelled at once; a running one is flagged,
+    and its worker kills the ffmpeg processes and cleans up within
+    JOB_CONTROL_POLL_SECONDS, after which the job reads as cancelled.
+    """
+    j: Optional[Job] = db.get(Job, job_id)
+    if not j:
+        raise HTTPException(404, "Job not found")
+    if user["role"] != "admin" and j.owner != user["username"]:
+        raise HTTPException(403, "Not allowed")
+    if j.status in TERMINAL_STATUSES:
+        raise HTTPException(409, f"Job is already {j.status}")
+    status = cancel(db, job_id)
+    db.commit()
+    return {"job_id": job_id, "status": status, "stopping": status == "running"}
+
+@router.get("/{job_id}/events")
+def job_events(job_id: int, user=Depends(get_current_user), db: Session = Depends(get_session)):
+    """Server-Sent Events stream of status/progress until the job finishes."""
+    j: Optional[Job] = db.get(Job, job_id)
+    if not j:
+        raise HTTPException(404, "Job not found")
+    if user["role"] != "admin" and j.owner != user["username"]:
+        raise HTTPException(403, "Not allowed")
+    return StreamingResponse(
+        EVENTS.sse(job_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@router.get("/{job_id}/outputs/{name:path}")
+def download_output(
+    job_id: int,
+    name: str,
+    request: Request,
+    user=Depends(get_current_user),
+    db: Session = Depends(get_session),
+):
+    """Presigned URL for one output (or packaged segment/playlist), or a Range-capable stream of it."""
+    j: Optional[Job] = db.get(Job, job_id)
+    if not j:
+        raise HTTPException(404, "Job not found")
+    if user["role"] != "admin" and j.owner != user["username"]:
+        raise HTTPException(403, "Not allowed")
+    outputs = json.loads(j.outputs_json or "[]")
+    out = next((o for o in outputs if o.get("name") == name), None)
+    manifest = next((o for o in outputs if o.get("type")), None)
+    if out:
+        key = out["key"]
+    elif manifest and name.startswith("stream/") and ".." not in name.split("/"):
+        # Segment or variant playlist of a packaged job: beside its manifest, which
+        # a cache hit shares with the job that produced it (outputs/job_<that id>/)
+        root = manifest["key"][: len(manifest["key"]) - len(manifest["name"])]  # key = root + name
+        key = root + name
+    else:
+        raise HTTPException(404, "Output not found")
+
+    url = presign_get(key, ttl=300)
+    if url:
+        return {"url": url}
+    return object_response(request, key)
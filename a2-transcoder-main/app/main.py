@@ -6,21 +6,28 @@ import uuid
 from typing import Optional
 import os
 
-from fastapi import FastAPI, UploadFile, File, Depends, HTTPException, Body, Header, Query
+from fastapi import FastAPI, UploadFile, File, Depends, HTTPException, Body, Header, Query, Request, Response
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse, StreamingResponse
+from fastapi.responses import FileResponse, PlainTextResponse
 
 from sqlalchemy.orm import Session
 
-from .services.storage import put_bytes, presign_get, get_stream
+from .services.storage import put_stream, presign_get, exists, delete
+from .media_response import object_response
+from .pagination import keyset_page
 from .auth import USERS, create_access_token, get_current_user
 from .models import init_db, get_session, Video
-from .jobs import router as jobs_router
+from .services import media_info
+from . import metrics
+from .jobs import router as jobs_router, DISPATCHER, WORKERS_IN_API
+from .job_queue import recover_stale
+from .state_store import write
 from app.s3_utils import presign_upload, presign_download
-from app.dynamodb import new_video, update_status, list_videos as ddb_list_videos, get_video
+from app.dynamodb import new_video, update_status, batch_update_status, list_videos as ddb_list_videos, get_video
 
 # ---- App ----
 app = FastAPI(title="CAB432 Video Transcoder")
+app.add_middleware(metrics.RequestTimer)
 
 # Serve the frontend
 app.mount("/static", StaticFiles(directory="app/static"), name="static")
@@ -37,11 +44,24 @@ def root():
 def _startup():
     # No local data dirs are created here (statelessness).
     init_db()
+    metrics.get_forwarder().start()  # job worker processes report through it
+    if WORKERS_IN_API:  # else enqueue only; standalone workers (python -m app.worker) run the jobs
+        write(recover_stale)  # leases that lapsed while no dispatcher was polling, before claiming anything
+        DISPATCHER.start()  # recovers again on every poll
+
+@app.on_event("shutdown")
+def _shutdown():
+    DISPATCHER.stop()
 
 @app.get("/health")
 def health():
     return {"ok": True}
 
+@app.get("/metrics", include_in_schema=False)
+def prometheus_metrics():
+    """Prometheus text exposition (API and job workers)."""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
 @app.get("/health/config")
 def health_config():
     return {"storage_backend": "cloud (presigned_or_stream)", "stateless": True}
@@ -77,35 +97,58 @@ def upload_video(
     suffix = Path(original_name).suffix or ".mp4"
     object_key = f"uploads/{uuid.uuid4().hex}{suffix}"
 
-    # read file bytes (works for non-async route)
-    blob = file.file.read()
     content_type = getattr(file, "content_type", None) or "application/octet-stream"
 
-    # Store bytes in the storage backend (e.g., S3). No local disk writes.
-    put_bytes(object_key, blob, content_type)
-    size = len(blob)
+    # Copy the upload to the storage backend in bounded chunks (e.g., S3),
+    # so memory stays flat regardless of file size.
+    size, sha256 = put_stream(object_key, file.file, content_type)
+
+    # Identical bytes already stored? Point at that object and drop the copy.
+    deduplicated = False
+    twin = (
+        db.query(Video)
+        .filter(Video.content_hash == sha256, Video.size_bytes == size)
+        .order_by(Video.id.asc())
+        .first()
+    )
+    if twin and twin.filename != object_key and exists(twin.filename):
+        delete(object_key)
+        object_key = twin.filename
+        deduplicated = True
+
+    # Duration/resolution/codec/fps/bitrate, probed once here (same bytes: reuse the twin's)
+    media = media_info.describe(twin) if deduplicated else None
+    if media is None:
+        media = media_info.probe_object(object_key)
 
     v = Video(
         owner=user["username"],
         filename=object_key,  # NOTE: this stores an object key (e.g., S3 key), not a local path
         orig_name=original_name,
         size_bytes=size,
+        content_hash=sha256,
         created_at=datetime.utcnow(),
     )
+    media_info.apply(v, media)
     db.add(v); db.commit(); db.refresh(v)
     return {
     "video_id": v.id,
     "stored_name": object_key, 
     "size_bytes": size,
+    "sha256": sha256,
+    "deduplicated": deduplicated,
     "orig_name": original_name,
+    "media": media_info.describe(v),
 }
 
 # ---- Video listing (SQLAlchemy) ----
 @app.get("/videos-sql")
 def list_videos_sql(
+    response: Response,
     owner: Optional[str] = None,
     limit: int = 50,
     offset: int = 0,
+    cursor: Optional[str] = None,  # X-Next-Cursor from the previous page
     user=Depends(get_current_user),
     db: Session = Depends(get_session),
 ):
@@ -116,7 +159,7 @@ def list_videos_sql(
         if owner:
             q = q.filter(Video.owner == owner)
 
-    items = q.order_by(Video.id.desc()).offset(offset).limit(limit).all()
+    items = keyset_page(q, Video.id, limit, cursor=cursor, offset=offset, response=response)
     return [
         {
             "id": v.id,
@@ -124,6 +167,7 @@ def list_videos_sql(
             "orig_name": v.orig_name,
             "stored_name": v.filename,
             "size_bytes": v.size_bytes,
+            "media": media_info.describe(v),
             "created_at": v.created_at.isoformat() if v.created_at else None,
         }
         for v in items
@@ -133,6 +177,7 @@ def list_videos_sql(
 @app.get("/videos/{video_id}/download")
 def download_video(
     video_id: int,
+    request: Request,
     user=Depends(get_current_user),
     db: Session = Depends(get_session),
 ):
@@ -147,9 +192,9 @@ def download_video(
     if url:
         return {"url": url}
 
-    # Fallback: stream from storage backend without touching local disk
-    stream, content_type = get_stream(v.filename)
-    return StreamingResponse(stream, media_type=content_type)
+    # Fallback: serve from the storage backend with Range/ETag support
+    # (sendfile for local objects, ranged streaming otherwise)
+    return object_response(request, v.filename)
 
 def get_owner(x_user: str | None = Header(None)):
     # Minimal owner identity for now; replace with real auth later
@@ -195,9 +240,30 @@ def mark_done(video_id: str, payload: dict = Body(None), owner: str = Depends(ge
     update_status(owner, video_id, "DONE", outputs=outputs)
     return {"ok": True}
 
+@app.post("/videos/status")
+def mark_many(payload: dict = Body(...), owner: str = Depends(get_owner)):
+    """
+    Bulk status change.
+    body: { "video_ids": ["...", ...], "status": "PROCESSING", "outputs": [...]? }
+    """
+    video_ids = payload.get("video_ids")
+    status = payload.get("status")
+    if not isinstance(video_ids, list) or not video_ids or not status:
+        raise HTTPException(400, "video_ids (non-empty list) and status required")
+    updated = batch_update_status(owner, video_ids, status, outputs=payload.get("outputs"))
+    return {"ok": True, "updated": updated}
+
 @app.get("/videos")
-def my_videos(owner: str = Depends(get_owner)):
-    return {"items": ddb_list_videos(owner)}
+def my_videos(
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: Optional[str] = Query(None, description="next_cursor from the previous page"),
+    owner: str = Depends(get_owner),
+):
+    try:
+        items, next_cursor = ddb_list_videos(owner, limit=limit, cursor=cursor)
+    except ValueError:
+        raise HTTPException(400, "Invalid cursor")
+    return {"items": items, "next_cursor": next_cursor}
 
 @app.get("/videos/{video_id}/download-url")
 def get_download_url(video_id: str, owner: str = Depends(get_owner)):
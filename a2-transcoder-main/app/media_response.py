@@ -0,0 +1,122 @@
+# app/media_response.py
+"""
+Conditional and byte-range responses for stored objects.
+
+Handles Range / If-Range / If-None-Match, so browser players can seek
+without re-downloading from byte 0. Locally stored objects are sent from
+the file descriptor, using the ASGI zero-copy extension (sendfile) when the
+server offers it. Remote objects are streamed as a ranged read.
+"""
+from __future__ import annotations
+from email.utils import formatdate
+from typing import Any, Dict, Optional, Tuple
+import os
+
+import anyio
+from fastapi import HTTPException, Request
+from starlette.responses import Response, StreamingResponse
+from starlette.types import Receive, Scope, Send
+
+from .services.storage import CHUNK_SIZE, get_stream, local_path, stat
+
+ZEROCOPY = "http.response.zerocopysend"
+
+def parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """
+    Parse a single `bytes=` range into inclusive (start, end).
+    Returns None to serve the whole object (no/invalid/multi-range header);
+    raises ValueError when the range cannot be satisfied.
+    """
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    first, _, last = header[len("bytes="):].strip().partition("-")
+    if not (first.isdigit() or last.isdigit()) or (first and last and not (first.isdigit() and last.isdigit())):
+        return None  # malformed: RFC 7233 lets us ignore it
+    if not first:
+        n = int(last)  # suffix: the final n bytes
+        if n == 0 or size == 0:
+            raise ValueError("range not satisfiable")
+        return max(0, size - n), size - 1
+    start = int(first)
+    if start >= size:
+        raise ValueError("range not satisfiable")
+    end = int(last) if last else size - 1
+    if end < start:
+        return None
+    return start, min(end, size - 1)
+
+class FileRangeResponse(Response):
+    """Send [start, end] of a local file; sendfile when the server supports it."""
+
+    def __init__(self, path: str, start: int, end: int, status_code: int, headers: Dict[str, str], media_type: str):
+        super().__init__(status_code=status_code, headers=headers, media_type=media_type)
+        self.path = path
+        self.start = start
+        self.count = end - start + 1
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        if scope.get("method") == "HEAD" or self.count <= 0:
+            await send({"type": "http.response.body", "body": b""})
+            return
+        if ZEROCOPY in scope.get("extensions", {}):
+            with open(self.path, "rb") as f:
+                await send({"type": ZEROCOPY, "file": f, "offset": self.start, "count": self.count})
+            return
+        async with await anyio.open_file(self.path, "rb") as f:
+            await f.seek(self.start)
+            remaining = self.count
+            while remaining > 0:
+                chunk = await f.read(min(CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                await send({"type": "http.response.body", "body": chunk, "more_body": remaining > 0})
+            if remaining > 0:
+                await send({"type": "http.response.body", "body": b""})
+
+def _weak(tag: str) -> str:
+    """The opaque tag for If-None-Match's weak comparison (W/"x" matches "x")."""
+    tag = tag.strip()
+    return tag[2:] if tag.startswith("W/") else tag
+
+def object_response(request: Request, key: str) -> Response:
+    """200 / 206 / 304 / 416 response for a stored object, honouring conditional headers."""
+    try:
+        meta: Dict[str, Any] = stat(key)
+    except FileNotFoundError:
+        raise HTTPException(404, "Object not found")
+    size, etag = meta["size"], meta["etag"]
+    headers = {
+        "Accept-Ranges": "bytes",
+        "ETag": etag,
+        "Last-Modified": formatdate(meta["last_modified"], usegmt=True),
+    }
+
+    inm = request.headers.get("if-none-match")
+    if inm and (inm.strip() == "*" or _weak(etag) in [_weak(t) for t in inm.split(",")]):
+        return Response(status_code=304, headers=headers)
+
+    rng = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if rng and if_range and if_range.strip() != etag:  # strong comparison: a W/ tag never matches
+        rng = None  # representation changed since the client's partial copy: send it all
+    try:
+        byte_range = parse_range(rng, size)
+    except ValueError:
+        return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{size}"})
+
+    status = 200
+    start, end = 0, size - 1
+    if byte_range:
+        status = 206
+        start, end = byte_range
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    headers["Content-Length"] = str(end - start + 1)
+
+    path = local_path(key)
+    if path and os.path.exists(path):
+        return FileRangeResponse(path, start, end, status, headers, meta["content_type"])
+
+    stream, _ct = get_stream(key, byte_range=byte_range)
+    return StreamingResponse(stream, status_code=status, headers=headers, media_type=meta["content_type"])
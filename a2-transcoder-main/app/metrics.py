@@ -0,0 +1,262 @@
+# app/metrics.py
+"""
+Prometheus metrics, served as text at GET /metrics.
+
+Counters, gauges and histograms with labels are kept in a small in-process
+registry instead of pulling in a client library. Job worker processes have
+no endpoint of their own, so each observation they make is forwarded over a
+multiprocessing queue (installed into the pool like the CPU budget) and
+applied to the API process's registry by a drain thread. Values that
+already live in the database or in shared memory (queue depth, running
+jobs, CPU budget, DB contention) come from collectors run at scrape time.
+"""
+from __future__ import annotations
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+import logging
+import math
+import multiprocessing
+import os
+import queue
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+FORWARD_QUEUE_SIZE = int(os.getenv("METRICS_QUEUE_SIZE", "10000"))  # observations in flight from workers
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+JOB_BUCKETS = (1, 5, 10, 30, 60, 120, 300, 600, 1200, 1800, 3600, 7200)
+RATIO_BUCKETS = (0.1, 0.25, 0.5, 1, 2, 4, 8, 16, 32, 64)
+BYTES_BUCKETS = tuple(2 ** n * 1024 * 1024 for n in range(4, 14))  # 16 MiB .. 8 GiB
+
+Labels = Tuple[Tuple[str, str], ...]
+Sample = Tuple[str, Dict[str, str], float]  # (family, labels, value) reported by a collector
+
+class _Family:
+    def __init__(self, name: str, kind: str, help: str, buckets: Tuple[float, ...] = ()):
+        self.name = name
+        self.kind = kind  # counter | gauge | histogram
+        self.help = help
+        self.buckets = buckets
+        # counter/gauge: labels -> value; histogram: labels -> [count per bucket..., +Inf, sum]
+        self.values: Dict[Labels, object] = {}
+
+class Registry:
+    def __init__(self) -> None:
+        self._families: Dict[str, _Family] = {}
+        self._collectors: List[Callable[[], Iterable[Sample]]] = []
+        self._lock = threading.Lock()
+
+    def declare(self, name: str, kind: str, help: str, buckets: Tuple[float, ...] = ()) -> None:
+        self._families.setdefault(name, _Family(name, kind, help, buckets))
+
+    def add_collector(self, fn: Callable[[], Iterable[Sample]]) -> None:
+        """fn() is called on every scrape and returns (family, labels, value) samples."""
+        self._collectors.append(fn)
+
+    def apply(self, op: str, name: str, value: float, labels: Labels) -> None:
+        fam = self._families[name]
+        with self._lock:
+            if op == "inc":
+                fam.values[labels] = fam.values.get(labels, 0.0) + value  # type: ignore[operator]
+            elif op == "set":
+                fam.values[labels] = value
+            else:  # observe
+                row = fam.values.get(labels)
+                if row is None:
+                    row = fam.values[labels] = [0] * (len(fam.buckets) + 1) + [0.0]
+                i = next((i for i, b in enumerate(fam.buckets) if value <= b), len(fam.buckets))
+                row[i] += 1  # type: ignore[index]
+                row[-1] += value  # type: ignore[index]
+
+    def render(self) -> str:
+        collected: Dict[str, List[Tuple[Labels, float]]] = {}
+        for fn in self._collectors:
+            try:
+                for name, labels, value in fn():
+                    collected.setdefault(name, []).append((_key(labels), value))
+            except Exception:
+                log.exception("metrics collector %r failed", fn)
+
+        lines: List[str] = []
+        with self._lock:
+            for fam in self._families.values():
+                lines.append(f"# HELP {fam.name} {fam.help}")
+                lines.append(f"# TYPE {fam.name} {fam.kind}")
+                if fam.kind == "histogram":
+                    for labels, row in sorted(fam.values.items()):
+                        cumulative = 0
+                        for bound, n in zip((*fam.buckets, math.inf), row):  # type: ignore[arg-type]
+                            cumulative += n
+                            le = "+Inf" if bound == math.inf else _num(bound)
+                            lines.append(f"{fam.name}_bucket{_fmt(labels + (('le', le),))} {cumulative}")
+                        lines.append(f"{fam.name}_sum{_fmt(labels)} {_num(row[-1])}")  # type: ignore[index]
+                        lines.append(f"{fam.name}_count{_fmt(labels)} {cumulative}")
+                else:
+                    samples = {**fam.values, **dict(collected.get(fam.name, []))}
+                    for labels, value in sorted(samples.items()):
+                        lines.append(f"{fam.name}{_fmt(labels)} {_num(value)}")  # type: ignore[arg-type]
+        return "\n".join(lines) + "\n"
+
+def _key(labels: Dict[str, str]) -> Labels:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+def _escape(v: str) -> str:
+    return v.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _fmt(labels: Labels) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels) + "}"
+
+def _num(v: float) -> str:
+    return str(int(v)) if float(v).is_integer() else repr(float(v))
+
+REGISTRY = Registry()
+
+class Forwarder:
+    """Carries observations from job worker processes to the API process's registry."""
+
+    def __init__(self, maxsize: int = FORWARD_QUEUE_SIZE):
+        self.owner_pid = os.getpid()
+        self._q = multiprocessing.get_context("spawn").Queue(maxsize)
+        self._thread: Optional[threading.Thread] = None
+
+    def __getstate__(self):  # pickled into the worker pool's initargs
+        return {"owner_pid": self.owner_pid, "_q": self._q, "_thread": None}
+
+    def send(self, op: str, name: str, value: float, labels: Labels) -> None:
+        try:
+            self._q.put_nowait((op, name, value, labels))
+        except queue.Full:
+            pass  # never block a job on metrics; the API isn't draining
+
+    def start(self, registry: Optional[Registry] = None) -> None:
+        """Drain forwarded observations into registry (API process only)."""
+        if self._thread:
+            return
+        target = registry or REGISTRY
+        self._thread = threading.Thread(target=self._drain, args=(target,), name="metrics-drain", daemon=True)
+        self._thread.start()
+
+    def _drain(self, registry: Registry) -> None:
+        while True:
+            op, name, value, labels = self._q.get()
+            try:
+                registry.apply(op, name, value, labels)
+            except Exception:
+                log.exception("dropping forwarded metric %s", name)
+
+_FORWARDER: Optional[Forwarder] = None
+
+def install(forwarder: Forwarder) -> None:
+    """Process-pool initializer: send this process's observations to the parent."""
+    global _FORWARDER
+    _FORWARDER = forwarder
+
+def get_forwarder() -> Forwarder:
+    global _FORWARDER
+    if _FORWARDER is None:
+        _FORWARDER = Forwarder()
+    return _FORWARDER
+
+def _emit(op: str, name: str, value: float, labels: Dict[str, str]) -> None:
+    key = _key(labels)
+    fwd = _FORWARDER
+    if fwd is not None and fwd.owner_pid != os.getpid():
+        fwd.send(op, name, value, key)
+    else:
+        REGISTRY.apply(op, name, value, key)
+
+def inc(name: str, value: float = 1.0, **labels: str) -> None:
+    _emit("inc", name, value, labels)
+
+def set_gauge(name: str, value: float, **labels: str) -> None:
+    _emit("set", name, value, labels)
+
+def observe(name: str, value: float, **labels: str) -> None:
+    _emit("observe", name, value, labels)
+
+@contextmanager
+def timer(name: str, **labels: str) -> Iterator[None]:
+    """Observe the duration of the block (also when it raises)."""
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - t0, **labels)
+
+def add_collector(fn: Callable[[], Iterable[Sample]]) -> None:
+    REGISTRY.add_collector(fn)
+
+def render() -> str:
+    return REGISTRY.render()
+
+class RequestTimer:
+    """
+    ASGI middleware: request latency by method, route template and status,
+    measured until the response starts (so streams and SSE don't skew it).
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        t0 = time.perf_counter()
+        started = False
+
+        def record(status: int) -> None:
+            route = getattr(scope.get("route"), "path", "unmatched")  # the template, not the raw path
+            observe("transcoder_http_request_duration_seconds", time.perf_counter() - t0,
+                    method=scope["method"], route=route, status=str(status))
+
+        async def send_timed(message):
+            nonlocal started
+            if message["type"] == "http.response.start":
+                started = True
+                record(message["status"])
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_timed)
+        except Exception:
+            if not started:
+                record(500)
+            raise
+
+# --- Series ---
+_declare = REGISTRY.declare
+_declare("transcoder_http_request_duration_seconds", "histogram",
+         "API request latency until the response starts, by route template.", LATENCY_BUCKETS)
+_declare("transcoder_jobs_queued", "gauge", "Jobs waiting in the queue.")
+_declare("transcoder_jobs_running", "gauge", "Jobs claimed by a worker.")
+_declare("transcoder_job_queue_oldest_seconds", "gauge", "Age of the oldest queued job.")
+_declare("transcoder_job_queue_wait_seconds", "histogram",
+         "Time from enqueue (or retry becoming due) to a worker starting the job.", JOB_BUCKETS)
+_declare("transcoder_job_phase_seconds", "histogram",
+         "Time a job spent in each phase: input, encode, upload, total.", JOB_BUCKETS)
+_declare("transcoder_jobs_finished_total", "counter", "Job attempts that ended, by outcome.")
+_declare("transcoder_encode_seconds", "histogram", "Wall time to produce one rendition.", JOB_BUCKETS)
+_declare("transcoder_encode_realtime_factor", "histogram",
+         "Source seconds encoded per wall second, per rendition.", RATIO_BUCKETS)
+_declare("transcoder_ffmpeg_runs_total", "counter", "ffmpeg child processes, by operation and outcome.")
+_declare("transcoder_ffmpeg_cpu_seconds_total", "counter", "User+system CPU of ffmpeg children (rusage).")
+_declare("transcoder_ffmpeg_max_rss_bytes", "histogram", "Peak RSS of each ffmpeg child (rusage).", BYTES_BUCKETS)
+_declare("transcoder_cpu_budget_cores", "gauge", "Shared encoder CPU budget, by state (total/used).")
+_declare("transcoder_cpu_budget_waiting", "gauge", "Encodes blocked waiting for cores.")
+_declare("transcoder_storage_op_seconds", "histogram",
+         "Storage call latency by operation (get: until the stream is open).", LATENCY_BUCKETS)
+_declare("transcoder_storage_bytes_total", "counter", "Bytes moved to/from storage; rate() gives bytes/sec.")
+_declare("transcoder_storage_errors_total", "counter", "Storage calls that raised (missing objects excluded).")
+_declare("transcoder_input_cache_requests_total", "counter",
+         "Job inputs asked of the node's input cache, by result (hit/shared/miss; bypass = didn't fit).")
+_declare("transcoder_input_cache_hit_bytes_total", "counter", "Input bytes served from the cache instead of storage.")
+_declare("transcoder_input_cache_evictions_total", "counter", "Input cache entries evicted to stay under budget.")
+_declare("transcoder_input_cache_bytes", "gauge", "Bytes held by this node's input cache.")
+_declare("transcoder_db_commit_seconds", "histogram", "Job-state write units, from session open to commit.",
+         LATENCY_BUCKETS)
+_declare("transcoder_db_write_events_total", "counter",
+         "Job-state write path events (lock retries, failures, coalesced updates...).")
@@ -3,21 +3,51 @@ from __future__ import annotations
 from datetime import datetime
 import os
 
-from sqlalchemy import create_engine, String, Integer, Float, DateTime, ForeignKey, Text
+from sqlalchemy import create_engine, event, inspect, literal, text, String, Integer, Float, DateTime, ForeignKey, Index, Text
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship, sessionmaker
 
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:////tmp/app.db")
 ECHO = os.getenv("SQL_ECHO", "0") in {"1", "true", "True"}
+# Per-process connection pool (the API and every job worker process get one each)
+POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+SQLITE_BUSY_TIMEOUT = float(os.getenv("SQLITE_BUSY_TIMEOUT", "30"))  # seconds a writer waits for the lock
+SQLITE_WAL = os.getenv("SQLITE_WAL", "1") in {"1", "true", "True"}  # turn off on network filesystems
 
 class Base(DeclarativeBase):
     pass
 
-engine = create_engine(DATABASE_URL, echo=ECHO, future=True)
+def _engine_kwargs(url: str) -> dict:
+    if not url.startswith("sqlite"):
+        return {"pool_size": POOL_SIZE, "max_overflow": MAX_OVERFLOW, "pool_timeout": POOL_TIMEOUT, "pool_pre_ping": True}
+    kwargs: dict = {"connect_args": {"timeout": SQLITE_BUSY_TIMEOUT, "check_same_thread": False}}
+    if ":memory:" not in url and url.rstrip("/") != "sqlite:":
+        kwargs.update(pool_size=POOL_SIZE, max_overflow=MAX_OVERFLOW, pool_timeout=POOL_TIMEOUT)
+    return kwargs
+
+engine = create_engine(DATABASE_URL, echo=ECHO, future=True, **_engine_kwargs(DATABASE_URL))
+
+if engine.dialect.name == "sqlite":
+    @event.listens_for(engine, "connect")
+    def _sqlite_pragmas(dbapi_conn, _record):
+        # WAL lets readers (API, SSE pollers) run alongside the single writer;
+        # NORMAL sync is durable across app crashes and fsyncs far less.
+        cur = dbapi_conn.cursor()
+        if SQLITE_WAL:
+            cur.execute("PRAGMA journal_mode=WAL")
+            cur.execute("PRAGMA synchronous=NORMAL")
+        cur.execute(f"PRAGMA busy_timeout={int(SQLITE_BUSY_TIMEOUT * 1000)}")
+        cur.execute("PRAGMA temp_store=MEMORY")
+        cur.close()
 SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False, future=True)
 
 # --- Models ---
 class Video(Base):
     __tablename__ = "videos"
+    __table_args__ = (
+        Index("ix_videos_owner_id", "owner", "id"),  # per-owner listings, newest first
+    )
 
     id: Mapped[int] = mapped_column(primary_key=True)
     owner: Mapped[str] = mapped_column(String(64))
@@ -25,30 +55,124 @@ class Video(Base):
     filename: Mapped[str] = mapped_column(String(512))
     orig_name: Mapped[str] = mapped_column(String(255))  # original client filename
     size_bytes: Mapped[int] = mapped_column(Integer)
+    # Probed at upload (app/services/media_info.py); NULL when ffprobe couldn't read it
     duration_sec: Mapped[float | None] = mapped_column(Float, nullable=True)
+    width: Mapped[int | None] = mapped_column(Integer, nullable=True)   # as displayed (rotation applied)
+    height: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    video_codec: Mapped[str | None] = mapped_column(String(32), nullable=True)
+    pix_fmt: Mapped[str | None] = mapped_column(String(32), nullable=True)
+    fps: Mapped[float | None] = mapped_column(Float, nullable=True)
+    bitrate: Mapped[int | None] = mapped_column(Integer, nullable=True)  # bits/s
+    content_hash: Mapped[str | None] = mapped_column(String(64), nullable=True, index=True)  # sha256 of the bytes
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
 
     jobs: Mapped[list["Job"]] = relationship(back_populates="video")
 
 class Job(Base):
     __tablename__ = "jobs"
+    __table_args__ = (
+        # Listings filter on owner and/or status and page by id (see app/pagination.py)
+        Index("ix_jobs_owner_id", "owner", "id"),
+        Index("ix_jobs_status_owner_id", "status", "owner", "id"),
+        Index("ix_jobs_status_id", "status", "id"),
+        # The dispatcher's claim: most urgent queued job first, oldest within a priority
+        Index("ix_jobs_status_priority_id", "status", "priority", "id"),
+        # Fair share: each waiting owner's recent starts
+        Index("ix_jobs_owner_started_at", "owner", "started_at"),
+    )
 
     id: Mapped[int] = mapped_column(primary_key=True)
     owner: Mapped[str] = mapped_column(String(64))
     video_id: Mapped[int] = mapped_column(ForeignKey("videos.id"))
-    status: Mapped[str] = mapped_column(String(16), default="queued")  # queued|running|done|failed
+    status: Mapped[str] = mapped_column(String(16), default="queued")  # queued|running|done|failed|cancelled
     spec_json: Mapped[str] = mapped_column(Text)
+    options_json: Mapped[str | None] = mapped_column(Text, nullable=True)  # {"intensity": ..., "mode": ...}
     outputs_json: Mapped[str | None] = mapped_column(Text, nullable=True)
+    progress_json: Mapped[str | None] = mapped_column(Text, nullable=True)  # {output_name: {fps, speed, out_time, eta, ...}}
+    # Last attempt's {queue_wait, input, encode, upload, total, cpu_seconds, renditions: {...}} (seconds)
+    timings_json: Mapped[str | None] = mapped_column(Text, nullable=True)
     error: Mapped[str | None] = mapped_column(Text, nullable=True)
+    queued_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True, default=datetime.utcnow)
     started_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
     finished_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
+    # Durable queue bookkeeping (see app/job_queue.py)
+    attempts: Mapped[int] = mapped_column(Integer, default=0)
+    next_attempt_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
+    lease_owner: Mapped[str | None] = mapped_column(String(128), nullable=True)
+    lease_expires_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
+    priority: Mapped[int] = mapped_column(Integer, default=0)  # higher runs first; may preempt lower
+    # Set on a running job for its worker to act on: cancelled | preempted
+    stop_reason: Mapped[str | None] = mapped_column(String(16), nullable=True)
+    # On a queued job: the running job flagged "preempted" to make room for it (one per urgent job, cluster-wide)
+    preempted_job_id: Mapped[int | None] = mapped_column(Integer, nullable=True)
 
     video: Mapped["Video"] = relationship(back_populates="jobs")
 
+class TranscodeCache(Base):
+    """Finished outputs keyed on (content hash, normalized renditions, preset)."""
+    __tablename__ = "transcode_cache"
+
+    cache_key: Mapped[str] = mapped_column(String(64), primary_key=True)
+    content_hash: Mapped[str] = mapped_column(String(64), index=True)
+    job_id: Mapped[int] = mapped_column(Integer)  # job that produced the outputs
+    outputs_json: Mapped[str] = mapped_column(Text)
+    size_bytes: Mapped[int] = mapped_column(Integer)
+    hits: Mapped[int] = mapped_column(Integer, default=0)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    last_used_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, index=True)
+
+class CacheObjects(Base):
+    """A job's output objects (everything under its key prefix), kept alive by result-cache entries."""
+    __tablename__ = "cache_objects"
+
+    prefix: Mapped[str] = mapped_column(String(512), primary_key=True)  # outputs/job_<id>/
+    size_bytes: Mapped[int] = mapped_column(Integer)
+    refs: Mapped[int] = mapped_column(Integer, default=0)  # entries pointing here; deleted from storage at 0
+
+class EncodeStat(Base):
+    """Measured encoder throughput per (preset, mode); see app/services/encode_stats.py."""
+    __tablename__ = "encode_stats"
+
+    intensity: Mapped[str] = mapped_column(String(16), primary_key=True)  # low|medium|high|max
+    mode: Mapped[str] = mapped_column(String(16), primary_key=True)       # transcode mode or packaging
+    samples: Mapped[int] = mapped_column(Integer, default=0)
+    mpx_per_second: Mapped[float] = mapped_column(Float)  # EWMA of output megapixel-frames per wall second
+    updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+
 # --- Helpers ---
+def _add_missing_columns() -> None:
+    """
+    create_all skips tables that already exist, so add the columns introduced
+    since to them: nullable, with the model's scalar default (if any) as the
+    server default, so existing rows get it too.
+    """
+    insp = inspect(engine)
+    tables = set(insp.get_table_names())
+    preparer = engine.dialect.identifier_preparer
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if table.name not in tables:
+                continue
+            have = {c["name"] for c in insp.get_columns(table.name)}
+            for col in table.columns:
+                if col.name in have:
+                    continue
+                ddl = (f"ALTER TABLE {preparer.format_table(table)} "
+                       f"ADD COLUMN {preparer.format_column(col)} {col.type.compile(engine.dialect)}")
+                if col.default is not None and col.default.is_scalar:
+                    value = literal(col.default.arg, col.type).compile(
+                        dialect=engine.dialect, compile_kwargs={"literal_binds": True})
+                    ddl += f" DEFAULT {value}"
+                conn.execute(text(ddl))
+
 def init_db():
     # No local directory creation here (stateless). Just ensure tables exist.
     Base.metadata.create_all(engine)
+    _add_missing_columns()
+    # ...and the indexes introduced since, now that their columns exist
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(engine, checkfirst=True)
 
 ###
 def get_session():
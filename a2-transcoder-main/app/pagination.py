@@ -0,0 +1,63 @@
+# app/pagination.py
+"""
+Keyset (cursor) pagination for id-ordered listings.
+
+OFFSET n makes the database walk and discard n rows, so deep pages get
+slower as tables grow. A cursor instead remembers the last id returned and
+the next page is `WHERE id < :last ORDER BY id DESC LIMIT m`. With an index
+that ends in id (e.g. (owner, id)), every page costs the same.
+Cursors are opaque to clients and travel in the X-Next-Cursor header, so
+list bodies stay plain arrays.
+"""
+from __future__ import annotations
+from typing import Any, List, Optional
+import base64
+import json
+
+from fastapi import HTTPException, Response
+from sqlalchemy.orm import InstrumentedAttribute, Query
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+def encode_cursor(last_id: int) -> str:
+    raw = json.dumps({"id": last_id}, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> int:
+    """Return the id the cursor points after; ValueError if it isn't one of ours."""
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        last_id = data["id"]
+    except (ValueError, TypeError, KeyError) as e:
+        raise ValueError("invalid cursor") from e
+    if not isinstance(last_id, int) or isinstance(last_id, bool):
+        raise ValueError("invalid cursor")
+    return last_id
+
+def keyset_page(
+    q: Query,
+    id_col: InstrumentedAttribute,
+    limit: int,
+    cursor: Optional[str] = None,
+    offset: int = 0,
+    response: Optional[Response] = None,
+) -> List[Any]:
+    """
+    Newest-first page of q. With a cursor, seek past it (offset is ignored).
+    Without one, the legacy offset still applies to the first page. Sets
+    X-Next-Cursor on response when more rows follow.
+    """
+    if cursor:
+        try:
+            q = q.filter(id_col < decode_cursor(cursor))
+        except ValueError:
+            raise HTTPException(400, "Invalid cursor")
+    q = q.order_by(id_col.desc())
+    if offset and not cursor:
+        q = q.offset(offset)
+    rows = q.limit(limit + 1).all()  # one extra row says whether a next page exists
+    if len(rows) > limit:
+        rows = rows[:limit]
+        if response is not None:
+            response.headers[NEXT_CURSOR_HEADER] = encode_cursor(rows[-1].id)
+    return rows
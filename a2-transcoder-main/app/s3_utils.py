@@ -2,15 +2,34 @@
 import os
 from functools import lru_cache
 import boto3
+from botocore.config import Config
+
+# One pooled client per process, shared by storage transfers and presign routes.
+# Size the pool for UPLOAD_CONCURRENCY x S3_TRANSFER_CONCURRENCY parts in flight.
+S3_MAX_CONNECTIONS = int(os.getenv("S3_MAX_CONNECTIONS", "64"))
+S3_MAX_ATTEMPTS = int(os.getenv("S3_MAX_ATTEMPTS", "5"))
+
+def _region() -> str:
+    return (os.getenv("AWS_REGION") or os.getenv("AWS_DEFAULT_REGION") or "ap-southeast-2").replace("_", "-")
 
 @lru_cache(maxsize=1)
 def _s3():
-    region = (os.getenv("AWS_REGION") or os.getenv("AWS_DEFAULT_REGION") or "ap-southeast-2").replace("_", "-")
-    kwargs = {"region_name": region}
     endpoint = os.getenv("S3_ENDPOINT")
+    config = Config(
+        max_pool_connections=S3_MAX_CONNECTIONS,
+        retries={"max_attempts": S3_MAX_ATTEMPTS, "mode": "adaptive"},
+        tcp_keepalive=True,
+        # MinIO/LocalStack/moto serve buckets by path, not by virtual host
+        s3={"addressing_style": "path" if endpoint else "auto"},
+    )
+    kwargs = {"region_name": _region(), "config": config}
     if endpoint:
         kwargs["endpoint_url"] = endpoint  # LocalStack/MinIO only
-    return boto3.client("s3", **kwargs)
+    return boto3.client("s3", **kwargs)  # boto3 clients are thread-safe
+
+def client():
+    """The shared, pooled S3 client."""
+    return _s3()
 
 def presign_upload(bucket: str, key: str, expires: int = 3600):
     """Returns a presigned POST policy so clients can upload directly to S3."""
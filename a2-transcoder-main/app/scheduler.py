@@ -0,0 +1,93 @@
+# app/scheduler.py
+"""
+Machine-wide CPU budget shared by every encode, in every worker process.
+"""
+from __future__ import annotations
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional
+import math
+import multiprocessing
+import os
+
+CPU_BUDGET = int(os.getenv("CPU_BUDGET", str(os.cpu_count() or 2)))
+MAX_THREADS_PER_ENCODE = int(os.getenv("MAX_THREADS_PER_ENCODE", "16"))  # x264 scales poorly past this
+
+# Slower presets do more work per frame and keep extra threads busy.
+_PRESET_WEIGHT = {"low": 0.5, "medium": 0.75, "high": 1.0, "max": 1.0}
+
+class CoreBudget:
+    def __init__(self, total: int = CPU_BUDGET):
+        ctx = multiprocessing.get_context("spawn")
+        self.total = max(1, total)
+        self._cond = ctx.Condition()
+        self._used = ctx.Value("i", 0, lock=False)      # cores handed out
+        self._encoders = ctx.Value("i", 0, lock=False)  # ffmpeg processes holding a slot
+        self._waiting = ctx.Value("i", 0, lock=False)   # requests blocked on the budget
+
+    def threads_for(self, width: int, height: int, intensity: str = "high") -> int:
+        """Cores worth giving one encode of this size at this preset."""
+        mp = (width * height) / 1_000_000
+        weight = _PRESET_WEIGHT.get((intensity or "high").lower(), 1.0)
+        want = math.ceil(1 + 2 * mp * weight)
+        return max(1, min(want, MAX_THREADS_PER_ENCODE, self.total))
+
+    def acquire(self, cores: int) -> int:
+        cores = max(1, min(cores, self.total))
+        with self._cond:
+            self._waiting.value += 1
+            try:
+                while self._used.value + cores > self.total:
+                    self._cond.wait()
+            finally:
+                self._waiting.value -= 1
+            self._used.value += cores
+            self._encoders.value += 1
+        return cores
+
+    def release(self, cores: int) -> None:
+        with self._cond:
+            self._used.value -= cores
+            self._encoders.value -= 1
+            self._cond.notify_all()
+
+    @contextmanager
+    def slot(self, cores: int) -> Iterator[int]:
+        """Hold `cores` of the budget for the duration; yields the granted count."""
+        granted = self.acquire(cores)
+        try:
+            yield granted
+        finally:
+            self.release(granted)
+
+    def stats(self) -> Dict[str, float]:
+        with self._cond:
+            used = self._used.value
+            return {
+                "total_cores": self.total,
+                "used_cores": used,
+                "utilization": round(used / self.total, 3),
+                "running_encoders": self._encoders.value,
+                "queue_depth": self._waiting.value,
+            }
+
+_BUDGET: Optional[CoreBudget] = None
+
+def install(budget: CoreBudget) -> None:
+    """Process-pool initializer: adopt the parent's shared budget."""
+    global _BUDGET
+    _BUDGET = budget
+
+def reset() -> CoreBudget:
+    """
+    Replace this process's budget with a fresh one, for a new worker pool:
+    cores (or the lock) held by processes of a pool that died are never given back.
+    """
+    global _BUDGET
+    _BUDGET = CoreBudget()
+    return _BUDGET
+
+def get_budget() -> CoreBudget:
+    global _BUDGET
+    if _BUDGET is None:
+        _BUDGET = CoreBudget()
+    return _BUDGET
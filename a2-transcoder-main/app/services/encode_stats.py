@@ -0,0 +1,111 @@
+# app/services/encode_stats.py
+"""
+Measured encoder throughput per preset, and deadline-aware preset choice.
+"""
+from __future__ import annotations
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+import os
+
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from ..ffmpeg_runner import can_remux
+from ..models import EncodeStat
+from ..scheduler import get_budget
+
+PRESETS = ["max", "high", "medium", "low"]  # slowest (best compression) first
+DEADLINE_SAFETY = float(os.getenv("DEADLINE_SAFETY", "0.85"))  # plan to use this share of the time left
+EWMA_ALPHA = float(os.getenv("ENCODE_STATS_ALPHA", "0.3"))
+PRIOR_WEIGHT = 2  # samples of history worth as much as the prior
+DEFAULT_FPS = 30.0
+# Cold-start guess: megapixel-frames per second per core for x264 at each preset
+_PRIOR_PER_CORE = {"low": 50.0, "medium": 16.0, "high": 5.0, "max": 1.0}
+
+def _work(spec: Dict[str, Any], duration: float, fps: Optional[float]) -> float:
+    """Output megapixel-frames of one rendition."""
+    mp = int(spec.get("width", 1280)) * int(spec.get("height", 720)) / 1_000_000
+    return mp * duration * (fps or DEFAULT_FPS)
+
+def _prior(intensity: str, spec: Dict[str, Any]) -> float:
+    cores = get_budget().threads_for(int(spec.get("width", 1280)), int(spec.get("height", 720)), intensity)
+    return _PRIOR_PER_CORE.get(intensity, 5.0) * cores
+
+def history(db: Session) -> Dict[Tuple[str, str], EncodeStat]:
+    return {(r.intensity, r.mode): r for r in db.query(EncodeStat).all()}
+
+def _rate(history: Dict[Tuple[str, str], EncodeStat], intensity: str, mode: str, spec: Dict[str, Any]) -> float:
+    prior = _prior(intensity, spec)
+    row = history.get((intensity, mode))
+    if not row or not row.samples:
+        return prior
+    n = row.samples
+    return (prior * PRIOR_WEIGHT + row.mpx_per_second * n) / (PRIOR_WEIGHT + n)
+
+def predict(
+    history: Dict[Tuple[str, str], EncodeStat],
+    specs: List[Dict[str, Any]],
+    intensity: str,
+    mode: str,
+    duration: float,
+    fps: Optional[float],
+    source: Optional[Dict[str, Any]] = None,
+) -> float:
+    """Seconds to encode specs one after another at this preset (remuxed rungs are free)."""
+    return sum(
+        _work(s, duration, fps) / _rate(history, intensity, mode, s)
+        for s in specs
+        if not can_remux(source, int(s.get("width", 0)), int(s.get("height", 0)), int(s.get("crf", 23)))
+    )
+
+def choose(
+    history: Dict[Tuple[str, str], EncodeStat],
+    specs: List[Dict[str, Any]],
+    mode: str,
+    duration: float,
+    fps: Optional[float],
+    seconds_left: float,
+    slowest: str = "high",
+    source: Optional[Dict[str, Any]] = None,
+) -> Tuple[str, float, bool]:
+    """
+    Slowest preset, no slower than `slowest`, predicted to finish specs within
+    seconds_left. Returns (intensity, predicted_seconds, meets_deadline). If
+    none fits, the fastest preset is returned with meets_deadline False.
+    """
+    allowed = PRESETS[PRESETS.index(slowest):] if slowest in PRESETS else PRESETS[1:]
+    budget = seconds_left * DEADLINE_SAFETY
+    predicted = 0.0
+    for intensity in allowed:
+        predicted = predict(history, specs, intensity, mode, duration, fps, source)
+        if predicted <= budget:
+            return intensity, predicted, True
+    return allowed[-1], predicted, False
+
+def record(db: Session, intensity: str, mode: str, work: float, seconds: float) -> None:
+    """
+    Fold one encode's throughput into the preset's average. Meant to be its
+    own unit of work (state_store.write): a concurrent first insert is resolved
+    by rolling back and updating the other worker's row. Caller commits.
+    """
+    if work <= 0 or seconds <= 0:
+        return
+    rate, now = work / seconds, datetime.utcnow()
+    row = db.get(EncodeStat, (intensity, mode))
+    if row is None:
+        db.add(EncodeStat(intensity=intensity, mode=mode, samples=1, mpx_per_second=rate, updated_at=now))
+        try:
+            db.flush()
+            return
+        except IntegrityError:
+            db.rollback()
+            row = db.get(EncodeStat, (intensity, mode))
+            if row is None:
+                raise
+    row.mpx_per_second = EWMA_ALPHA * rate + (1 - EWMA_ALPHA) * row.mpx_per_second
+    row.samples += 1
+    row.updated_at = now
+
+def encoded_work(results: List[Dict[str, Any]], duration: float, fps: Optional[float]) -> float:
+    """Megapixel-frames actually encoded by a transcode() call (remuxes excluded)."""
+    return sum(_work(r, duration, fps) for r in results if not r.get("fast_path") and r.get("width"))
@@ -0,0 +1,238 @@
+# app/services/input_cache.py
+"""
+Node-local LRU disk cache of job inputs fetched from remote storage.
+"""
+from __future__ import annotations
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+import fcntl
+import hashlib
+import os
+import re
+import tempfile
+import threading
+from pathlib import Path
+
+from .. import metrics
+from .storage import get_stream, stat
+
+CACHE_DIR = Path(os.getenv("INPUT_CACHE_DIR") or os.path.join(tempfile.gettempdir(), "transcoder-input-cache"))
+MAX_BYTES = int(os.getenv("INPUT_CACHE_BYTES", str(20 * 1024 ** 3)))  # 20 GiB of sources; 0 disables
+ENABLED = MAX_BYTES > 0
+
+class Pin:
+    """A cached input in use; path stays valid until release()."""
+
+    def __init__(self, path: Path, fd: int):
+        self.path = path
+        self._fd: Optional[int] = fd
+        self._lock = threading.Lock()
+
+    def release(self) -> None:
+        with self._lock:
+            if self._fd is not None:
+                os.close(self._fd)  # drops the shared lock
+                self._fd = None
+
+def _suffix(suffix: str) -> str:
+    return suffix.lower() if re.fullmatch(r"\.[A-Za-z0-9]{1,10}", suffix or "") else ""
+
+def _entry(key: str, meta: Dict[str, Any], suffix: str) -> str:
+    return hashlib.sha256(f"{key}\0{meta['etag']}\0{meta['size']}\0{suffix}".encode()).hexdigest()
+
+def _is_data(name: str) -> bool:
+    return name.split(".", 2)[1:2] == ["data"]  # <h>.data or <h>.data.<ext>
+
+@contextmanager
+def _flock(path: Path) -> Iterator[None]:
+    """Exclusive lock on path (created if missing), re-taken if eviction unlinked the file meanwhile."""
+    while True:
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                current = os.fstat(fd).st_ino == os.stat(path).st_ino
+            except FileNotFoundError:
+                current = False
+        except BaseException:
+            os.close(fd)
+            raise
+        if current:
+            break
+        os.close(fd)
+    try:
+        yield
+    finally:
+        os.close(fd)
+
+def _pin(path: Path) -> Optional[Pin]:
+    """Shared-lock path if it is (still) the cached entry; None if missing or just evicted."""
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except FileNotFoundError:
+        return None
+    try:
+        fcntl.flock(fd, fcntl.LOCK_SH)
+        if os.fstat(fd).st_ino != os.stat(path).st_ino:  # evicted between open and lock
+            raise FileNotFoundError(path)
+        os.utime(path)
+    except FileNotFoundError:
+        os.close(fd)
+        return None
+    except BaseException:
+        os.close(fd)
+        raise
+    return Pin(path, fd)
+
+def _unused(path: str) -> Optional[int]:
+    """An fd holding path's exclusive lock, or None if it is pinned (or gone)."""
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except FileNotFoundError:
+        return None
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        os.close(fd)
+        return None
+    return fd
+
+def _evict(path: str) -> bool:
+    """Remove an entry and its lock file unless it is pinned. Call under .evict.lock."""
+    fd = _unused(path)
+    if fd is None:
+        return not os.path.exists(path)
+    try:
+        os.remove(path)
+    finally:
+        os.close(fd)
+    lock = os.path.join(os.path.dirname(path), os.path.basename(path).split(".", 1)[0] + ".lock")
+    fd = _unused(lock)
+    if fd is not None:  # else a miss for this object holds it; it stays for that job
+        try:
+            os.remove(lock)  # a job about to lock the old file notices (see _flock) and takes the new one
+        finally:
+            os.close(fd)
+    metrics.inc("transcoder_input_cache_evictions_total")
+    return True
+
+def _reserve(h: str, size: int) -> Optional[Tuple[int, str]]:
+    """
+    Evict least recently used, unpinned entries until size more bytes fit,
+    and claim them with a pinned .part file to download into. Returns
+    (fd, part path), or None if pinned entries leave no room.
+    """
+    with _flock(CACHE_DIR / ".evict.lock"):
+        total = 0
+        entries: List[Tuple[float, int, str]] = []
+        with os.scandir(CACHE_DIR) as it:
+            for e in it:
+                try:
+                    if e.name.endswith(".part"):
+                        fd = _unused(e.path)
+                        if fd is None:  # a download in progress: its size is spoken for
+                            total += int(e.name.split(".")[1])
+                        else:  # left behind by a killed worker
+                            os.remove(e.path)
+                            os.close(fd)
+                    elif _is_data(e.name):
+                        st = e.stat()
+                        total += st.st_size
+                        entries.append((st.st_mtime, st.st_size, e.path))
+                except FileNotFoundError:
+                    continue
+        for _mtime, entry_size, path in sorted(entries):
+            if total + size <= MAX_BYTES:
+                break
+            if _evict(path):
+                total -= entry_size
+        if total + size > MAX_BYTES:
+            return None
+        fd, part = tempfile.mkstemp(dir=CACHE_DIR, prefix=f"{h}.{size}.", suffix=".part")
+        fcntl.flock(fd, fcntl.LOCK_SH)  # taken before .evict.lock is let go, so it's never seen unpinned
+        return fd, part
+
+def _download(key: str, path: Path, size: int, fd: int, part: str) -> Pin:
+    """Fetch into the reserved file, then publish it under path (still pinned: the lock moves with the inode)."""
+    try:
+        stream, _content_type = get_stream(key)
+        written = 0
+        for chunk in stream:  # type: ignore
+            written += os.write(fd, chunk)
+        if written != size:
+            raise IOError(f"{key}: got {written} bytes, expected {size}")
+        os.replace(part, path)
+    except BaseException:
+        os.close(fd)
+        try:
+            os.remove(part)
+        except OSError:
+            pass
+        raise
+    return Pin(path, fd)
+
+def acquire(key: str, suffix: str = "") -> Optional[Pin]:
+    """
+    Pinned local copy of a storage object, downloaded on a miss; suffix is
+    the source's extension (".ts"), kept on the cached file. Returns None
+    when the cache is disabled, the object is larger than the whole budget
+    or pinned entries leave no room for it. Raises FileNotFoundError if the
+    object is missing. Caller must release().
+    """
+    if not ENABLED:
+        return None
+    meta = stat(key)
+    if meta["size"] > MAX_BYTES:
+        metrics.inc("transcoder_input_cache_requests_total", result="bypass")
+        return None
+    suffix = _suffix(suffix)
+    h = _entry(key, meta, suffix)
+    path = CACHE_DIR / f"{h}.data{suffix}"
+    pin = _pin(path)
+    if pin:
+        metrics.inc("transcoder_input_cache_requests_total", result="hit")
+        metrics.inc("transcoder_input_cache_hit_bytes_total", meta["size"])
+        return pin
+
+    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    with _flock(CACHE_DIR / f"{h}.lock"):
+        pin = _pin(path)
+        if pin:  # another job fetched it while we waited
+            metrics.inc("transcoder_input_cache_requests_total", result="shared")
+            metrics.inc("transcoder_input_cache_hit_bytes_total", meta["size"])
+            return pin
+        reserved = _reserve(h, meta["size"])
+        if reserved is None:
+            metrics.inc("transcoder_input_cache_requests_total", result="bypass")
+            return None
+        pin = _download(key, path, meta["size"], *reserved)
+    metrics.inc("transcoder_input_cache_requests_total", result="miss")
+    return pin
+
+def stats() -> Dict[str, Any]:
+    """What is on this node's disk now (hit/miss counts are in /metrics)."""
+    entries = pinned = size = 0
+    try:
+        with os.scandir(CACHE_DIR) as it:
+            found = [e for e in it if _is_data(e.name)]
+    except FileNotFoundError:
+        found = []
+    for e in found:
+        try:
+            size += e.stat().st_size
+        except FileNotFoundError:
+            continue
+        entries += 1
+        fd = _unused(e.path)
+        if fd is None:
+            pinned += os.path.exists(e.path)
+        else:
+            os.close(fd)
+    return {"enabled": ENABLED, "dir": str(CACHE_DIR), "entries": entries, "pinned": pinned,
+            "size_bytes": size, "max_bytes": MAX_BYTES}
+
+def _samples():
+    if ENABLED:
+        yield "transcoder_input_cache_bytes", {}, stats()["size_bytes"]
+
+metrics.add_collector(_samples)
@@ -0,0 +1,42 @@
+# app/services/media_info.py
+"""
+Source media metadata: probe a stored object once (at upload) and keep the
+result on its Video row, so job creation, ladder fitting and progress/ETA
+never have to open the file again.
+"""
+from __future__ import annotations
+from typing import Any, Dict, Optional
+
+from ..ffmpeg_runner import probe
+from ..models import Video
+from .storage import local_path, presign_get
+
+PROBE_FIELDS = ("duration_sec", "width", "height", "video_codec", "pix_fmt", "fps", "bitrate")
+
+def probe_object(key: str) -> Optional[Dict[str, Any]]:
+    """ffprobe a stored object in place (local file or presigned URL); None if unreadable."""
+    try:
+        src = local_path(key) or presign_get(key, ttl=300)
+    except FileNotFoundError:
+        return None
+    return probe(src) if src else None
+
+def apply(video: Video, info: Optional[Dict[str, Any]]) -> None:
+    for field in PROBE_FIELDS:
+        setattr(video, field, (info or {}).get(field))
+
+def describe(video: Video) -> Optional[Dict[str, Any]]:
+    """The probed fields, or None if the video was never (successfully) probed."""
+    if not video.width or not video.height:
+        return None
+    return {field: getattr(video, field) for field in PROBE_FIELDS}
+
+def ensure_probed(video: Video) -> bool:
+    """Probe rows uploaded before probing existed (or when it failed). Caller commits."""
+    if describe(video) is not None:
+        return False
+    info = probe_object(video.filename)
+    if not info:
+        return False
+    apply(video, info)
+    return True
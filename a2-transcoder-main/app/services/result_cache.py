@@ -0,0 +1,175 @@
+# app/services/result_cache.py
+"""
+Reuse of finished transcodes across jobs (and owners), keyed on the source's
+content hash and everything that shapes the outputs.
+"""
+from __future__ import annotations
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+import hashlib
+import json
+import logging
+import os
+import threading
+
+from sqlalchemy import func, update
+from sqlalchemy.orm import Session
+
+from ..models import CacheObjects, TranscodeCache
+from .storage import delete_prefix
+
+log = logging.getLogger(__name__)
+
+ENABLED = os.getenv("RESULT_CACHE", "1") in {"1", "true", "True"}
+MAX_BYTES = int(os.getenv("RESULT_CACHE_MAX_BYTES", str(50 * 1024 ** 3)))  # output objects kept for reuse
+
+_lock = threading.Lock()
+_counters = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+
+def _count(name: str, n: int = 1) -> None:
+    with _lock:
+        _counters[name] += n
+
+def stats() -> Dict[str, int]:
+    with _lock:
+        return dict(_counters)
+
+def usage(db: Session) -> Tuple[int, int]:
+    """(entries, bytes of the output objects they hold)."""
+    n = db.query(func.count(TranscodeCache.cache_key)).scalar()
+    size = db.query(func.coalesce(func.sum(CacheObjects.size_bytes), 0)).scalar()
+    return int(n), int(size)
+
+def _normalize(specs: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    # Only the fields that change the encoded bytes; order doesn't matter.
+    out = []
+    for r in specs:
+        w = int(r.get("width", 1280))
+        h = int(r.get("height", 720))
+        out.append({
+            "width": w,
+            "height": h,
+            "crf": int(r.get("crf", 23)),
+            "suffix": str(r.get("suffix", f"{w}x{h}")),
+            "fitted": bool(r.get("fitted")),  # exact size vs. aspect-kept box
+        })
+    return sorted(out, key=lambda r: (r["width"], r["height"], r["crf"], r["suffix"]))
+
+def cache_key(
+    content_hash: str,
+    specs: List[Dict[str, Any]],
+    intensity: str,
+    mode: str = "parallel",
+    packaging: str = "mp4",
+    thumbnails: Optional[Dict[str, Any]] = None,
+) -> str:
+    """Stable key for (input bytes, rendition ladder, x264 preset, mode, output packaging, thumbnails)."""
+    doc = {
+        "content": content_hash,
+        "specs": _normalize(specs),
+        "intensity": (intensity or "high").lower(),
+        # each mode encodes differently; packaging always runs its own ladder
+        "mode": (mode or "parallel") if (packaging or "mp4") == "mp4" else None,
+        "packaging": packaging or "mp4",
+    }
+    if thumbnails:  # only when set, so existing entries keep their keys
+        doc["thumbnails"] = thumbnails
+    return hashlib.sha256(json.dumps(doc, sort_keys=True).encode()).hexdigest()
+
+def lookup(db: Session, key: str, commit: bool = True) -> Optional[List[Dict[str, Any]]]:
+    """Return cached outputs (and bump LRU/hit stats) or None. commit=False leaves the bump to the caller."""
+    if not ENABLED:
+        return None
+    row = db.get(TranscodeCache, key)
+    if not row:
+        _count("misses")
+        return None
+    row.hits += 1
+    row.last_used_at = datetime.utcnow()
+    if commit:
+        db.commit()
+    _count("hits")
+    return json.loads(row.outputs_json)
+
+def _tree(outputs: List[Dict[str, Any]]) -> Tuple[str, int]:
+    """(the producing job's key prefix, bytes under it); a package counts every segment."""
+    o = outputs[0]
+    prefix = o["key"][:len(o["key"]) - len(o["name"])]
+    packaged = [int(o["package_bytes"]) for o in outputs if o.get("package_bytes")]
+    return prefix, max(packaged) if packaged else sum(int(o.get("size_bytes") or 0) for o in outputs)
+
+def _hold(db: Session, prefix: str, size: int) -> None:
+    if not db.execute(update(CacheObjects).where(CacheObjects.prefix == prefix)
+                      .values(refs=CacheObjects.refs + 1)).rowcount:
+        db.add(CacheObjects(prefix=prefix, size_bytes=size, refs=1))
+        db.flush()
+
+def _drop(db: Session, prefix: str) -> Optional[CacheObjects]:
+    """Release one reference; returns the row if that was the last one (objects now unreferenced)."""
+    row = db.get(CacheObjects, prefix)
+    if row is None:
+        return None  # an entry from before refcounting: its objects stay
+    row.refs -= 1
+    if row.refs > 0:
+        return None
+    db.delete(row)
+    return row
+
+def _delete(prefixes: List[str]) -> None:
+    for prefix in prefixes:
+        try:
+            delete_prefix(prefix)
+        except Exception:  # an orphan in storage, not a broken entry
+            log.exception("result cache: deleting %s failed", prefix)
+
+def store(db: Session, key: str, content_hash: str, job_id: int, outputs: List[Dict[str, Any]]) -> None:
+    """Remember a finished job's outputs, then evict down to MAX_BYTES."""
+    if not ENABLED or not outputs:
+        return
+    prefix, size = _tree(outputs)
+    # Presigned URLs expire; callers re-sign on every hit
+    kept = [{k: v for k, v in o.items() if k != "url"} for o in outputs]
+    _hold(db, prefix, size)
+    freed = []
+    row = db.get(TranscodeCache, key)
+    if row is None:
+        row = TranscodeCache(cache_key=key, content_hash=content_hash)
+        db.add(row)
+    elif row.outputs_json:
+        old = json.loads(row.outputs_json)
+        gone = _drop(db, _tree(old)[0]) if old else None
+        if gone is not None:
+            freed.append(gone.prefix)
+    row.job_id = job_id
+    row.outputs_json = json.dumps(kept)
+    row.size_bytes = size
+    row.last_used_at = datetime.utcnow()
+    db.commit()
+    _delete(freed)
+    _count("stores")
+    evict(db)
+
+def evict(db: Session, max_bytes: Optional[int] = None) -> int:
+    """
+    Drop least-recently-used entries until the objects they hold fit in
+    max_bytes (default MAX_BYTES), deleting objects no entry holds any more.
+    """
+    max_bytes = MAX_BYTES if max_bytes is None else max_bytes
+    _n, total = usage(db)
+    if total <= max_bytes:
+        return 0
+    dropped, freed = 0, []
+    for row in db.query(TranscodeCache).order_by(TranscodeCache.last_used_at.asc()).all():
+        if total <= max_bytes:
+            break
+        outputs = json.loads(row.outputs_json or "[]")
+        gone = _drop(db, _tree(outputs)[0]) if outputs else None
+        if gone is not None:
+            total -= gone.size_bytes
+            freed.append(gone.prefix)
+        db.delete(row)
+        dropped += 1
+    db.commit()  # forget the entries before their objects go
+    _delete(freed)
+    _count("evictions", dropped)
+    return dropped
@@ -1,10 +1,75 @@
 # app/services/storage.py
 from __future__ import annotations
-from typing import Tuple, Iterator, Optional
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Deque, Tuple, Iterator, Optional, Iterable, BinaryIO, TypeVar, Union, List, Dict, Any
+import functools
+import hashlib
+import mimetypes
 import os
+import shutil
 import tempfile
+import time
 
-_BACKEND = os.getenv("STORAGE_BACKEND", "local-temp")  # will be "s3" later
+from botocore.exceptions import ClientError
+
+from .. import metrics
+from ..s3_utils import client, presign_download
+
+_BACKEND = os.getenv("STORAGE_BACKEND", "local-temp")  # local-temp | s3
+CHUNK_SIZE = int(os.getenv("STORAGE_CHUNK_SIZE", str(1024 * 1024)))
+
+# S3 transfers: objects above one part go multipart (upload) or are fetched as
+# parallel ranged GETs (download). S3 requires parts >= 5 MiB and allows
+# 10,000 of them, so the 16 MiB default covers objects up to ~160 GB.
+S3_PART_SIZE = max(5 * 1024 * 1024, int(os.getenv("S3_PART_SIZE", str(16 * 1024 * 1024))))
+S3_TRANSFER_CONCURRENCY = int(os.getenv("S3_TRANSFER_CONCURRENCY", "8"))  # parts in flight per transfer
+S3_PARALLEL_GET_THRESHOLD = int(os.getenv("S3_PARALLEL_GET_THRESHOLD", str(4 * S3_PART_SIZE)))
+# Shared by every transfer in the process, so part traffic stays within the client's connection pool
+_TRANSFERS = ThreadPoolExecutor(max_workers=S3_TRANSFER_CONCURRENCY, thread_name_prefix="s3-part")
+
+F = TypeVar("F", bound=Callable[..., Any])
+
+def _instrumented(op: str) -> Callable[[F], F]:
+    """Export the call's latency (and failures other than a missing object) by op and backend."""
+    def wrap(fn: F) -> F:
+        @functools.wraps(fn)
+        def inner(*args: Any, **kwargs: Any) -> Any:
+            t0 = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            except FileNotFoundError:
+                raise
+            except Exception:
+                metrics.inc("transcoder_storage_errors_total", op=op, backend=_BACKEND)
+                raise
+            finally:
+                metrics.observe("transcoder_storage_op_seconds", time.perf_counter() - t0, op=op, backend=_BACKEND)
+        return inner  # type: ignore[return-value]
+    return wrap
+
+def _counted(chunks: Iterator[bytes], op: str) -> Iterator[bytes]:
+    """Count bytes as the reader consumes them, so partial reads are counted too."""
+    for chunk in chunks:
+        metrics.inc("transcoder_storage_bytes_total", len(chunk), op=op, backend=_BACKEND)
+        yield chunk
+
+def _bucket() -> str:
+    bucket = os.getenv("S3_BUCKET")
+    if not bucket:
+        raise RuntimeError("S3_BUCKET env not set")
+    return bucket
+
+def _missing(e: ClientError) -> bool:
+    return e.response.get("Error", {}).get("Code") in {"404", "NoSuchKey", "NotFound"}
+
+def _s3_head(key: str) -> Dict[str, Any]:
+    try:
+        return client().head_object(Bucket=_bucket(), Key=key)
+    except ClientError as e:
+        if _missing(e):
+            raise FileNotFoundError(key) from e
+        raise
 
 def _safe_temp_path(key: str) -> str:
     # Simulate S3-style object keys under the OS temp dir, safely.
@@ -24,15 +89,130 @@ def _safe_temp_path(key: str) -> str:
     os.makedirs(os.path.dirname(path), exist_ok=True)
     return path
 
+@_instrumented("put")
 def put_bytes(key: str, data: bytes, content_type: str = "application/octet-stream") -> None:
     if _BACKEND == "local-temp":
         path = _safe_temp_path(key)
         with open(path, "wb") as f:
             f.write(data)
+    elif _BACKEND == "s3":
+        client().put_object(Bucket=_bucket(), Key=key, Body=data, ContentType=content_type)
+    else:
+        raise NotImplementedError(f"Unknown STORAGE_BACKEND {_BACKEND!r}")
+    metrics.inc("transcoder_storage_bytes_total", len(data), op="put", backend=_BACKEND)
+
+def _iter_chunks(src: Union[BinaryIO, Iterable[bytes]]) -> Iterator[bytes]:
+    # Accept either a file-like object or an iterator of byte chunks.
+    if hasattr(src, "read"):
+        while True:
+            chunk = src.read(CHUNK_SIZE)  # type: ignore[union-attr]
+            if not chunk:
+                break
+            yield chunk
         return
-    raise NotImplementedError("S3 backend not wired yet")
+    for chunk in src:  # type: ignore[union-attr]
+        if chunk:
+            yield chunk
 
-def get_stream(key: str) -> Tuple[Iterator[bytes], str]:
+@_instrumented("put")
+def put_stream(
+    key: str,
+    src: Union[BinaryIO, Iterable[bytes]],
+    content_type: str = "application/octet-stream",
+) -> Tuple[int, str]:
+    """
+    Copy src into storage in CHUNK_SIZE pieces without buffering it whole.
+    Returns (size_bytes, sha256_hex) computed on the way through.
+    """
+    digest = hashlib.sha256()
+    size = 0
+    if _BACKEND == "local-temp":
+        path = _safe_temp_path(key)
+        part = path + ".part"
+        try:
+            with open(part, "wb") as f:
+                for chunk in _counted(_iter_chunks(src), "put"):
+                    digest.update(chunk)
+                    size += len(chunk)
+                    f.write(chunk)
+            os.replace(part, path)  # readers never see a half-written object
+        except Exception:
+            try:
+                os.remove(part)
+            except OSError:
+                pass
+            raise
+        return size, digest.hexdigest()
+    if _BACKEND == "s3":
+        return _s3_put_stream(key, src, content_type)
+    raise NotImplementedError(f"Unknown STORAGE_BACKEND {_BACKEND!r}")
+
+def _s3_put_stream(key: str, src: Union[BinaryIO, Iterable[bytes]], content_type: str) -> Tuple[int, str]:
+    """
+    Read src sequentially into S3_PART_SIZE parts and upload them concurrently
+    (at most S3_TRANSFER_CONCURRENCY in flight, which also bounds memory).
+    Small objects are a single PUT. Until the multipart upload completes the
+    object doesn't exist, so readers never see a partial one.
+    """
+    s3, bucket = client(), _bucket()
+    digest = hashlib.sha256()
+    size = 0
+    buf = bytearray()
+    upload_id: Optional[str] = None
+    parts: List[Dict[str, Any]] = []
+    pending: Deque[Future] = deque()
+
+    def _part(number: int, body: bytes) -> Dict[str, Any]:
+        resp = s3.upload_part(Bucket=bucket, Key=key, UploadId=upload_id, PartNumber=number, Body=body)
+        return {"PartNumber": number, "ETag": resp["ETag"]}
+
+    def _flush() -> None:
+        nonlocal upload_id, buf
+        if upload_id is None:
+            upload_id = s3.create_multipart_upload(Bucket=bucket, Key=key, ContentType=content_type)["UploadId"]
+        while len(pending) >= S3_TRANSFER_CONCURRENCY:
+            parts.append(pending.popleft().result())
+        pending.append(_TRANSFERS.submit(_part, len(parts) + len(pending) + 1, bytes(buf)))
+        buf = bytearray()
+
+    try:
+        for chunk in _counted(_iter_chunks(src), "put"):
+            digest.update(chunk)
+            size += len(chunk)
+            buf += chunk
+            if len(buf) >= S3_PART_SIZE:
+                _flush()
+        if upload_id is None:
+            s3.put_object(Bucket=bucket, Key=key, Body=bytes(buf), ContentType=content_type)
+            return size, digest.hexdigest()
+        if buf:
+            _flush()
+        while pending:
+            parts.append(pending.popleft().result())
+        s3.complete_multipart_upload(Bucket=bucket, Key=key, UploadId=upload_id, MultipartUpload={"Parts": parts})
+    except BaseException:
+        for fut in pending:
+            fut.cancel()
+        if upload_id is not None:
+            try:
+                s3.abort_multipart_upload(Bucket=bucket, Key=key, UploadId=upload_id)
+            except ClientError:
+                pass
+        raise
+    return size, digest.hexdigest()
+
+def put_file(key: str, path: str, content_type: str = "application/octet-stream") -> Tuple[int, str]:
+    """Upload a local file in CHUNK_SIZE pieces; see put_stream."""
+    with open(path, "rb") as f:
+        return put_stream(key, f, content_type)
+
+@_instrumented("get")
+def get_stream(key: str, byte_range: Optional[Tuple[int, int]] = None) -> Tuple[Iterator[bytes], str]:
+    """Stream an object (or the inclusive byte_range=(start, end) of it)."""
+    stream, content_type = _get_stream(key, byte_range)
+    return _counted(stream, "get"), content_type
+
+def _get_stream(key: str, byte_range: Optional[Tuple[int, int]]) -> Tuple[Iterator[bytes], str]:
     if _BACKEND == "local-temp":
         path = _safe_temp_path(key)
         if not os.path.exists(path):
@@ -40,15 +220,159 @@ def get_stream(key: str) -> Tuple[Iterator[bytes], str]:
 
         def _iter() -> Iterator[bytes]:
             with open(path, "rb") as f:
-                while True:
-                    chunk = f.read(1024 * 1024)
+                remaining = None
+                if byte_range:
+                    f.seek(byte_range[0])
+                    remaining = byte_range[1] - byte_range[0] + 1
+                while remaining is None or remaining > 0:
+                    n = CHUNK_SIZE if remaining is None else min(CHUNK_SIZE, remaining)
+                    chunk = f.read(n)
                     if not chunk:
                         break
+                    if remaining is not None:
+                        remaining -= len(chunk)
                     yield chunk
 
         return _iter(), "application/octet-stream"
-    raise NotImplementedError("S3 backend not wired yet")
+    if _BACKEND == "s3":
+        return _s3_get_stream(key, byte_range)
+    raise NotImplementedError(f"Unknown STORAGE_BACKEND {_BACKEND!r}")
+
+def _s3_get_stream(key: str, byte_range: Optional[Tuple[int, int]]) -> Tuple[Iterator[bytes], str]:
+    s3, bucket = client(), _bucket()
+    if byte_range and byte_range[1] - byte_range[0] + 1 < S3_PARALLEL_GET_THRESHOLD:
+        try:
+            resp = s3.get_object(Bucket=bucket, Key=key, Range=f"bytes={byte_range[0]}-{byte_range[1]}")
+        except ClientError as e:
+            if _missing(e):
+                raise FileNotFoundError(key) from e
+            raise
+        return resp["Body"].iter_chunks(CHUNK_SIZE), resp.get("ContentType") or "application/octet-stream"
+
+    head = _s3_head(key)
+    size = head["ContentLength"]
+    content_type = head.get("ContentType") or "application/octet-stream"
+    start, end = byte_range or (0, size - 1)
+    end = min(end, size - 1)
+    if end - start + 1 < S3_PARALLEL_GET_THRESHOLD:
+        kwargs = {"Range": f"bytes={start}-{end}"} if byte_range else {}
+        resp = s3.get_object(Bucket=bucket, Key=key, IfMatch=head["ETag"], **kwargs)
+        return resp["Body"].iter_chunks(CHUNK_SIZE), content_type
+    return _s3_parallel_ranges(key, start, end, head["ETag"]), content_type
+
+def _s3_parallel_ranges(key: str, start: int, end: int, etag: str) -> Iterator[bytes]:
+    """
+    Fetch [start, end] as S3_PART_SIZE ranged GETs, S3_TRANSFER_CONCURRENCY
+    ahead of the reader, and yield them in order. IfMatch pins every part to
+    the same object version, so an overwrite mid-read fails instead of mixing.
+    """
+    s3, bucket = client(), _bucket()
+    offsets = iter(range(start, end + 1, S3_PART_SIZE))
+    pending: Deque[Future] = deque()
+
+    def _fetch(lo: int) -> bytes:
+        hi = min(lo + S3_PART_SIZE - 1, end)
+        return s3.get_object(Bucket=bucket, Key=key, Range=f"bytes={lo}-{hi}", IfMatch=etag)["Body"].read()
+
+    def _ahead() -> None:
+        lo = next(offsets, None)
+        if lo is not None:
+            pending.append(_TRANSFERS.submit(_fetch, lo))
+
+    try:
+        for _ in range(S3_TRANSFER_CONCURRENCY):
+            _ahead()
+        while pending:
+            data = pending.popleft().result()
+            _ahead()
+            for i in range(0, len(data), CHUNK_SIZE):
+                yield data[i:i + CHUNK_SIZE]
+    finally:
+        for fut in pending:
+            fut.cancel()
+
+@_instrumented("stat")
+def stat(key: str) -> dict:
+    """Object metadata: {size, etag, last_modified (epoch s), content_type}."""
+    if _BACKEND == "local-temp":
+        path = _safe_temp_path(key)
+        st = os.stat(path)  # FileNotFoundError if missing
+        return {
+            "size": st.st_size,
+            "etag": f'"{st.st_size:x}-{st.st_mtime_ns:x}"',
+            "last_modified": st.st_mtime,
+            "content_type": mimetypes.guess_type(key)[0] or "application/octet-stream",
+        }
+    if _BACKEND == "s3":
+        head = _s3_head(key)
+        return {
+            "size": head["ContentLength"],
+            "etag": head["ETag"],
+            "last_modified": head["LastModified"].timestamp(),
+            "content_type": head.get("ContentType") or mimetypes.guess_type(key)[0] or "application/octet-stream",
+        }
+    raise NotImplementedError(f"Unknown STORAGE_BACKEND {_BACKEND!r}")
+
+@_instrumented("exists")
+def exists(key: str) -> bool:
+    if _BACKEND == "local-temp":
+        return os.path.exists(_safe_temp_path(key))
+    if _BACKEND == "s3":
+        try:
+            _s3_head(key)
+        except FileNotFoundError:
+            return False
+        return True
+    raise NotImplementedError(f"Unknown STORAGE_BACKEND {_BACKEND!r}")
+
+@_instrumented("delete")
+def delete(key: str) -> None:
+    if _BACKEND == "local-temp":
+        try:
+            os.remove(_safe_temp_path(key))
+        except FileNotFoundError:
+            pass
+        return
+    if _BACKEND == "s3":
+        client().delete_object(Bucket=_bucket(), Key=key)
+        return
+    raise NotImplementedError(f"Unknown STORAGE_BACKEND {_BACKEND!r}")
+
+@_instrumented("delete")
+def delete_prefix(prefix: str) -> int:
+    """Delete every object under prefix ("outputs/job_7/"); returns how many there were."""
+    if not prefix.strip("/") or not prefix.endswith("/"):
+        raise ValueError("Invalid prefix")
+    if _BACKEND == "local-temp":
+        root = _safe_temp_path(prefix)
+        n = sum(len(files) for _dir, _subdirs, files in os.walk(root))
+        shutil.rmtree(root, ignore_errors=True)
+        return n
+    if _BACKEND == "s3":
+        s3, bucket, n = client(), _bucket(), 0
+        for page in s3.get_paginator("list_objects_v2").paginate(Bucket=bucket, Prefix=prefix):
+            keys = [{"Key": o["Key"]} for o in page.get("Contents", [])]  # at most 1000, DeleteObjects' cap
+            if keys:
+                s3.delete_objects(Bucket=bucket, Delete={"Objects": keys, "Quiet": True})
+                n += len(keys)
+        return n
+    raise NotImplementedError(f"Unknown STORAGE_BACKEND {_BACKEND!r}")
+
+def local_path(key: str) -> Optional[str]:
+    """
+    Return a filesystem path for the object if this backend keeps it on local
+    disk, so readers can open/link/mmap it directly instead of copying.
+    Treat the file as read-only. Returns None for remote backends.
+    """
+    if _BACKEND == "local-temp":
+        path = _safe_temp_path(key)
+        if not os.path.exists(path):
+            raise FileNotFoundError(key)
+        return path
+    return None
 
 def presign_get(key: str, ttl: int = 300) -> Optional[str]:
+    if _BACKEND == "s3":
+        return presign_download(_bucket(), key, expires=ttl)
     # Local-temp has no presigned URL concept. Return None so callers stream.
     return None
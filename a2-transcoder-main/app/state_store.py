@@ -0,0 +1,206 @@
+# app/state_store.py
+"""
+Write path for job state.
+
+Every state change runs as one short unit of work through write(). On
+SQLite's "database is locked" / busy (or a Postgres serialization
+failure) the unit is retried with jittered backoff instead of failing the
+job. Hot, overwrite-only columns (progress) go through UPDATES instead. It
+keeps the latest value per job and flushes every job in this process in one
+transaction, so N running jobs cost one commit per STATE_FLUSH_SECONDS, not N.
+Contention counters live in multiprocessing shared memory (installed into the
+worker pool like the CPU budget), so stats() covers every process.
+"""
+from __future__ import annotations
+from typing import Any, Callable, Dict, Optional, TypeVar
+import atexit
+import logging
+import multiprocessing
+import os
+import random
+import threading
+import time
+
+from sqlalchemy import update
+from sqlalchemy.exc import OperationalError, DBAPIError
+from sqlalchemy.orm import Session
+
+from . import metrics
+from .models import Job, SessionLocal, engine
+
+log = logging.getLogger(__name__)
+
+WRITE_RETRIES = int(os.getenv("STATE_WRITE_RETRIES", "8"))
+FLUSH_SECONDS = float(os.getenv("STATE_FLUSH_SECONDS", "1"))
+
+T = TypeVar("T")
+
+_FIELDS = (
+    "writes",             # units of work committed
+    "write_seconds",      # total time inside successful units
+    "write_max_seconds",
+    "lock_retries",       # attempts that hit a locked/busy database and were retried
+    "lock_wait_seconds",  # time lost to those attempts and their backoff
+    "write_failures",     # units that gave up (or failed for another reason)
+    "coalesced",          # updates absorbed into an unflushed one for the same job
+    "flushes",
+    "flushed_rows",
+)
+_PG_RETRYABLE = {"40001", "40P01"}  # serialization_failure, deadlock_detected
+
+class Counters:
+    def __init__(self) -> None:
+        self._arr = multiprocessing.get_context("spawn").Array("d", len(_FIELDS))
+
+    def add(self, field: str, n: float = 1) -> None:
+        with self._arr.get_lock():
+            self._arr[_FIELDS.index(field)] += n
+
+    def peak(self, field: str, value: float) -> None:
+        i = _FIELDS.index(field)
+        with self._arr.get_lock():
+            if value > self._arr[i]:
+                self._arr[i] = value
+
+    def snapshot(self) -> Dict[str, float]:
+        with self._arr.get_lock():
+            return {f: round(v, 4) for f, v in zip(_FIELDS, self._arr)}
+
+_COUNTERS: Optional[Counters] = None
+
+def install(counters: Counters) -> None:
+    """Process-pool initializer: adopt the parent's shared counters."""
+    global _COUNTERS
+    _COUNTERS = counters
+
+def get_counters() -> Counters:
+    global _COUNTERS
+    if _COUNTERS is None:
+        _COUNTERS = Counters()
+    return _COUNTERS
+
+def _retryable(e: DBAPIError) -> bool:
+    if getattr(e.orig, "pgcode", None) in _PG_RETRYABLE:
+        return True
+    msg = str(e.orig).lower()
+    return isinstance(e, OperationalError) and ("locked" in msg or "busy" in msg)
+
+def write(fn: Callable[[Session], T], retries: int = WRITE_RETRIES) -> T:
+    """
+    Run fn(session) and commit, retrying the whole unit on lock contention.
+    fn may commit itself; it must be safe to run again after a rollback.
+    """
+    counters = get_counters()
+    delay = 0.02
+    for attempt in range(retries + 1):
+        db = SessionLocal()
+        t0 = time.perf_counter()
+        try:
+            result = fn(db)
+            db.commit()
+            took = time.perf_counter() - t0
+            counters.add("writes")
+            counters.add("write_seconds", took)
+            counters.peak("write_max_seconds", took)
+            metrics.observe("transcoder_db_commit_seconds", took)
+            return result
+        except DBAPIError as e:
+            db.rollback()
+            if not _retryable(e) or attempt == retries:
+                counters.add("write_failures")
+                raise
+            time.sleep(delay * (1 + random.random()))
+            delay = min(delay * 2, 1.0)
+            counters.add("lock_retries")
+            counters.add("lock_wait_seconds", time.perf_counter() - t0)
+        except Exception:
+            db.rollback()
+            counters.add("write_failures")
+            raise
+        finally:
+            db.close()
+    raise AssertionError("unreachable")
+
+class JobUpdates:
+    """Write-behind buffer for overwrite-only job columns; latest value wins."""
+
+    def __init__(self, interval: float = FLUSH_SECONDS):
+        self.interval = interval
+        self._pending: Dict[int, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        self._flushing = threading.Lock()  # batches commit in the order they were taken
+        self._closed = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def put(self, job_id: int, **values: Any) -> None:
+        with self._lock:
+            row = self._pending.setdefault(job_id, {})
+            if row:
+                get_counters().add("coalesced")
+            row.update(values)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name="job-updates", daemon=True)
+                self._thread.start()
+
+    def flush(self) -> int:
+        """Write everything pending now; returns the number of jobs updated."""
+        with self._flushing:
+            with self._lock:
+                batch, self._pending = self._pending, {}
+            if not batch:
+                return 0
+
+            def _apply(db: Session) -> None:
+                for job_id, values in batch.items():
+                    db.execute(update(Job).where(Job.id == job_id).values(**values))
+
+            try:
+                write(_apply)
+            except Exception:
+                with self._lock:  # keep it for the next flush; anything newer still wins
+                    for job_id, values in batch.items():
+                        self._pending[job_id] = {**values, **self._pending.get(job_id, {})}
+                raise
+            counters = get_counters()
+            counters.add("flushes")
+            counters.add("flushed_rows", len(batch))
+            return len(batch)
+
+    def close(self) -> None:
+        """Stop the background flusher and write what is still pending (at process exit)."""
+        self._closed.set()
+        try:
+            self.flush()
+        except Exception:
+            log.exception("job state flush failed")
+
+    def _loop(self) -> None:
+        while not self._closed.wait(self.interval):
+            try:
+                self.flush()
+            except Exception:
+                log.exception("job state flush failed")
+
+UPDATES = JobUpdates()
+atexit.register(UPDATES.close)  # job processes are spawned, so this runs when the pool shuts down
+
+_EVENTS = ("writes", "lock_retries", "write_failures", "coalesced", "flushes", "flushed_rows")
+
+def _samples():
+    snap = get_counters().snapshot()
+    for field in _EVENTS:
+        yield "transcoder_db_write_events_total", {"event": field}, snap[field]
+
+metrics.add_collector(_samples)
+
+def stats() -> Dict[str, Any]:
+    """Shared contention counters plus this process's connection pool state."""
+    out: Dict[str, Any] = get_counters().snapshot()
+    pool = engine.pool
+    out["pool"] = {
+        "class": type(pool).__name__,
+        "size": pool.size() if hasattr(pool, "size") else None,
+        "checked_out": pool.checkedout() if hasattr(pool, "checkedout") else None,
+        "overflow": pool.overflow() if hasattr(pool, "overflow") else None,
+    }
+    return out
@@ -0,0 +1,83 @@
+# app/worker.py
+"""
+Standalone job worker: python -m app.worker
+
+Runs the same Dispatcher as the API process, against the same database, so
+encode capacity scales by adding worker nodes rather than API replicas.
+Start the API with JOB_WORKERS_IN_API=0 to have it only enqueue. Any number
+of workers can share the database: claims are atomic (see app/job_queue.py),
+each running job's lease is renewed by its heartbeat, and jobs of a worker
+that died are requeued once their lease lapses. JOB_WORKERS sets the job
+processes per node; CPU_BUDGET the cores they share.
+
+The worker has no API to serve /metrics from, so it exposes its registry
+(including what its job processes forward) on WORKER_METRICS_PORT.
+
+SIGTERM/SIGINT stop claiming and let running jobs finish (scale-in); a
+second signal exits at once, leaving those jobs to lease recovery.
+"""
+from __future__ import annotations
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import logging
+import os
+import signal
+import threading
+
+from . import metrics
+from .job_queue import recover_stale
+from .jobs import DISPATCHER
+from .models import init_db
+from .state_store import write
+
+log = logging.getLogger("app.worker")
+
+METRICS_PORT = int(os.getenv("WORKER_METRICS_PORT", "9100"))  # 0 = don't serve metrics
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self) -> None:
+        if self.path.split("?", 1)[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = metrics.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args) -> None:  # scrapes would flood the log
+        pass
+
+def _serve_metrics(port: int) -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer(("", port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    return server
+
+def main() -> None:
+    logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO"), format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    init_db()
+    metrics.get_forwarder().start()
+    if METRICS_PORT:
+        _serve_metrics(METRICS_PORT)
+
+    stop = threading.Event()
+
+    def _on_signal(signum, _frame) -> None:
+        log.info("%s: draining running jobs (signal again to exit now)", signal.Signals(signum).name)
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+        stop.set()
+
+    signal.signal(signal.SIGTERM, _on_signal)
+    signal.signal(signal.SIGINT, _on_signal)
+
+    write(recover_stale)  # leases that lapsed while no dispatcher was polling, before claiming anything
+    DISPATCHER.start()
+    log.info("worker %s: %d job processes, metrics on :%s", DISPATCHER.worker_id, DISPATCHER.max_workers,
+             METRICS_PORT or "-")
+    stop.wait()
+    DISPATCHER.stop(drain=True)
+    log.info("worker %s: stopped", DISPATCHER.worker_id)
+
+if __name__ == "__main__":
+    main()
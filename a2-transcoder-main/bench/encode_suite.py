@@ -0,0 +1,213 @@
+# bench/encode_suite.py
+"""
+Encode throughput suite: presets x ladders x modes x concurrency.
+
+Run from the project root:
+    python -m bench.encode_suite run --out results.json
+    python -m bench.encode_suite run --sources testsrc2:1920x1080:20,mandelbrot:1280x720:10 \\
+        --intensities low,medium,high --ladders abr3 --modes parallel,single --concurrency 1,2 --cpu-budget 8
+    python -m bench.encode_suite compare base.json results.json --threshold 0.10
+
+`run` builds deterministic lavfi sources once. Each case calls the real
+ffmpeg_runner.transcode() entry point with the ladder fitted to the source,
+the way job creation does it. `--concurrency N` runs N transcodes at once
+under one shared CPU budget (`--cpu-budget`, default CPU_BUDGET), the way
+the job workers do. Every case runs in a fresh process, so the ffmpeg
+children's CPU time and peak RSS (getrusage RUSAGE_CHILDREN) belong to
+that case alone. Results are JSON. Per case: wall seconds, output
+frames/sec, realtime factor (source seconds encoded per wall second),
+CPU-seconds per output minute and peak encoder RSS.
+
+`compare` matches cases by (source, intensity, ladder, mode, concurrency)
+and exits 1 if fps dropped, or CPU/output-minute or RSS grew, by more
+than the threshold.
+"""
+from __future__ import annotations
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, List
+
+from bench.segment_bench import make_source
+
+FPS = 30
+LADDERS: Dict[str, List[Dict[str, Any]]] = {
+    "top": [
+        {"width": 1920, "height": 1080, "crf": 18, "suffix": "1080p"},
+    ],
+    "abr3": [  # the API's default ladder
+        {"width": 1920, "height": 1080, "crf": 18, "suffix": "1080p"},
+        {"width": 1280, "height": 720, "crf": 20, "suffix": "720p"},
+        {"width": 854, "height": 480, "crf": 22, "suffix": "480p"},
+    ],
+    "abr5": [
+        {"width": 1920, "height": 1080, "crf": 18, "suffix": "1080p"},
+        {"width": 1280, "height": 720, "crf": 20, "suffix": "720p"},
+        {"width": 854, "height": 480, "crf": 22, "suffix": "480p"},
+        {"width": 640, "height": 360, "crf": 24, "suffix": "360p"},
+        {"width": 426, "height": 240, "crf": 26, "suffix": "240p"},
+    ],
+}
+# (metric, direction): +1 higher is better, -1 lower is better
+COMPARED = (("fps", 1), ("cpu_s_per_out_min", -1), ("peak_rss_mb", -1))
+
+def _case_key(c: Dict[str, Any]) -> str:
+    return f"{c['source']}|{c['intensity']}|{c['ladder']}|{c['mode']}|x{c['concurrency']}"
+
+def _run_case(src: str, width: int, height: int, duration: float, case: Dict[str, Any]) -> Dict[str, Any]:
+    """Runs in its own process; measures only this case's ffmpeg children."""
+    from app import scheduler
+    from app.ffmpeg_runner import fit_ladder, transcode
+
+    if case["cpu_budget"]:
+        scheduler.install(scheduler.CoreBudget(case["cpu_budget"]))
+    specs, _dropped = fit_ladder(LADDERS[case["ladder"]], width, height)
+    out_root = Path(tempfile.mkdtemp(prefix="bench_enc_"))
+
+    def one(i: int) -> None:
+        transcode(Path(src), out_root / str(i), specs, intensity=case["intensity"], mode=case["mode"], name=f"c{i}")
+
+    before = resource.getrusage(resource.RUSAGE_CHILDREN)
+    t0 = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(max_workers=case["concurrency"]) as ex:
+            list(ex.map(one, range(case["concurrency"])))
+        wall = time.perf_counter() - t0
+    finally:
+        shutil.rmtree(out_root, ignore_errors=True)
+    after = resource.getrusage(resource.RUSAGE_CHILDREN)
+
+    cpu = (after.ru_utime - before.ru_utime) + (after.ru_stime - before.ru_stime)
+    outputs = len(specs) * case["concurrency"]
+    out_minutes = duration * outputs / 60
+    return {
+        **case,
+        "renditions": [f"{s['width']}x{s['height']}" for s in specs],
+        "wall_seconds": round(wall, 3),
+        "fps": round(duration * FPS * outputs / wall, 2),
+        "realtime_factor": round(duration * case["concurrency"] / wall, 3),
+        "cpu_seconds": round(cpu, 2),
+        "cpu_s_per_out_min": round(cpu / out_minutes, 2),
+        "peak_rss_mb": round(after.ru_maxrss / 1024, 1),  # KiB on Linux; largest single ffmpeg
+    }
+
+def _environment() -> Dict[str, Any]:
+    try:
+        ffmpeg = subprocess.run(["ffmpeg", "-version"], capture_output=True, text=True).stdout.splitlines()[0]
+    except (OSError, IndexError):
+        ffmpeg = None
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = ""
+    return {
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "git_commit": commit or None,
+        "ffmpeg": ffmpeg,
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+    }
+
+def run(args: argparse.Namespace) -> None:
+    work = Path(args.work) if args.work else Path(tempfile.mkdtemp(prefix="bench_src_"))
+    work.mkdir(parents=True, exist_ok=True)
+    sources = []
+    for spec in args.sources.split(","):
+        pattern, size, duration = spec.split(":")
+        path = work / f"{pattern}_{size}_{duration}s.mp4"
+        if not path.exists():  # deterministic, so --work can reuse them across runs
+            make_source(path, size, int(duration), FPS, pattern)
+        w, h = (int(x) for x in size.split("x"))
+        sources.append((spec, str(path), w, h, float(duration)))
+
+    cases = []
+    ctx = multiprocessing.get_context("spawn")
+    try:
+        for spec, path, w, h, duration in sources:
+            for intensity in args.intensities.split(","):
+                for ladder in args.ladders.split(","):
+                    for mode in args.modes.split(","):
+                        for conc in (int(c) for c in args.concurrency.split(",")):
+                            case = {"source": spec, "intensity": intensity, "ladder": ladder, "mode": mode,
+                                    "concurrency": conc, "cpu_budget": args.cpu_budget}
+                            with ProcessPoolExecutor(max_workers=1, mp_context=ctx) as ex:
+                                result = ex.submit(_run_case, path, w, h, duration, case).result()
+                            print(json.dumps({k: result[k] for k in ("source", "intensity", "ladder", "mode",
+                                                                      "concurrency", "fps", "realtime_factor",
+                                                                      "cpu_s_per_out_min", "peak_rss_mb")}),
+                                  file=sys.stderr)
+                            cases.append(result)
+    finally:
+        if not args.work:
+            shutil.rmtree(work, ignore_errors=True)
+
+    report = {"environment": _environment(), "cases": cases}
+    text = json.dumps(report, indent=2)
+    if args.out:
+        Path(args.out).write_text(text)
+    print(text)
+
+def compare(args: argparse.Namespace) -> int:
+    base = {_case_key(c): c for c in json.loads(Path(args.base).read_text())["cases"]}
+    new = {_case_key(c): c for c in json.loads(Path(args.new).read_text())["cases"]}
+    rows, regressions = [], []
+    for key in sorted(base.keys() & new.keys()):
+        row: Dict[str, Any] = {"case": key}
+        for metric, direction in COMPARED:
+            old, cur = base[key].get(metric), new[key].get(metric)
+            if not old or cur is None:
+                continue
+            change = (cur - old) / old
+            row[metric] = {"base": old, "new": cur, "change": round(change, 3)}
+            if change * direction < -args.threshold:
+                regressions.append(f"{key}: {metric} {old} -> {cur} ({change:+.1%})")
+        rows.append(row)
+    print(json.dumps({
+        "threshold": args.threshold,
+        "cases": rows,
+        "only_in_base": sorted(base.keys() - new.keys()),
+        "only_in_new": sorted(new.keys() - base.keys()),
+        "regressions": regressions,
+    }, indent=2))
+    return 1 if regressions else 0
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = ap.add_subparsers(dest="cmd", required=True)
+
+    r = sub.add_parser("run", help="run the matrix and write JSON results")
+    r.add_argument("--sources", default="testsrc2:1280x720:5,mandelbrot:1280x720:5",
+                   help="comma-separated pattern:WxH:seconds (lavfi testsrc2, mandelbrot, ...)")
+    r.add_argument("--intensities", default="low,medium")
+    r.add_argument("--ladders", default="abr3", help=f"comma-separated; one of {sorted(LADDERS)}")
+    r.add_argument("--modes", default="parallel,single")
+    r.add_argument("--concurrency", default="1,2", help="concurrent transcodes (jobs) per case")
+    r.add_argument("--cpu-budget", type=int, default=0, help="cores shared by all encodes (0 = CPU_BUDGET)")
+    r.add_argument("--work", default="", help="keep generated sources here between runs")
+    r.add_argument("--out", default="", help="also write the JSON report here")
+
+    c = sub.add_parser("compare", help="diff two result files; exit 1 on regression")
+    c.add_argument("base")
+    c.add_argument("new")
+    c.add_argument("--threshold", type=float, default=0.10, help="relative change that counts as a regression")
+
+    args = ap.parse_args()
+    if args.cmd == "run":
+        run(args)
+    else:
+        sys.exit(compare(args))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+# bench/pagination_bench.py
+"""
+Page latency of the /jobs listing query: OFFSET vs keyset cursor.
+
+Run from the project root:
+    python -m bench.pagination_bench --rows 1000000 --owners 50
+
+Fills a throwaway SQLite database with the app's schema (indexes included),
+then times the newest-first listing at increasing depths, both for one
+owner and for the unfiltered admin view, with OFFSET and with a cursor.
+Prints one JSON object with the median milliseconds per page at each
+depth. Keyset latency should stay flat while OFFSET grows with depth.
+"""
+from __future__ import annotations
+import argparse
+import json
+import os
+import random
+import statistics
+import tempfile
+import time
+from datetime import datetime
+
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import sessionmaker
+
+from app.models import Base, Job, Video
+from app.pagination import decode_cursor, encode_cursor, keyset_page
+
+STATUSES = ["queued", "running", "done", "done", "done", "failed"]
+
+def populate(engine, rows: int, owners: int, batch: int = 50_000) -> None:
+    Base.metadata.create_all(engine)
+    rnd = random.Random(0)
+    now = datetime.utcnow()
+    with engine.begin() as conn:
+        conn.execute(insert(Video), [
+            {"id": 1, "owner": "owner0", "filename": "uploads/bench.mp4", "orig_name": "bench.mp4", "size_bytes": 0, "created_at": now}
+        ])
+        for lo in range(1, rows + 1, batch):
+            conn.execute(insert(Job), [
+                {
+                    "id": i,
+                    "owner": f"owner{rnd.randrange(owners)}",
+                    "video_id": 1,
+                    "status": rnd.choice(STATUSES),
+                    "spec_json": "[]",
+                    "attempts": 1,
+                    "queued_at": now,
+                }
+                for i in range(lo, min(lo + batch, rows + 1))
+            ])
+
+def timed(fn, repeat: int) -> float:
+    samples = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - t0) * 1000)
+    return round(statistics.median(samples), 3)
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--rows", type=int, default=1_000_000)
+    ap.add_argument("--owners", type=int, default=50)
+    ap.add_argument("--page", type=int, default=20)
+    ap.add_argument("--depths", default="0,100,900,10000,49000", help="page numbers to time")
+    ap.add_argument("--repeat", type=int, default=5)
+    args = ap.parse_args()
+
+    fd, path = tempfile.mkstemp(suffix=".db", prefix="bench_pages_")
+    os.close(fd)
+    try:
+        engine = create_engine(f"sqlite:///{path}", future=True)
+        t0 = time.perf_counter()
+        populate(engine, args.rows, args.owners)
+        load_s = round(time.perf_counter() - t0, 1)
+        db = sessionmaker(bind=engine, future=True)()
+
+        scopes = {
+            "owner": lambda: db.query(Job).filter(Job.owner == "owner0"),
+            "all": lambda: db.query(Job),  # admin view
+        }
+        results = {}
+        for scope, base in scopes.items():
+            # Cursors are just "last id seen"; find each depth's boundary once, then time the seek itself
+            ids = [r.id for r in base().with_entities(Job.id).order_by(Job.id.desc())]
+            by_depth = results[scope] = {"rows": len(ids)}
+            for depth in (int(d) for d in args.depths.split(",")):
+                skip = depth * args.page
+                if skip >= len(ids):
+                    continue
+                cursor = encode_cursor(ids[skip - 1]) if skip else None
+                assert cursor is None or decode_cursor(cursor) == ids[skip - 1]
+                by_depth[str(depth)] = {
+                    "offset_ms": timed(lambda: base().order_by(Job.id.desc()).offset(skip).limit(args.page).all(), args.repeat),
+                    "keyset_ms": timed(lambda: keyset_page(base(), Job.id, args.page, cursor=cursor), args.repeat),
+                }
+        db.close()
+    finally:
+        os.remove(path)
+
+    print(json.dumps({
+        "rows": args.rows,
+        "page_size": args.page,
+        "load_seconds": load_s,
+        "ms_per_page_by_depth": results,
+    }, indent=2))
+
+if __name__ == "__main__":
+    main()
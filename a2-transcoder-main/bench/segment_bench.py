@@ -0,0 +1,73 @@
+# bench/segment_bench.py
+"""
+Wall-clock comparison of transcode(mode="parallel") vs mode="segmented".
+
+Run from the project root:
+    python -m bench.segment_bench --duration 120 --size 1920x1080 --intensity high
+
+Generates a deterministic lavfi source, encodes the same ladder with each
+mode and prints one JSON object with per-mode seconds and the speedup.
+"""
+from __future__ import annotations
+import argparse
+import json
+import shutil
+import subprocess
+import tempfile
+import time
+from pathlib import Path
+
+from app.ffmpeg_runner import transcode
+
+def make_source(path: Path, size: str, duration: int, fps: int = 30, pattern: str = "testsrc2") -> None:
+    """Deterministic synthetic clip; pattern is a lavfi source (testsrc2, mandelbrot, ...)."""
+    subprocess.run(
+        [
+            "ffmpeg", "-y", "-hide_banner", "-loglevel", "error",
+            "-f", "lavfi", "-i", f"{pattern}=size={size}:rate={fps}", "-t", str(duration),
+            "-c:v", "libx264", "-preset", "ultrafast", "-g", str(fps * 2), "-pix_fmt", "yuv420p",
+            str(path),
+        ],
+        check=True,
+    )
+
+def run(src: Path, specs: list, intensity: str, mode: str) -> float:
+    out = Path(tempfile.mkdtemp(prefix=f"bench_{mode}_"))
+    try:
+        t0 = time.perf_counter()
+        transcode(src, out, specs, intensity=intensity, mode=mode)
+        return round(time.perf_counter() - t0, 2)
+    finally:
+        shutil.rmtree(out, ignore_errors=True)
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--duration", type=int, default=60, help="source length in seconds")
+    ap.add_argument("--size", default="1920x1080")
+    ap.add_argument("--intensity", default="high", choices=["low", "medium", "high", "max"])
+    ap.add_argument("--modes", default="parallel,segmented")
+    args = ap.parse_args()
+
+    specs = [
+        {"width": 1280, "height": 720, "crf": 20, "suffix": "720p"},
+        {"width": 854, "height": 480, "crf": 22, "suffix": "480p"},
+    ]
+    work = Path(tempfile.mkdtemp(prefix="bench_src_"))
+    try:
+        src = work / "source.mp4"
+        make_source(src, args.size, args.duration)
+        seconds = {m: run(src, specs, args.intensity, m) for m in args.modes.split(",")}
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+
+    report = {
+        "source": {"size": args.size, "duration": args.duration},
+        "intensity": args.intensity,
+        "seconds": seconds,
+    }
+    if "parallel" in seconds and "segmented" in seconds and seconds["segmented"]:
+        report["speedup"] = round(seconds["parallel"] / seconds["segmented"], 2)
+    print(json.dumps(report, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+# bench/state_stress.py
+"""
+Stress the job-state write path with dozens of concurrent jobs (no ffmpeg).
+
+Run from the project root:
+    python -m bench.state_stress --jobs 96 --workers 32
+    python -m bench.state_stress --path direct            # per-update sessions, no retry/coalescing
+    SQLITE_WAL=0 python -m bench.state_stress --path direct
+    python -m bench.state_stress --abandon 0.1 --lease 2  # workers "die" holding jobs; leases recover them
+    python -m bench.state_stress --database-url postgresql+psycopg2://...  # an empty database: SKIP LOCKED claims
+
+Each worker process loops: claim a queued job, report progress every
+--tick seconds (heartbeating every few ticks), then mark it done, exactly
+like the real workers do around an encode. `store` uses
+app.state_store (retried units, coalesced progress). `direct` opens a
+session and commits for every update, as the workers used to.
+Prints one JSON object with throughput, the errors surfaced to jobs and
+the shared contention counters.
+
+It also checks the queue's exactly-once guarantees across processes: no
+job is claimed by two workers while neither has died, and every job is
+finished exactly once. With --abandon, that share of claims is dropped
+without a finish or heartbeat, like a worker node dying mid-job. Idle
+workers run lease recovery (as the dispatcher does) until every job is
+done.
+"""
+from __future__ import annotations
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import tempfile
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict
+
+def _setup(jobs: int) -> None:
+    from app.models import Job, SessionLocal, Video, init_db
+    init_db()
+    db = SessionLocal()
+    db.add(Video(id=1, owner="bench", filename="uploads/bench.mp4", orig_name="bench.mp4", size_bytes=0))
+    db.add_all(Job(owner="bench", video_id=1, status="queued", spec_json="[]") for _ in range(jobs))
+    db.commit()
+    db.close()
+
+def _worker(path: str, ticks: int, tick: float, abandon: float) -> Dict[str, Any]:
+    from sqlalchemy import update
+    from app.job_queue import claim, finish, heartbeat, new_worker_id, recover_stale
+    from app.models import Job, SessionLocal
+    from app.state_store import UPDATES, write
+
+    def direct(fn):
+        db = SessionLocal()
+        try:
+            out = fn(db)
+            db.commit()
+            return out
+        finally:
+            db.close()
+
+    run = write if path == "store" else direct
+    wid = new_worker_id()
+    done = errors = recovered = 0
+    claimed, finished, abandoned = [], [], []
+    while True:
+        try:
+            job_id = run(lambda db: claim(db, wid))
+        except Exception:
+            errors += 1
+            continue
+        if job_id is None:
+            # Idle: recover dead workers' jobs, and stay until none are left running
+            recovered += run(recover_stale)
+            if not run(lambda db: db.query(Job.id).filter(Job.status.in_(("queued", "running"))).first()):
+                return {"done": done, "errors": errors, "recovered": recovered,
+                        "claimed": claimed, "finished": finished, "abandoned": abandoned}
+            time.sleep(0.2)
+            continue
+        claimed.append(job_id)
+        if random.random() < abandon:
+            abandoned.append(job_id)  # "crash": no heartbeat, no finish; the lease will lapse
+            wid = new_worker_id()     # and come back as a new worker
+            continue
+        try:
+            for i in range(ticks):
+                time.sleep(tick)
+                progress = json.dumps({"out.mp4": {"frame": i, "fps": 30.0, "percent": round(100 * i / ticks, 1)}})
+                if path == "store":
+                    UPDATES.put(job_id, progress_json=progress)
+                else:
+                    direct(lambda db: db.execute(update(Job).where(Job.id == job_id).values(progress_json=progress)))
+                if i % 5 == 4:
+                    run(lambda db: heartbeat(db, job_id, wid))
+            if path == "store":
+                UPDATES.flush()
+            if run(lambda db: finish(db, job_id, wid, "done", outputs_json="[]")):
+                finished.append(job_id)
+            done += 1
+        except Exception:
+            errors += 1
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--jobs", type=int, default=96)
+    ap.add_argument("--workers", type=int, default=32, help="concurrent worker processes")
+    ap.add_argument("--ticks", type=int, default=40, help="progress updates per job")
+    ap.add_argument("--tick", type=float, default=0.02, help="seconds between progress updates")
+    ap.add_argument("--path", default="store", choices=["store", "direct"])
+    ap.add_argument("--abandon", type=float, default=0.0, help="share of claimed jobs dropped as if the worker died")
+    ap.add_argument("--lease", type=int, default=5, help="JOB_LEASE_SECONDS while abandoning jobs")
+    ap.add_argument("--database-url", default="", help="an empty database to use instead of a temp SQLite file")
+    args = ap.parse_args()
+
+    db_path = ""
+    if args.database_url:
+        os.environ["DATABASE_URL"] = args.database_url
+    else:
+        fd, db_path = tempfile.mkstemp(suffix=".db", prefix="bench_state_")
+        os.close(fd)
+        os.environ["DATABASE_URL"] = f"sqlite:///{db_path}"  # before app.models is imported, here and in workers
+    if args.abandon:
+        # Recovered jobs should come straight back, and never run out of attempts
+        os.environ.update(JOB_LEASE_SECONDS=str(args.lease), JOB_RETRY_BACKOFF="0", JOB_MAX_ATTEMPTS="1000")
+    try:
+        from app import state_store
+        from app.models import Job, SessionLocal, engine
+        _setup(args.jobs)
+        counters = state_store.get_counters()
+
+        t0 = time.perf_counter()
+        with ProcessPoolExecutor(
+            max_workers=args.workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=state_store.install,
+            initargs=(counters,),
+        ) as pool:
+            results = list(pool.map(_worker, *zip(*[(args.path, args.ticks, args.tick, args.abandon)] * args.workers)))
+        wall = time.perf_counter() - t0
+
+        db = SessionLocal()
+        finished = db.query(Job).filter(Job.status == "done").count()
+        db.close()
+        engine.dispose()
+    finally:
+        for suffix in ("", "-wal", "-shm") if db_path else ():
+            try:
+                os.remove(db_path + suffix)
+            except OSError:
+                pass
+
+    claims = Counter(j for r in results for j in r["claimed"])
+    finishes = Counter(j for r in results for j in r["finished"])
+    abandoned = Counter(j for r in results for j in r["abandoned"])
+
+    print(json.dumps({
+        "path": args.path,
+        "sqlite_wal": os.getenv("SQLITE_WAL", "1"),
+        "jobs": args.jobs,
+        "workers": args.workers,
+        "wall_seconds": round(wall, 2),
+        "jobs_per_second": round(finished / wall, 2),
+        "jobs_done": finished,
+        "errors": sum(r["errors"] for r in results),
+        "exactly_once": {
+            "claimed_twice_while_alive": sum(1 for j, n in claims.items() if n - abandoned[j] > 1),
+            "finished_twice": sum(1 for n in finishes.values() if n > 1),
+            "never_finished": args.jobs - len(finishes),
+            "abandoned": sum(abandoned.values()),
+            "recovered": sum(r["recovered"] for r in results),
+        },
+        "counters": counters.snapshot(),
+    }, indent=2))
+
+if __name__ == "__main__":
+    main()
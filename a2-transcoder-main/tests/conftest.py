@@ -0,0 +1,66 @@
+# tests/conftest.py
+"""
+Shared fixtures. Settings are read at import time, so the environment is
+pinned here, before anything under app/ is imported: a throwaway SQLite
+database and the local-temp storage backend under a private temp dir.
+Tests that run ffmpeg are skipped when it isn't on PATH.
+"""
+from __future__ import annotations
+import os
+import shutil
+import subprocess
+import tempfile
+from pathlib import Path
+
+import pytest
+
+_ROOT = tempfile.mkdtemp(prefix="transcoder-tests-")
+os.environ["DATABASE_URL"] = f"sqlite:///{_ROOT}/app.db"
+os.environ["STORAGE_BACKEND"] = "local-temp"
+os.environ["INPUT_CACHE_DIR"] = os.path.join(_ROOT, "input-cache")
+tempfile.tempdir = _ROOT  # local-temp storage keeps objects under the temp dir
+
+requires_ffmpeg = pytest.mark.skipif(shutil.which("ffmpeg") is None, reason="ffmpeg not on PATH")
+
+@pytest.fixture
+def db():
+    """A session on freshly created tables."""
+    from app.models import Base, SessionLocal, engine
+
+    Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+    session = SessionLocal()
+    try:
+        yield session
+    finally:
+        session.close()
+
+@pytest.fixture(scope="session")
+def source_720p() -> Path:
+    """2 s 1280x720 25 fps H.264 test clip."""
+    if shutil.which("ffmpeg") is None:
+        pytest.skip("ffmpeg not on PATH")
+    path = Path(_ROOT) / "src_720p.mp4"
+    subprocess.run(
+        ["ffmpeg", "-y", "-hide_banner", "-loglevel", "error", "-f", "lavfi", "-i", "testsrc2=size=1280x720:rate=25",
+         "-t", "2", "-c:v", "libx264", "-preset", "ultrafast", "-pix_fmt", "yuv420p", str(path)],
+        check=True,
+    )
+    return path
+
+@pytest.fixture
+def client(db):
+    """API client. Not entered as a context manager, so startup (and the dispatcher) never runs."""
+    from fastapi.testclient import TestClient
+    from app.main import app
+
+    return TestClient(app)
+
+def auth(user: str = "kimia") -> dict:
+    """Authorization header for one of the demo users."""
+    from app.auth import USERS, create_access_token
+
+    return {"Authorization": f"Bearer {create_access_token(user, USERS[user]['role'])}"}
+
+def pytest_sessionfinish(session, exitstatus):
+    shutil.rmtree(_ROOT, ignore_errors=True)
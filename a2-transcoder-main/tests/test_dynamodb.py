@@ -0,0 +1,98 @@
+# tests/test_dynamodb.py
+from __future__ import annotations
+from typing import List
+
+import pytest
+
+from app import dynamodb
+
+moto = pytest.importorskip("moto")
+
+def _create(pk: str, sk: str) -> None:
+    attrs = {pk: "S", sk: "S"}
+    kwargs = {}
+    if pk != "owner":
+        attrs.update(owner="S", created_at="N")
+        kwargs["GlobalSecondaryIndexes"] = [{
+            "IndexName": dynamodb.OWNER_INDEX,
+            "KeySchema": [{"AttributeName": "owner", "KeyType": "HASH"}, {"AttributeName": "created_at", "KeyType": "RANGE"}],
+            "Projection": {"ProjectionType": "ALL"},
+        }]
+    dynamodb._ddb().create_table(
+        TableName=dynamodb.TABLE,
+        KeySchema=[{"AttributeName": pk, "KeyType": "HASH"}, {"AttributeName": sk, "KeyType": "RANGE"}],
+        AttributeDefinitions=[{"AttributeName": name, "AttributeType": t} for name, t in attrs.items()],
+        BillingMode="PAY_PER_REQUEST",
+        **kwargs,
+    )
+
+@pytest.fixture(params=["owner", "video_id"])
+def ddb(request, monkeypatch):
+    """A mocked videos table keyed by (owner, video_id), or by video_id alone with the owner GSI."""
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    monkeypatch.delenv("AWS_SESSION_TOKEN", raising=False)
+    monkeypatch.setattr(dynamodb, "DDB_ENDPOINT", None)
+    if request.param == "video_id":
+        monkeypatch.setattr(dynamodb, "PK", "video_id")
+        monkeypatch.setattr(dynamodb, "SK", "rev")
+    with moto.mock_aws():
+        dynamodb._local.__dict__.clear()  # resources cached by other tests point at no mock
+        _create(dynamodb.PK, dynamodb.SK)
+        yield request.param
+        dynamodb._local.__dict__.clear()
+
+def _put(owner: str, n: int) -> List[str]:
+    items = [{dynamodb.PK: f"{owner}-{i:03d}", dynamodb.SK: f"{owner}-{i:03d}", "owner": owner, "created_at": 1000 + i}
+             for i in range(n)]  # with PK "owner", the last "owner" wins
+    dynamodb.batch_put_videos(items)
+    return [item[dynamodb.SK] for item in reversed(items)]  # newest first
+
+def _walk(owner: str, limit: int) -> List[List[str]]:
+    pages, cursor = [], None
+    while True:
+        items, cursor = dynamodb.list_videos(owner, limit=limit, cursor=cursor)
+        pages.append([item[dynamodb.SK] for item in items])
+        if cursor is None:
+            return pages
+
+def test_list_videos_pages_newest_first(ddb):
+    mine = _put("kimia", 5)
+    _put("sara", 3)
+    pages = _walk("kimia", 2)
+    assert [vid for page in pages for vid in page] == mine
+    assert [len(page) for page in pages if page] == [2, 2, 1]
+    assert _walk("nobody", 2) == [[]]
+
+@pytest.mark.parametrize("cursor", ["not base64 json!", "WzFd", "eyJhIjoxfQ"])
+def test_list_videos_rejects_foreign_cursors(ddb, cursor):
+    _put("kimia", 1)
+    with pytest.raises(ValueError):
+        dynamodb.list_videos("kimia", cursor=cursor)
+
+def test_cursor_of_another_owner_is_rejected(ddb):
+    _put("sara", 3)
+    _items, cursor = dynamodb.list_videos("sara", limit=1)
+    assert cursor
+    with pytest.raises(ValueError):
+        dynamodb.list_videos("kimia", cursor=cursor)
+
+def test_batch_update_status(ddb, monkeypatch):
+    if ddb != "owner":
+        pytest.skip("batch helpers address items by (owner, video_id), like get_video")
+    monkeypatch.setattr(dynamodb, "BATCH_GET_LIMIT", 2)
+    ids = _put("kimia", 5)
+    updated = dynamodb.batch_update_status("kimia", ids[:3] + ["missing", ids[0]], "READY")
+    assert sorted(updated) == sorted(ids[:3])
+    statuses = {item[dynamodb.SK]: item.get("status") for item in dynamodb.list_videos("kimia")[0]}
+    assert [statuses[i] for i in ids] == ["READY"] * 3 + [None] * 2
+
+def test_videos_endpoint_pages_and_rejects_bad_cursors(ddb, client):
+    mine = _put("kimia", 3)
+    r = client.get("/videos", params={"limit": 2}, headers={"X-User": "kimia"})
+    body = r.json()
+    assert [item[dynamodb.SK] for item in body["items"]] == mine[:2] and body["next_cursor"]
+    r = client.get("/videos", params={"limit": 2, "cursor": body["next_cursor"]}, headers={"X-User": "kimia"})
+    assert [item[dynamodb.SK] for item in r.json()["items"]] == mine[2:]
+    r = client.get("/videos", params={"cursor": "garbage"}, headers={"X-User": "kimia"})
+    assert r.status_code == 400 and r.json()["detail"] == "Invalid cursor"
@@ -0,0 +1,57 @@
+# tests/test_encode_stats.py
+from __future__ import annotations
+
+import pytest
+
+from app.models import EncodeStat
+from app.scheduler import CoreBudget
+from app.services import encode_stats
+from app.services.encode_stats import choose, history, predict, record
+
+R720 = {"width": 1280, "height": 720, "crf": 20}
+R360 = {"width": 640, "height": 360, "crf": 24}
+H264_720P = {"video_codec": "h264", "pix_fmt": "yuv420p", "width": 1280, "height": 720, "fps": 25.0, "bitrate": 500_000}
+
+@pytest.fixture(autouse=True)
+def budget(monkeypatch):
+    monkeypatch.setattr(encode_stats, "get_budget", lambda: CoreBudget(4))
+
+def test_predict_from_the_per_core_prior():
+    # 0.9216 MP * 10 s * 25 fps = 230.4 MP-frames; "high" gets 3 of 4 cores at 5 MP-frames/s each
+    assert predict({}, [R720], "high", "single", 10, 25) == pytest.approx(230.4 / 15)
+    assert predict({}, [R720], "low", "single", 10, 25) == pytest.approx(230.4 / 100)  # 2 cores * 50
+    frames = 10 * encode_stats.DEFAULT_FPS  # fps unknown
+    assert predict({}, [R720, R360], "high", "single", 10, None) == pytest.approx(
+        0.9216 * frames / 15 + 0.2304 * frames / 10)  # rungs add up; 360p gets 2 cores
+
+def test_predict_skips_rungs_the_source_can_be_remuxed_to():
+    assert predict({}, [R720, R360], "high", "single", 10, 25, H264_720P) == pytest.approx(
+        predict({}, [R360], "high", "single", 10, 25))
+
+def test_history_blends_with_the_prior_by_sample_count():
+    hist = {("high", "single"): EncodeStat(intensity="high", mode="single", samples=2, mpx_per_second=45.0)}
+    assert predict(hist, [R720], "high", "single", 10, 25) == pytest.approx(230.4 / 30)  # (15*2 + 45*2) / 4
+    assert predict(hist, [R720], "high", "cascade", 10, 25) == pytest.approx(230.4 / 15)  # per mode
+
+def test_choose_takes_the_slowest_preset_that_fits():
+    fits = {p: predict({}, [R720], p, "single", 10, 25) for p in encode_stats.PRESETS}
+    budget = fits["medium"] / encode_stats.DEADLINE_SAFETY + 0.01
+    assert choose({}, [R720], "single", 10, 25, budget) == ("medium", pytest.approx(fits["medium"]), True)
+    assert choose({}, [R720], "single", 10, 25, 10 ** 6, slowest="medium")[0] == "medium"  # never slower than asked
+    assert choose({}, [R720], "single", 10, 25, 10 ** 6, slowest="max")[0] == "max"
+    assert choose({}, [R720], "single", 10, 25, 0.001) == ("low", pytest.approx(fits["low"]), False)
+
+def test_record_folds_samples_into_an_ewma(db, monkeypatch):
+    monkeypatch.setattr(encode_stats, "EWMA_ALPHA", 0.5)
+    record(db, "high", "single", 100.0, 10.0)
+    record(db, "high", "single", 100.0, 5.0)
+    record(db, "high", "single", 0.0, 5.0)  # nothing encoded (all remuxed): no sample
+    record(db, "high", "cascade", 100.0, 1.0)
+    db.commit()
+    rows = history(db)
+    assert (rows[("high", "single")].samples, rows[("high", "single")].mpx_per_second) == (2, pytest.approx(15.0))
+    assert rows[("high", "cascade")].mpx_per_second == pytest.approx(100.0)
+
+def test_encoded_work_counts_encodes_only():
+    results = [{**R720, "fast_path": "remux"}, R360, {"kind": "poster"}]
+    assert encode_stats.encoded_work(results, 10, 25) == pytest.approx(0.2304 * 250)
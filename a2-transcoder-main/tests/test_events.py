@@ -0,0 +1,112 @@
+# tests/test_events.py
+from __future__ import annotations
+import asyncio
+from typing import Any, Dict, List, Optional
+
+import pytest
+
+from app import events
+from app.events import JobEvents, _offer
+from app.ffmpeg_runner import _parse_progress
+
+def test_progress_fields_that_are_not_known_yet():
+    info = _parse_progress({"frame": "0", "fps": "N/A", "speed": "N/A", "out_time_us": "N/A", "progress": "continue"}, 10.0)
+    assert info == {"frame": 0, "fps": None, "speed": None, "out_time": 0.0, "done": False, "percent": 0.0}
+
+@pytest.mark.parametrize("block", [
+    {"out_time_us": "2500000", "out_time_ms": "999"},
+    {"out_time_us": "N/A", "out_time_ms": "2500000"},  # ffmpeg's out_time_ms is microseconds too
+])
+def test_progress_position_from_out_time(block):
+    info = _parse_progress({**block, "frame": "62", "fps": "50", "speed": "2.0x", "progress": "continue"}, 10.0)
+    assert (info["out_time"], info["speed"], info["percent"], info["eta"]) == (2.5, 2.0, 25.0, 3.8)
+
+def test_progress_end_block():
+    info = _parse_progress({"frame": "240", "out_time_us": "9600000", "speed": "3x", "progress": "end"}, 10.0)
+    assert (info["done"], info["percent"], info["eta"]) == (True, 100.0, 0.0)
+    assert "percent" not in _parse_progress({"progress": "end"}, None)  # no duration, no percent
+
+def test_offer_keeps_only_the_latest_state():
+    async def main():
+        q: asyncio.Queue = asyncio.Queue()
+        for n in range(3):
+            _offer(q, {"n": n})
+        return [q.get_nowait() for _ in range(q.qsize())]
+    assert asyncio.run(main()) == [{"n": 2}]
+
+class _Rows:
+    """What each job's row reads as, one snapshot per poll (the last repeats), and how often it was read."""
+
+    def __init__(self) -> None:
+        self.script: Dict[int, List[Dict[str, Any]]] = {}
+        self.reads: Dict[int, int] = {}
+
+    def snapshot(self, job_id: int) -> Optional[Dict[str, Any]]:
+        n = self.reads[job_id] = self.reads.get(job_id, 0) + 1
+        seq = self.script.get(job_id)
+        return None if seq is None else seq[min(n, len(seq)) - 1]
+
+@pytest.fixture
+def rows(monkeypatch) -> _Rows:
+    fake = _Rows()
+    monkeypatch.setattr(events, "_snapshot", fake.snapshot)
+    return fake
+
+def _snap(status: str, percent: float = 0.0) -> Dict[str, Any]:
+    return {"id": 1, "status": status, "progress": {"a.mp4": {"percent": percent}}, "error": None, "attempts": 1}
+
+async def _collect(hub: JobEvents, job_id: int, started: Optional[asyncio.Event] = None) -> List[Dict[str, Any]]:
+    out = []
+    async for snap in hub.subscribe(job_id):
+        if started is not None:
+            started.set()
+        out.append(snap)
+    return out
+
+def test_watchers_share_one_poller_until_the_job_finishes(rows):
+    rows.script[1] = [_snap("queued"), _snap("running", 10), _snap("running", 10), _snap("running", 60), _snap("done", 100)]
+
+    async def main():
+        hub = JobEvents(poll_seconds=0.01)
+        seen = await asyncio.gather(*(_collect(hub, 1) for _ in range(3)))
+        return hub, seen
+
+    hub, seen = asyncio.run(main())
+    statuses = [[(s["status"], s["progress"]["a.mp4"]["percent"]) for s in watcher] for watcher in seen]
+    assert statuses[0] == [("queued", 0.0), ("running", 10), ("running", 60), ("done", 100)]  # changes only
+    assert statuses[1] == statuses[2] == statuses[0]
+    assert rows.reads[1] == 5  # one read per poll, not per watcher; none after "done"
+    assert hub.watchers() == 0 and not hub._topics
+
+def test_a_late_watcher_gets_the_latest_state_at_once(rows):
+    rows.script[1] = [_snap("running", n) for n in range(5)] + [_snap("running", 99)] * 50 + [_snap("failed", 99)]
+
+    async def main():
+        hub = JobEvents(poll_seconds=0.01)
+        started = asyncio.Event()
+        first = asyncio.ensure_future(_collect(hub, 1, started))
+        await started.wait()
+        await asyncio.sleep(0.1)
+        late = await _collect(hub, 1)
+        return await first, late
+
+    first, late = asyncio.run(main())
+    assert late[0]["progress"]["a.mp4"]["percent"] == 99 and late[-1]["status"] == "failed"
+    assert first[-1] == late[-1]
+
+def test_stream_of_a_missing_job_ends(rows):
+    async def main():
+        return [chunk async for chunk in JobEvents(poll_seconds=0.01).sse(404)]
+    assert asyncio.run(main()) == ["event: end\ndata: {}\n\n"]
+
+def test_sse_frames_and_keepalive(rows, monkeypatch):
+    monkeypatch.setattr(events, "KEEPALIVE_SECONDS", 0.02)
+    rows.script[1] = [_snap("running", 5)] * 20 + [_snap("cancelled", 5)]
+
+    async def main():
+        return [chunk async for chunk in JobEvents(poll_seconds=0.01).sse(1)]
+
+    chunks = asyncio.run(main())
+    assert chunks[0].startswith("event: job\ndata: {") and '"status": "running"' in chunks[0]
+    assert ": keep-alive\n\n" in chunks
+    assert '"status": "cancelled"' in chunks[-2] and chunks[-1] == "event: end\ndata: {}\n\n"
@@ -0,0 +1,377 @@
+# tests/test_ffmpeg_runner.py
+from __future__ import annotations
+import os
+import re
+import shutil
+import subprocess
+import threading
+import time
+from pathlib import Path
+
+import pytest
+
+from app import ffmpeg_runner, jobs
+from app.ffmpeg_runner import (CHILDREN, Stopped, _parse_progress, _run, _Thumbs, can_remux, fit_ladder, package,
+                               thumbnail_options, transcode)
+from tests.conftest import requires_ffmpeg
+
+DEFAULT_LADDER = [  # the API's default
+    {"width": 1920, "height": 1080, "crf": 30, "suffix": "1080p"},
+    {"width": 1280, "height": 720, "crf": 30, "suffix": "720p"},
+    {"width": 854, "height": 480, "crf": 30, "suffix": "480p"},
+]
+
+@requires_ffmpeg
+@pytest.mark.parametrize("packaging", ["hls", "dash", "cmaf"])
+def test_package_720p_480p_ladder(source_720p, tmp_path, packaging):
+    # 852x480 is not exactly 16:9; all rungs still share one adaptation set
+    specs = [{"width": 1280, "height": 720, "crf": 30, "suffix": "720p", "fitted": True},
+             {"width": 852, "height": 480, "crf": 30, "suffix": "480p", "fitted": True}]
+    res = package(source_720p, tmp_path, specs, intensity="low", packaging=packaging, segment_seconds=1)
+
+    assert set(res["manifests"]) == {"hls": {"hls"}, "dash": {"dash"}, "cmaf": {"hls", "dash"}}[packaging]
+    mpd = (tmp_path / "manifest.mpd").read_text()
+    assert mpd.count("<AdaptationSet") == 1
+    assert len(re.findall(r"<Representation ", mpd)) == 2
+    master = (tmp_path / "master.m3u8").read_text()
+    assert "media_0.m3u8" in master and "media_1.m3u8" in master
+    for i in range(2):
+        assert (tmp_path / f"init-{i}.m4s").stat().st_size > 0
+        assert list(tmp_path.glob(f"chunk-{i}-*.m4s"))
+    assert [(r["width"], r["height"]) for r in res["renditions"]] == [(1280, 720), (852, 480)]
+
+@requires_ffmpeg
+def test_package_default_ladder_fitted(source_720p, tmp_path):
+    specs, dropped = fit_ladder(DEFAULT_LADDER, 1280, 720)
+    assert [(s["width"], s["height"]) for s in specs] == [(1280, 720), (852, 480)]
+    assert len(dropped) == 1
+    res = package(source_720p, tmp_path, specs, intensity="low", packaging="dash", segment_seconds=1)
+    assert (tmp_path / "manifest.mpd").exists() and len(res["renditions"]) == 2
+
+@requires_ffmpeg
+def test_package_unfitted_boxes(source_720p, tmp_path):
+    # Boxes sized at encode time (keep_aspect), as when no probe was available
+    res = package(source_720p, tmp_path, DEFAULT_LADDER[1:], intensity="low", packaging="hls", segment_seconds=1)
+    assert (tmp_path / "master.m3u8").exists() and len(res["renditions"]) == 2
+
+SOURCE_720P = {"video_codec": "h264", "pix_fmt": "yuv420p", "width": 1280, "height": 720, "fps": 25.0}
+
+@pytest.mark.parametrize("bitrate, crf, expected", [
+    (1_500_000, 23, True),     # about what CRF 23 gives at 720p
+    (40_000_000, 28, False),   # far above what the rung asks for
+    (3_000_000, 28, False),
+    (3_000_000, 18, True),
+    (None, 23, False),         # unknown bitrate: can't tell, so encode
+])
+def test_can_remux_respects_the_rungs_bitrate_budget(bitrate, crf, expected):
+    assert can_remux({**SOURCE_720P, "bitrate": bitrate}, 1280, 720, crf) is expected
+
+def test_can_remux_needs_matching_stream(monkeypatch):
+    src = {**SOURCE_720P, "bitrate": 1_000_000}
+    assert not can_remux(src, 854, 480)
+    assert not can_remux({**src, "video_codec": "hevc"}, 1280, 720)
+    assert not can_remux({**src, "pix_fmt": "yuv420p10le"}, 1280, 720)
+    monkeypatch.setattr(ffmpeg_runner, "REMUX_MAX_BITRATE", 800_000)
+    assert not can_remux(src, 1280, 720)
+
+@requires_ffmpeg
+def test_transcode_remuxes_only_rungs_within_budget(source_720p, tmp_path):
+    specs = [{"width": 1280, "height": 720, "crf": 23, "suffix": "720p", "fitted": True},
+             {"width": 640, "height": 360, "crf": 30, "suffix": "360p", "fitted": True}]
+    light = transcode(source_720p, tmp_path / "light", specs, intensity="low", mode="single",
+                      source={**SOURCE_720P, "bitrate": 1_000_000})
+    assert {r["name"]: r.get("fast_path") for r in light} == {"src_720p_720p.mp4": "remux", "src_720p_360p.mp4": None}
+
+    heavy = transcode(source_720p, tmp_path / "heavy", specs[:1], intensity="low", mode="single",
+                      source={**SOURCE_720P, "bitrate": 40_000_000})
+    assert heavy[0].get("fast_path") is None and heavy[0]["crf"] == 23
+
+@pytest.fixture
+def children():
+    CHILDREN.reset()
+    yield CHILDREN
+    CHILDREN.reset()
+
+def _gone(pid: int, wait: float = 5.0) -> bool:
+    """pid has exited (gone, or a zombie nobody has reaped yet)."""
+    deadline = time.monotonic() + wait
+    while time.monotonic() < deadline:
+        try:
+            with open(f"/proc/{pid}/stat") as f:
+                if f.read().rsplit(")", 1)[1].split()[0] == "Z":
+                    return True
+        except FileNotFoundError:
+            return True
+        time.sleep(0.02)
+    return False
+
+def _sleeper(tmp_path):
+    """A child that forks a grandchild into its process group and records its pid."""
+    pidfile = tmp_path / "grandchild.pid"
+    return ["sh", "-c", f"sleep 60 & echo $! > {pidfile}; wait"], pidfile
+
+def _grandchild(pidfile) -> int:
+    deadline = time.monotonic() + 5
+    while not (pidfile.exists() and pidfile.read_text().strip()) and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return int(pidfile.read_text())
+
+@pytest.mark.skipif(not os.path.isdir("/proc"), reason="needs /proc")
+def test_stop_kills_the_whole_process_group(children, tmp_path):
+    cmd, pidfile = _sleeper(tmp_path)
+    threading.Timer(0.3, children.stop, ("cancelled",)).start()
+    started = time.monotonic()
+    with pytest.raises(Stopped) as e:
+        _run(cmd)
+    assert e.value.reason == "cancelled" and time.monotonic() - started < 10
+    assert _gone(_grandchild(pidfile))
+    with pytest.raises(Stopped):  # nothing new starts until reset()
+        _run(["true"])
+    children.reset()
+    assert _run(["true"])[0] == 0
+
+@pytest.mark.skipif(not os.path.isdir("/proc"), reason="needs /proc")
+def test_a_run_past_its_timeout_is_killed(children, tmp_path):
+    cmd, pidfile = _sleeper(tmp_path)
+    children.reset(timeout=0.2)
+    started = time.monotonic()
+    with pytest.raises(Stopped) as e:
+        _run(cmd, op="encode", renditions=2)
+    assert e.value.reason == "timeout" and str(e.value) == "ffmpeg encode ran past its 0.4s limit"
+    assert time.monotonic() - started < 10
+    assert _gone(_grandchild(pidfile))
+
+@pytest.fixture(scope="module")
+def source_10s(tmp_path_factory) -> Path:
+    """10 s 640x360 25 fps H.264 clip: long enough for several progress blocks."""
+    if shutil.which("ffmpeg") is None:
+        pytest.skip("ffmpeg not on PATH")
+    path = tmp_path_factory.mktemp("src") / "src_10s.mp4"
+    subprocess.run(
+        ["ffmpeg", "-y", "-hide_banner", "-loglevel", "error", "-f", "lavfi", "-i", "testsrc2=size=640x360:rate=25",
+         "-t", "10", "-c:v", "libx264", "-preset", "ultrafast", "-pix_fmt", "yuv420p", str(path)],
+        check=True,
+    )
+    return path
+
+def test_progress_counts_rendition_frames_when_fps_is_known():
+    # The last block of an encode with a sprite output: out_time/speed follow the sprite sheet
+    end = {"frame": "250", "fps": "50.0", "out_time_us": "40000", "speed": "0.0017x", "progress": "end"}
+    assert _parse_progress(end, 10.0, fps=25.0) == {
+        "frame": 250, "fps": 50.0, "speed": 2.0, "out_time": 10.0, "done": True, "percent": 100.0, "eta": 0.0}
+    mid = {"frame": "100", "fps": "50.0", "out_time_us": "40000", "speed": "0.01x", "progress": "continue"}
+    assert _parse_progress(mid, 10.0, fps=25.0)["percent"] == 40.0
+    assert _parse_progress(mid, 10.0, fps=25.0)["eta"] == 3.0
+    assert _parse_progress(mid, 10.0)["percent"] == 0.4  # no fps: out_time is all there is
+
+@requires_ffmpeg
+@pytest.mark.parametrize("mode", ["single", "cascade", "parallel"])
+def test_progress_is_monotonic_with_thumbnails(source_10s, tmp_path, mode):
+    specs = [{"width": 640, "height": 360, "crf": 30, "suffix": "360p", "fitted": True},
+             {"width": 320, "height": 180, "crf": 30, "suffix": "180p", "fitted": True}]
+    seen = {}
+    transcode(source_10s, tmp_path, specs, intensity="medium", mode=mode, duration=10.0,
+              source={"width": 640, "height": 360, "fps": 25.0}, thumbnails={"interval": 2},
+              on_progress=lambda name, info: seen.setdefault(name, []).append(info))
+    assert set(seen) == {"src_10s_360p.mp4", "src_10s_180p.mp4"}
+    for name, infos in seen.items():
+        percents = [i["percent"] for i in infos]
+        assert percents == sorted(percents), (name, percents)
+        assert infos[-1]["done"] and infos[-1]["percent"] == 100.0
+        assert infos[-1]["out_time"] == 10.0 and infos[-1]["speed"] > 0.1
+
+@pytest.mark.parametrize("opts, expected", [
+    (None, None),
+    (False, None),
+    ({"poster": None, "sprite": False}, None),
+    (True, {"poster": "jpg", "poster_at": None, "sprite": True, "interval": 10.0, "width": 160, "columns": 10, "rows": 10}),
+    ({"poster": "webp", "poster_at": "3", "sprite": False, "interval": 2, "width": 161, "columns": 4, "rows": 3},
+     {"poster": "webp", "poster_at": 3.0, "sprite": False, "interval": 2.0, "width": 160, "columns": 4, "rows": 3}),
+])
+def test_thumbnail_options(opts, expected):
+    assert thumbnail_options(opts) == expected
+
+@pytest.mark.parametrize("opts, message", [
+    ("yes", "true or an object"),
+    ({"poster": "png"}, "poster must be one of"),
+    ({"interval": "often"}, "must be numbers"),
+    ({"interval": 0}, "interval > 0"),
+    ({"width": 8}, "width 16-1920"),
+    ({"columns": 51}, "columns/rows 1-50"),
+    ({"rows": 0}, "columns/rows 1-50"),
+])
+def test_thumbnail_options_rejects(opts, message):
+    with pytest.raises(ValueError, match=message):
+        thumbnail_options(opts)
+
+def _thumbs(tmp_path, duration, **opts) -> _Thumbs:
+    return _Thumbs(thumbnail_options({"width": 160, **opts}), tmp_path, "clip", duration, {"width": 1280, "height": 720})
+
+def _cues(vtt: Path):
+    blocks = vtt.read_text().split("\n\n")
+    assert blocks[0] == "WEBVTT"
+    return [tuple(b.strip().split("\n")) for b in blocks[1:] if b.strip()]
+
+def test_vtt_cues_walk_the_sprite_grid(tmp_path):
+    thumbs = _thumbs(tmp_path, 23.0, interval=5, columns=2, rows=2)
+    assert thumbs.tile == (160, 90)
+    sheets = [tmp_path / "clip_sprite_001.jpg", tmp_path / "clip_sprite_002.jpg"]
+    assert _cues(thumbs._write_vtt(sheets)) == [
+        ("00:00:00.000 --> 00:00:05.000", "clip_sprite_001.jpg#xywh=0,0,160,90"),
+        ("00:00:05.000 --> 00:00:10.000", "clip_sprite_001.jpg#xywh=160,0,160,90"),
+        ("00:00:10.000 --> 00:00:15.000", "clip_sprite_001.jpg#xywh=0,90,160,90"),
+        ("00:00:15.000 --> 00:00:20.000", "clip_sprite_001.jpg#xywh=160,90,160,90"),
+        ("00:00:20.000 --> 00:00:23.000", "clip_sprite_002.jpg#xywh=0,0,160,90"),  # ends with the video
+    ]
+
+def test_vtt_without_a_duration_covers_every_tile(tmp_path):
+    thumbs = _thumbs(tmp_path, None, interval=90, columns=3, rows=1)
+    cues = _cues(thumbs._write_vtt([tmp_path / "clip_sprite_001.jpg"]))
+    assert [c[0] for c in cues] == ["00:00:00.000 --> 00:01:30.000", "00:01:30.000 --> 00:03:00.000",
+                                    "00:03:00.000 --> 00:04:30.000"]
+    assert cues[-1][1] == "clip_sprite_001.jpg#xywh=320,0,160,90"
+
+def test_thumbs_graph_shares_the_decode(tmp_path):
+    thumbs = _thumbs(tmp_path, 20.0, interval=5)
+    assert thumbs.poster_at == 2.0  # 10% in
+    alone = thumbs.graph()
+    assert alone.startswith("[0:v]split=2[t0][t1];[t0]trim=start=2.000,")
+    assert "[t1]fps=1/5:eof_action=pass,scale=160:90" in alone and alone.endswith("tile=10x10[ts]")
+    shared = thumbs.graph("[0:v]scale=640:360[v0]")
+    assert shared.startswith("[0:v]split=3[src][t0][t1];[src]scale=640:360[v0];")
+    assert _thumbs(tmp_path, 1.0, poster_at=30).poster_at == 0.5  # clamped inside the video
+
+@requires_ffmpeg
+def test_short_source_still_gets_a_tile_and_poster(source_720p, tmp_path):
+    # 2 s of video, 10 s per tile, poster asked for past the end
+    res = transcode(source_720p, tmp_path, [], mode="single", duration=2.0, name="short",
+                    source={"width": 1280, "height": 720, "fps": 25.0},
+                    thumbnails={"interval": 10, "poster_at": 30, "columns": 2, "rows": 2})
+    assert sorted(r["kind"] for r in res) == ["poster", "sprite", "thumbnails"]
+    assert (tmp_path / "short_poster.jpg").stat().st_size > 0
+    assert _cues(tmp_path / "short_thumbnails.vtt") == [
+        ("00:00:00.000 --> 00:00:02.000", "short_sprite_001.jpg#xywh=0,0,160,90")]
+
+@requires_ffmpeg
+def test_piped_source_with_only_thumbnails(source_720p, tmp_path):
+    mkv = tmp_path / "src.mkv"  # a pipe can't seek to a trailing moov
+    subprocess.run(["ffmpeg", "-y", "-loglevel", "error", "-i", str(source_720p), "-c", "copy", str(mkv)], check=True)
+    res = transcode("pipe:0", tmp_path, [], mode="single", stdin=[mkv.read_bytes()], name="piped",
+                    duration=2.0, thumbnails={"poster": "webp", "sprite": False})
+    assert [(r["kind"], r["name"]) for r in res] == [("poster", "piped_poster.webp")]
+    assert (tmp_path / "piped_poster.webp").stat().st_size > 0
+
+@pytest.mark.parametrize("name, content_type", [
+    ("clip_poster.jpg", "image/jpeg"),
+    ("clip_poster.webp", "image/webp"),
+    ("clip_sprite_001.jpg", "image/jpeg"),
+    ("clip_thumbnails.vtt", "text/vtt"),
+    ("master.m3u8", "application/vnd.apple.mpegurl"),
+    ("manifest.mpd", "application/dash+xml"),
+    ("chunk-0-00001.m4s", "video/iso.segment"),
+    ("clip_720p.mp4", "video/mp4"),
+    ("notes.bin", "application/octet-stream"),
+])
+def test_outputs_are_stored_with_their_content_type(tmp_path, monkeypatch, name, content_type):
+    stored = {}
+    monkeypatch.setattr(jobs, "put_file", lambda key, path, ct: stored.update({key: ct}) or (1, ""))
+    (tmp_path / name).write_bytes(b"x")
+    jobs._upload_output(tmp_path / name, 7)
+    assert stored == {f"outputs/job_7/{name}": content_type}
+
+@pytest.fixture(scope="module")
+def source_gop30(tmp_path_factory) -> Path:
+    """10 s 320x180 25 fps clip with a keyframe every 30 frames (1.2 s), so cuts can't land on round seconds."""
+    if shutil.which("ffmpeg") is None:
+        pytest.skip("ffmpeg not on PATH")
+    path = tmp_path_factory.mktemp("src") / "src_gop30.mp4"
+    subprocess.run(
+        ["ffmpeg", "-y", "-hide_banner", "-loglevel", "error", "-f", "lavfi", "-i", "testsrc2=size=320x180:rate=25",
+         "-t", "10", "-c:v", "libx264", "-preset", "ultrafast", "-g", "30", "-keyint_min", "30", "-sc_threshold", "0",
+         "-pix_fmt", "yuv420p", str(path)],
+        check=True,
+    )
+    return path
+
+def _frames(path: Path):
+    """(video frames, whether the first one is a keyframe), read by decoding the file."""
+    out = subprocess.run(["ffmpeg", "-hide_banner", "-i", str(path), "-map", "0:v:0", "-vf", "showinfo", "-f", "null", "-"],
+                         capture_output=True, text=True, check=True).stderr
+    keys = re.findall(r"\] n:\s*\d+ .*?iskey:(\d)", out)
+    return len(keys), keys[:1] == ["1"]
+
+def _plan(tmp_path: Path, *sizes):
+    return [{"width": w, "height": h, "crf": 30, "keep_aspect": True, "out_path": tmp_path / f"out_{h}p.mp4"}
+            for w, h in sizes]
+
+def test_split_cuts_at_keyframes_without_losing_frames(source_gop30, tmp_path):
+    chunks = ffmpeg_runner._split(source_gop30, tmp_path, 2)
+    counts = [_frames(c) for c in chunks]
+    # cut at the first keyframe at or after each multiple of 2 s: 2.4, 4.8, 6.0, 8.4 s
+    assert [n for n, _key in counts] == [60, 60, 30, 60, 40]
+    assert all(key for _n, key in counts) and sum(n for n, _key in counts) == 250
+
+def test_segmented_output_matches_the_source(source_gop30, tmp_path):
+    done, progress = [], []
+    results = ffmpeg_runner._segmented(source_gop30, _plan(tmp_path, (320, 180), (160, 90)), "low",
+                                       on_result=done.append, seconds=2,
+                                       on_progress=lambda name, p: progress.append((name, p["segments_done"])))
+    assert [r["segments"] for r in results] == [5, 5] and len(done) == 2
+    for r in results:
+        assert _frames(Path(r["path"])) == (250, True)  # 10 s at 25 fps: same frames, same duration
+    assert sorted(n for name, n in progress if name == "out_180p.mp4") == [1, 2, 3, 4, 5]
+    assert not list(tmp_path.glob("seg_*"))  # chunks cleaned up
+
+def test_segmented_fails_when_one_chunk_fails(source_gop30, tmp_path, monkeypatch):
+    one = ffmpeg_runner._one
+
+    def flaky(in_path, out_path, *args, **kwargs):
+        if out_path.name == "r1_00002.mp4":
+            raise RuntimeError("ffmpeg exited 1: chunk 2")
+        return one(in_path, out_path, *args, **kwargs)
+
+    monkeypatch.setattr(ffmpeg_runner, "_one", flaky)
+    done = []
+    with pytest.raises(RuntimeError, match="chunk 2"):
+        ffmpeg_runner._segmented(source_gop30, _plan(tmp_path, (320, 180), (160, 90)), "low",
+                                 on_result=done.append, seconds=2)
+    assert all(r["name"] != "out_90p.mp4" for r in done)  # the broken rendition is never reported
+    assert not (tmp_path / "out_90p.mp4").exists() and not list(tmp_path.glob("seg_*"))
+
+def _rungs(*sizes, keep_aspect=True):
+    return [{"width": w, "height": h, "keep_aspect": keep_aspect} for w, h in sizes]
+
+def test_flat_graph_splits_the_decode_once():
+    graph = ffmpeg_runner._filter_graph(_rungs((854, 480), (1280, 720), keep_aspect=False), cascade=False)
+    assert graph == ("[0:v]split=2[s0][s1];"
+                     "[s0]scale=854:480:flags=lanczos,setsar=1[v0];"
+                     "[s1]scale=1280:720:flags=lanczos,setsar=1[v1]")
+
+def test_cascade_graph_scales_each_rung_from_the_next_larger():
+    graph = ffmpeg_runner._filter_graph(_rungs((854, 480), (1920, 1080), (1280, 720)), cascade=True,
+                                        square_pixels=False)
+    box = ":force_original_aspect_ratio=decrease:force_divisible_by=2:flags=lanczos"
+    assert graph.split(";") == [
+        f"[0:v]scale=1920:1080{box}[c1]", "[c1]split=2[v1][n1]",  # largest from the source
+        f"[n1]scale=1280:720{box}[c2]", "[c2]split=2[v2][n2]",
+        f"[n2]scale=854:480{box}[v0]",  # the smallest ends the chain; labels follow plan order
+    ]
+    assert ffmpeg_runner._filter_graph(_rungs((640, 360)), cascade=True) == \
+        f"[0:v]scale=640:360{box},setsar=1[v0]"
+
+def _size(path: Path) -> tuple:
+    out = subprocess.run(["ffmpeg", "-hide_banner", "-i", str(path)], capture_output=True, text=True).stderr
+    w, h = re.search(r"Video: .*?, (\d+)x(\d+)", out).groups()
+    return int(w), int(h)
+
+@requires_ffmpeg
+@pytest.mark.parametrize("mode", ["single", "cascade"])
+def test_single_decode_modes_write_every_rung(source_720p, tmp_path, mode):
+    specs = [{"width": 480, "height": 270, "crf": 30, "suffix": "270p"},
+             {"width": 960, "height": 540, "crf": 30, "suffix": "540p"},
+             {"width": 640, "height": 480, "crf": 30, "suffix": "box"}]  # 4:3 box: 16:9 fits as 640x360
+    results = transcode(source_720p, tmp_path, specs, intensity="low", mode=mode)
+    sizes = {r["name"].rsplit("_", 1)[-1]: _size(Path(r["path"])) for r in results}
+    assert sizes == {"270p.mp4": (480, 270), "540p.mp4": (960, 540), "box.mp4": (640, 360)}
+    assert {_frames(Path(r["path"])) for r in results} == {(50, True)}  # 2 s at 25 fps each
+    assert len({r["cmd"] for r in results}) == 1  # one ffmpeg process wrote them all
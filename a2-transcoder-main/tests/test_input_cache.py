@@ -0,0 +1,115 @@
+# tests/test_input_cache.py
+from __future__ import annotations
+import os
+import threading
+
+import pytest
+
+from app.services import input_cache
+from app.services.storage import get_stream, put_bytes
+
+MiB = 1024 * 1024
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(input_cache, "CACHE_DIR", tmp_path / "cache")
+    monkeypatch.setattr(input_cache, "MAX_BYTES", 3 * MiB)
+    monkeypatch.setattr(input_cache, "ENABLED", True)
+    return tmp_path / "cache"
+
+def _object(key: str, size: int) -> str:
+    put_bytes(key, os.urandom(size))
+    return key
+
+def _files(cache, ending: str):
+    return sorted(p.name for p in cache.iterdir() if p.name.endswith(ending))
+
+def test_hit_keeps_suffix_and_content(cache):
+    key = _object("ic/a.ts", MiB)
+    pin = input_cache.acquire(key, ".TS")
+    assert pin.path.name.endswith(".data.ts")
+    assert pin.path.read_bytes() == b"".join(get_stream(key)[0])
+    again = input_cache.acquire(key, ".ts")
+    assert again.path == pin.path
+    pin.release()
+    again.release()
+    assert input_cache.acquire(key, "../x").path.name.endswith(".data")  # suffixes are sanitized
+
+def test_concurrent_misses_share_one_download(cache, monkeypatch):
+    key = _object("ic/b.mp4", MiB)
+    calls = []
+    gate = threading.Event()
+
+    def slow_stream(k, *args):
+        calls.append(k)
+        gate.wait(5)
+        return get_stream(k, *args)
+
+    monkeypatch.setattr(input_cache, "get_stream", slow_stream)
+    pins = []
+    threads = [threading.Thread(target=lambda: pins.append(input_cache.acquire(key, ".mp4"))) for _ in range(4)]
+    for t in threads:
+        t.start()
+    gate.set()
+    for t in threads:
+        t.join()
+    assert calls == [key]
+    assert len({p.path for p in pins}) == 1
+    assert input_cache.stats()["pinned"] == 1
+    for p in pins:
+        p.release()
+    assert input_cache.stats()["pinned"] == 0
+
+def test_lru_eviction_spares_pinned_entries_and_removes_lock_files(cache):
+    keys = [_object(f"ic/c{i}.mp4", MiB) for i in range(4)]
+    pinned = input_cache.acquire(keys[0], ".mp4")
+    paths = {}
+    for k in keys[1:3]:
+        pin = input_cache.acquire(k, ".mp4")
+        paths[k] = pin.path
+        pin.release()
+    os.utime(pinned.path, (0, 0))  # oldest of all, but in use
+    os.utime(paths[keys[1]], (1000, 1000))
+    os.utime(paths[keys[2]], (2000, 2000))
+    input_cache.acquire(keys[1], ".mp4").release()  # a hit makes keys[1] the most recent
+
+    last = input_cache.acquire(keys[3], ".mp4")
+    assert pinned.path.exists() and last.path.exists() and paths[keys[1]].exists()
+    assert not paths[keys[2]].exists()  # least recently used and not pinned
+    stats = input_cache.stats()
+    assert stats["entries"] == 3 and stats["size_bytes"] <= input_cache.MAX_BYTES
+    assert f"{paths[keys[2]].name.split('.')[0]}.lock" not in _files(cache, ".lock")
+    assert len(_files(cache, ".lock")) == 4  # three entries + .evict.lock
+    pinned.release()
+    last.release()
+
+def test_reservations_keep_concurrent_misses_within_budget(cache, monkeypatch):
+    first, second = _object("ic/d1.mp4", 2 * MiB), _object("ic/d2.mp4", 2 * MiB)
+    started, gate = threading.Event(), threading.Event()
+
+    def slow_stream(k, *args):
+        if k == first:
+            started.set()
+            gate.wait(5)
+        return get_stream(k, *args)
+
+    monkeypatch.setattr(input_cache, "get_stream", slow_stream)
+    pins = []
+    t = threading.Thread(target=lambda: pins.append(input_cache.acquire(first, ".mp4")))
+    t.start()
+    assert started.wait(5)
+    # first's 2 MiB are reserved while it downloads, so second doesn't fit in 3 MiB
+    assert input_cache.acquire(second, ".mp4") is None
+    gate.set()
+    t.join()
+    assert pins[0].path.stat().st_size == 2 * MiB
+    pins[0].release()
+    # once first is unpinned it can be evicted to make room
+    assert input_cache.acquire(second, ".mp4") is not None
+
+def test_abandoned_partial_downloads_are_swept(cache):
+    cache.mkdir()
+    (cache / f"{'0' * 64}.{2 * MiB}.dead.part").write_bytes(b"x")  # writer gone: not locked
+    key = _object("ic/e.mp4", 2 * MiB)
+    input_cache.acquire(key, ".mp4").release()
+    assert _files(cache, ".part") == []
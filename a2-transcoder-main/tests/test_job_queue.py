@@ -0,0 +1,281 @@
+# tests/test_job_queue.py
+from __future__ import annotations
+from datetime import datetime, timedelta
+from typing import List, Tuple
+import threading
+import time
+
+import pytest
+from sqlalchemy import event
+
+from app import job_queue
+from app.job_queue import Heartbeat, cancel, claim, fail_attempt, finish, heartbeat, preempt, recover_stale, release, stop_requested
+from app.models import Job, SessionLocal, Video, engine
+
+def _enqueue(db, owner: str = "kimia", **values) -> int:
+    video = db.query(Video).first()
+    if video is None:
+        video = Video(owner=owner, filename="uploads/a.mp4", orig_name="a.mp4", size_bytes=10)
+        db.add(video)
+        db.flush()
+    job = Job(owner=owner, video_id=video.id, spec_json="[]", **{"status": "queued", **values})
+    db.add(job)
+    db.commit()
+    return job.id
+
+def _get(db, job_id: int) -> Job:
+    db.expire_all()
+    return db.get(Job, job_id)
+
+def test_claim_takes_oldest_queued_job_under_a_lease(db):
+    first, second = _enqueue(db), _enqueue(db)
+    assert claim(db, "w1") == first
+    job = _get(db, first)
+    assert (job.status, job.lease_owner, job.attempts) == ("running", "w1", 1)
+    assert job.lease_expires_at > datetime.utcnow()
+    assert claim(db, "w2") == second
+    assert claim(db, "w3") is None
+
+def test_claim_skips_jobs_waiting_out_their_backoff(db):
+    _enqueue(db, next_attempt_at=datetime.utcnow() + timedelta(minutes=5))
+    assert claim(db, "w1") is None
+
+def test_heartbeat_extends_only_our_lease(db):
+    job_id = _enqueue(db)
+    claim(db, "w1")
+    db.query(Job).filter(Job.id == job_id).update({"lease_expires_at": datetime.utcnow()})
+    db.commit()
+    assert heartbeat(db, job_id, "w1")
+    assert _get(db, job_id).lease_expires_at > datetime.utcnow() + timedelta(seconds=job_queue.LEASE_SECONDS / 2)
+    assert not heartbeat(db, job_id, "w2")
+
+def test_fail_attempt_backs_off_then_fails(db, monkeypatch):
+    monkeypatch.setattr(job_queue, "MAX_ATTEMPTS", 2)
+    job_id = _enqueue(db)
+    claim(db, "w1")
+    assert fail_attempt(db, job_id, "w1", "boom")
+    db.commit()
+    job = _get(db, job_id)
+    assert (job.status, job.error, job.lease_owner) == ("queued", "boom", None)
+    assert job.next_attempt_at > datetime.utcnow()
+
+    db.query(Job).filter(Job.id == job_id).update({"next_attempt_at": datetime.utcnow()})
+    db.commit()
+    assert claim(db, "w1") == job_id
+    assert fail_attempt(db, job_id, "w1", "boom again")
+    db.commit()
+    job = _get(db, job_id)
+    assert (job.status, job.attempts) == ("failed", 2) and job.finished_at is not None
+
+def test_transitions_are_guarded_by_the_lease(db):
+    job_id = _enqueue(db)
+    claim(db, "w1")
+    assert not finish(db, job_id, "w2", "done")
+    assert not fail_attempt(db, job_id, "w2", "not mine")
+    assert finish(db, job_id, "w1", "done", error=None)
+    db.commit()
+    assert _get(db, job_id).status == "done"
+
+def test_release_requeues_without_counting_the_attempt(db):
+    job_id = _enqueue(db)
+    claim(db, "w1")
+    release(db, job_id, "w1")
+    job = _get(db, job_id)
+    assert (job.status, job.attempts, job.lease_owner) == ("queued", 0, None)
+
+def test_recover_stale_requeues_expired_leases_only(db):
+    expired, live = _enqueue(db), _enqueue(db)
+    claim(db, "dead-worker")
+    claim(db, "live-worker")
+    db.query(Job).filter(Job.id == expired).update({"lease_expires_at": datetime.utcnow() - timedelta(seconds=1)})
+    db.commit()
+
+    assert recover_stale(db) == 1
+    job = _get(db, expired)
+    assert (job.status, job.lease_owner) == ("queued", None)
+    assert "dead-worker" in job.error
+    assert _get(db, live).status == "running"
+
+@pytest.mark.parametrize("attempts, status", [(1, "queued"), (job_queue.MAX_ATTEMPTS, "failed")])
+def test_recover_stale_counts_the_lost_attempt(db, attempts, status):
+    job_id = _enqueue(db)
+    db.query(Job).filter(Job.id == job_id).update(
+        {"status": "running", "attempts": attempts, "lease_owner": "gone", "lease_expires_at": datetime.utcnow()})
+    db.commit()
+    recover_stale(db)
+    assert _get(db, job_id).status == status
+
+def test_concurrent_workers_claim_each_job_exactly_once(db):
+    ids = {_enqueue(db, owner=f"user{i % 3}") for i in range(30)}
+    claimed: List[int] = []
+    lock = threading.Lock()
+
+    def worker(n: int) -> None:
+        with SessionLocal() as s:
+            while (job_id := claim(s, f"w{n}")) is not None:
+                with lock:
+                    claimed.append(job_id)
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(6)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert sorted(claimed) == sorted(ids)  # none missed, none twice
+    assert db.query(Job).filter(Job.status == "running", Job.attempts == 1).count() == len(ids)
+
+def test_recovery_leaves_a_lease_renewed_after_it_looked(db):
+    job_id = _enqueue(db)
+    claim(db, "slow-worker")
+    db.query(Job).filter(Job.id == job_id).update({"lease_expires_at": datetime.utcnow() - timedelta(seconds=1)})
+    db.commit()
+
+    renewed = []
+
+    def renew_first(conn, cursor, statement, *args):
+        # the worker's heartbeat lands between recover_stale's read and its UPDATE
+        if statement.startswith("UPDATE jobs SET status") and not renewed:
+            with SessionLocal() as other:
+                renewed.append(heartbeat(other, job_id, "slow-worker"))
+
+    event.listen(engine, "before_cursor_execute", renew_first)
+    try:
+        with SessionLocal() as recoverer:
+            assert recover_stale(recoverer) == 0
+    finally:
+        event.remove(engine, "before_cursor_execute", renew_first)
+    assert renewed == [True]
+    job = _get(db, job_id)
+    assert (job.status, job.lease_owner) == ("running", "slow-worker")
+
+def _drain(db, n: int) -> List[str]:
+    """Owners of the next n claims."""
+    owners = []
+    for _ in range(n):
+        job_id = claim(db, "w1")
+        owners.append(_get(db, job_id).owner)
+    return owners
+
+def test_fair_share_interleaves_a_bulk_owner_with_others(db):
+    for _ in range(10):
+        _enqueue(db, owner="bulk")
+    _enqueue(db, owner="kimia")
+    _enqueue(db, owner="sara")
+    # bulk's backlog is older, but after its first start the others come first
+    assert _drain(db, 5) == ["bulk", "kimia", "sara", "bulk", "bulk"]
+
+def test_fair_share_follows_weights(db, monkeypatch):
+    monkeypatch.setattr(job_queue, "FAIR_SHARE_WEIGHTS", job_queue._weights("kimia=2"))
+    for _ in range(6):
+        _enqueue(db, owner="kimia")
+        _enqueue(db, owner="sara")
+    owners = _drain(db, 6)
+    assert owners.count("kimia") == 4 and owners.count("sara") == 2
+
+def test_priority_outranks_fair_share(db):
+    _enqueue(db, owner="kimia")
+    claim(db, "w1")  # kimia has used a slot
+    _enqueue(db, owner="sara")
+    urgent = _enqueue(db, owner="kimia", priority=5)
+    assert claim(db, "w1") == urgent
+
+def test_recent_starts_count_until_the_window_passes(db, monkeypatch):
+    done = _enqueue(db, owner="kimia")
+    claim(db, "w1")
+    finish(db, done, "w1", "done")
+    db.commit()
+    _enqueue(db, owner="kimia")
+    _enqueue(db, owner="sara")
+    assert _drain(db, 1) == ["sara"]  # kimia's finished job still counts as recent use
+
+    monkeypatch.setattr(job_queue, "FAIR_SHARE_WINDOW", 0)
+    db.query(Job).filter(Job.status == "running").update({"status": "done"})
+    db.commit()
+    _enqueue(db, owner="sara")
+    assert _drain(db, 1) == ["kimia"]  # usage forgotten: oldest job first
+
+def test_weights_parse():
+    assert job_queue._weights(" alice=4, bot=0.5 ,,carol=0") == {"alice": 4.0, "bot": 0.5, "carol": 0.01}
+
+def test_cancel_ends_a_queued_job_and_flags_a_running_one(db):
+    queued, running = _enqueue(db), _enqueue(db)
+    db.query(Job).filter(Job.id == running).update({"status": "running", "lease_owner": "w1", "attempts": 1})
+    db.commit()
+    assert cancel(db, queued) == "cancelled"
+    assert cancel(db, running) == "running"
+    db.commit()
+    assert _get(db, queued).finished_at is not None
+    assert stop_requested(db, running, "w1") == "cancelled"
+    assert stop_requested(db, running, "w2") == "lease lost"
+    assert fail_attempt(db, running, "w1", "killed")  # the worker unwinds: cancelled, not retried
+    db.commit()
+    assert _get(db, running).status == "cancelled"
+    assert cancel(db, 9999) is None
+
+def test_preempt_flags_the_lowest_priority_latest_started_job(db, monkeypatch):
+    monkeypatch.setattr(job_queue, "PREEMPT_PRIORITY", 1)
+    now = datetime.utcnow()
+    old, new, important = (_enqueue(db, status="running", lease_owner="w1", priority=p, started_at=now - timedelta(seconds=s))
+                           for p, s in ((0, 60), (0, 5), (1, 1)))
+    assert preempt(db, "w1") is None  # nothing urgent waiting
+    _enqueue(db, priority=1)
+    assert preempt(db, "w2") is None  # not w2's jobs
+    assert preempt(db, "w1") == new
+    db.commit()
+    assert preempt(db, "w1") is None  # one at a time
+    assert {j.id: j.stop_reason for j in db.query(Job).filter(Job.status == "running")} == {old: None, new: "preempted", important: None}
+
+def test_an_urgent_job_gets_one_victim_across_dispatchers(db, monkeypatch):
+    monkeypatch.setattr(job_queue, "PREEMPT_PRIORITY", 1)
+    low = {w: _enqueue(db, status="running", lease_owner=w, priority=0, started_at=datetime.utcnow()) for w in ("w1", "w2")}
+    urgent = _enqueue(db, priority=2)
+    assert preempt(db, "w1") == low["w1"]
+    db.commit()
+    assert preempt(db, "w2") is None  # w1's victim is already making room for it
+    assert _get(db, urgent).preempted_job_id == low["w1"]
+
+    second = _enqueue(db, priority=1)
+    assert preempt(db, "w2") == low["w2"]  # a second urgent job gets its own
+    db.commit()
+    assert _get(db, second).preempted_job_id == low["w2"]
+
+    # once the victim has unwound, the job may preempt again if it still isn't running
+    release(db, low["w1"], "w1")
+    assert claim(db, "w3") == urgent and _get(db, urgent).preempted_job_id is None
+
+@pytest.fixture
+def fast_control(monkeypatch):
+    monkeypatch.setattr(job_queue, "CONTROL_POLL_SECONDS", 0.02)
+
+def test_heartbeat_stops_a_cancelled_job_once(db, fast_control):
+    job_id = _enqueue(db)
+    claim(db, "w1")
+    stops: List[Tuple[str, str]] = []
+    with Heartbeat(job_id, "w1", on_stop=lambda *a: stops.append(a)):
+        cancel(db, job_id)
+        db.commit()
+        deadline = time.monotonic() + 5
+        while not stops and time.monotonic() < deadline:
+            time.sleep(0.01)
+        time.sleep(0.1)
+    assert stops == [("cancelled", "cancelled")]
+
+def test_heartbeat_stops_a_job_past_its_timeout(db, fast_control):
+    job_id = _enqueue(db)
+    claim(db, "w1")
+    stopped = threading.Event()
+    stops: List[Tuple[str, str]] = []
+    with Heartbeat(job_id, "w1", on_stop=lambda *a: (stops.append(a), stopped.set()), timeout=0.1):
+        assert stopped.wait(5)
+    assert stops == [("timeout", "job ran past its 0.1s limit")]
+
+def test_startup_recovers_stale_leases_before_the_dispatcher_claims(db, monkeypatch):
+    from app import main
+
+    stale = _enqueue(db, status="running", lease_owner="gone", attempts=1,
+                     lease_expires_at=datetime.utcnow() - timedelta(seconds=1))
+    seen = []
+    monkeypatch.setattr(main, "WORKERS_IN_API", True)
+    monkeypatch.setattr(main.DISPATCHER, "start", lambda: seen.append(_get(db, stale).status))
+    main._startup()
+    assert seen == ["queued"]
@@ -0,0 +1,82 @@
+# tests/test_jobs_api.py
+from __future__ import annotations
+import json
+
+from app.models import Job, Video
+from app.services.storage import put_bytes
+from tests.conftest import auth
+
+def _video(db, owner: str = "kimia") -> Video:
+    v = Video(owner=owner, filename="uploads/a.mp4", orig_name="a.mp4", size_bytes=10)
+    db.add(v)
+    db.commit()
+    return v
+
+def _packaged_outputs(producer: int):
+    root = f"outputs/job_{producer}/"
+    return [{"key": root + "stream/master.m3u8", "name": "stream/master.m3u8", "type": "hls", "size_bytes": 5}]
+
+def test_packaged_segments_resolve_beside_the_manifest(client, db):
+    # Job 2 was served from the result cache: its manifest lives under job 1
+    v = _video(db)
+    db.add_all([
+        Job(id=1, owner="kimia", video_id=v.id, status="done", spec_json="[]", outputs_json=json.dumps(_packaged_outputs(1))),
+        Job(id=2, owner="kimia", video_id=v.id, status="done", spec_json="[]", outputs_json=json.dumps(_packaged_outputs(1))),
+    ])
+    db.commit()
+    put_bytes("outputs/job_1/stream/master.m3u8", b"#EXTM3U\n")
+    put_bytes("outputs/job_1/stream/media_0.m3u8", b"#EXTM3U\n#EXT-X-TARGETDURATION:4\n")
+    put_bytes("outputs/job_1/stream/chunk-0-00001.m4s", b"segment")
+
+    for job_id in (1, 2):
+        r = client.get(f"/jobs/{job_id}/outputs/stream/chunk-0-00001.m4s", headers=auth())
+        assert r.status_code == 200 and r.content == b"segment"
+        assert client.get(f"/jobs/{job_id}/outputs/stream/media_0.m3u8", headers=auth()).status_code == 200
+        assert client.get(f"/jobs/{job_id}/outputs/stream/master.m3u8", headers=auth()).status_code == 200
+    assert client.get("/jobs/2/outputs/stream/../x", headers=auth()).status_code == 404
+    assert client.get("/jobs/2/outputs/stream/chunk-0-00001.m4s", headers=auth("sara")).status_code == 403
+
+def _probed(db, owner: str = "kimia") -> Video:
+    v = Video(owner=owner, filename="uploads/b.mp4", orig_name="b.mp4", size_bytes=10, duration_sec=2.0,
+              width=1280, height=720, video_codec="h264", pix_fmt="yuv420p", fps=25.0, bitrate=300_000)
+    db.add(v)
+    db.commit()
+    return v
+
+def test_batch_submit_inserts_every_job(client, db):
+    a, b = _probed(db), _probed(db)
+    r = client.post("/jobs/transcode:batch", headers=auth(), json={
+        "defaults": {"intensity": "low", "renditions": [{"width": 640, "height": 360}]},
+        "jobs": [{"video_id": a.id}, {"video_id": b.id, "mode": "single"}, {"video_id": a.id, "intensity": "medium"}],
+    })
+    assert r.status_code == 200, r.text
+    body = r.json()
+    assert body["count"] == 3 and body["queued"] == 3
+    jobs = {j.id: j for j in db.query(Job)}
+    assert [jobs[o["job_id"]].video_id for o in body["jobs"]] == [a.id, b.id, a.id]
+    options = [json.loads(jobs[o["job_id"]].options_json) for o in body["jobs"]]
+    assert [(o["intensity"], o["mode"]) for o in options] == [("low", "parallel"), ("low", "single"), ("medium", "parallel")]
+
+def test_batch_rejects_everything_on_one_bad_entry(client, db):
+    mine, theirs = _probed(db), _probed(db, owner="sara")
+    r = client.post("/jobs/transcode:batch", headers=auth(), json={
+        "jobs": [{"video_id": mine.id}, {"video_id": mine.id, "mode": "turbo"}]})
+    assert r.status_code == 400 and r.json()["detail"].startswith("jobs[1]: mode must be one of")
+    r = client.post("/jobs/transcode:batch", headers=auth(), json={"jobs": [{"video_id": mine.id}, {"video_id": theirs.id}]})
+    assert r.status_code == 403 and r.json()["detail"].startswith("jobs[1]:")
+    assert client.post("/jobs/transcode:batch", headers=auth(), json={"jobs": []}).status_code == 400
+    assert db.query(Job).count() == 0
+
+def test_cancel_queued_running_and_finished_jobs(client, db):
+    video = _video(db)
+    jobs = [Job(owner="kimia", video_id=video.id, status=status, spec_json="[]") for status in ("queued", "running", "done")]
+    db.add_all(jobs)
+    db.commit()
+    queued, running, done = (j.id for j in jobs)
+    assert client.post(f"/jobs/{queued}/cancel", headers=auth()).json() == {"job_id": queued, "status": "cancelled", "stopping": False}
+    assert client.post(f"/jobs/{running}/cancel", headers=auth()).json() == {"job_id": running, "status": "running", "stopping": True}
+    r = client.post(f"/jobs/{done}/cancel", headers=auth())
+    assert r.status_code == 409 and r.json()["detail"] == "Job is already done"
+    assert client.post(f"/jobs/{running}/cancel", headers=auth("sara")).status_code == 403
+    db.expire_all()
+    assert db.get(Job, running).stop_reason == "cancelled"
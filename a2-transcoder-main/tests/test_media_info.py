@@ -0,0 +1,79 @@
+# tests/test_media_info.py
+from __future__ import annotations
+import json
+import subprocess
+
+import pytest
+
+from app import ffmpeg_runner
+from app.ffmpeg_runner import probe
+from app.models import Video
+from tests.conftest import auth
+
+def _stream(**extra):
+    return {"codec_name": "h264", "pix_fmt": "yuv420p", "width": 1280, "height": 720,
+            "avg_frame_rate": "25/1", "r_frame_rate": "25/1", "bit_rate": "300000", **extra}
+
+@pytest.fixture
+def ffprobe(monkeypatch):
+    """Point probe() at canned ffprobe JSON: set .output (a dict, or raw bytes)."""
+    class Fake:
+        output = {}
+
+        def run(self, cmd, **kwargs):
+            out = self.output if isinstance(self.output, bytes) else json.dumps(self.output).encode()
+            return subprocess.CompletedProcess(cmd, 0, stdout=out)
+
+    fake = Fake()
+    monkeypatch.setattr(ffmpeg_runner.shutil, "which", lambda name: f"/usr/bin/{name}")
+    monkeypatch.setattr(ffmpeg_runner.subprocess, "run", fake.run)
+    return fake
+
+@pytest.mark.parametrize("stream, size", [
+    (_stream(), (1280, 720)),
+    (_stream(tags={"rotate": "90"}), (720, 1280)),  # older muxers: a rotate tag
+    (_stream(side_data_list=[{"side_data_type": "Display Matrix", "rotation": -90}]), (720, 1280)),
+    (_stream(side_data_list=[{"side_data_type": "Display Matrix", "rotation": 180}]), (1280, 720)),
+    (_stream(tags={"rotate": "90"}, side_data_list=[{"side_data_type": "Display Matrix", "rotation": 0}]), (1280, 720)),
+])
+def test_probe_reports_the_displayed_size(ffprobe, stream, size):
+    ffprobe.output = {"streams": [stream], "format": {"duration": "12.5", "bit_rate": "320000"}}
+    info = probe("/videos/clip.mp4")
+    assert (info["width"], info["height"]) == size
+    assert info == {"duration_sec": 12.5, "width": size[0], "height": size[1], "video_codec": "h264",
+                    "pix_fmt": "yuv420p", "fps": 25.0, "bitrate": 300000}
+
+def test_probe_falls_back_to_stream_and_format_fields(ffprobe):
+    ffprobe.output = {"streams": [_stream(avg_frame_rate="0/0", r_frame_rate="30000/1001", bit_rate=None, duration="3.0")],
+                      "format": {"bit_rate": "400000"}}
+    info = probe("/videos/clip.mp4")
+    assert (info["duration_sec"], round(info["fps"], 3), info["bitrate"]) == (3.0, 29.97, 400000)
+
+@pytest.mark.parametrize("output", [{"streams": []}, b"not json", b""])
+def test_probe_of_an_unreadable_source_is_none(ffprobe, output):
+    ffprobe.output = output
+    assert probe("/videos/clip.mp4") is None
+
+def test_probe_without_ffprobe_is_none(monkeypatch):
+    monkeypatch.setattr(ffmpeg_runner.shutil, "which", lambda name: None)
+    assert probe("/videos/clip.mp4") is None
+
+def test_ladder_is_fitted_to_the_rotated_source(client, db, ffprobe):
+    ffprobe.output = {"streams": [_stream(side_data_list=[{"rotation": -90}])], "format": {"duration": "2.0"}}
+    r = client.post("/videos/upload", headers=auth(), files={"file": ("phone.mp4", b"portrait" * 100, "video/mp4")})
+    media = r.json()["media"]
+    assert (media["width"], media["height"]) == (720, 1280)
+
+    video_id = r.json()["video_id"]
+    r = client.post("/jobs/transcode", headers=auth(), json={"video_id": video_id, "renditions": [
+        {"width": 1920, "height": 1080, "suffix": "1080p"},
+        {"width": 1280, "height": 720, "suffix": "720p"},
+        {"width": 2560, "height": 2560, "suffix": "box"},
+        {"width": 720, "height": 1280, "suffix": "native"},
+    ]})
+    assert r.status_code == 200, r.text
+    body = r.json()
+    sizes = {s["suffix"]: (s["width"], s["height"]) for s in body["renditions"]}
+    assert sizes == {"1080p": (606, 1080), "720p": (404, 720), "native": (720, 1280)}  # portrait, never upscaled
+    assert body["dropped"] == ["box"]  # also at or above the source: the smaller box is kept
+    assert db.get(Video, video_id).width == 720
@@ -0,0 +1,83 @@
+# tests/test_media_response.py
+from __future__ import annotations
+
+import pytest
+
+from app import media_response
+from app.media_response import parse_range
+from app.models import Video
+from app.services.storage import put_bytes
+from tests.conftest import auth
+
+BODY = bytes(range(256)) * 40  # 10240 bytes
+
+@pytest.mark.parametrize("header, expected", [
+    (None, None),
+    ("bytes=0-99", (0, 99)),
+    ("bytes=10240-", ValueError),
+    ("bytes=100-", (100, 10239)),
+    ("bytes=-100", (10140, 10239)),
+    ("bytes=-99999", (0, 10239)),
+    ("bytes=9000-99999", (9000, 10239)),
+    ("bytes=-0", ValueError),
+    ("bytes=20000-20001", ValueError),
+    ("bytes=5-1", None),
+    ("bytes=0-1,5-6", None),
+    ("items=0-1", None),
+    ("bytes=a-b", None),
+])
+def test_parse_range(header, expected):
+    if expected is ValueError:
+        with pytest.raises(ValueError):
+            parse_range(header, len(BODY))
+    else:
+        assert parse_range(header, len(BODY)) == expected
+
+@pytest.fixture(params=["file", "stream"])
+def url(request, db, monkeypatch):
+    """Download URL of a stored video, sent from the local file or as a ranged stream."""
+    if request.param == "stream":
+        monkeypatch.setattr(media_response, "local_path", lambda key: None)
+    put_bytes("uploads/range.mp4", BODY, "video/mp4")
+    video = Video(owner="kimia", filename="uploads/range.mp4", orig_name="range.mp4", size_bytes=len(BODY))
+    db.add(video)
+    db.commit()
+    return f"/videos/{video.id}/download"
+
+def test_full_download(client, url):
+    r = client.get(url, headers=auth())
+    assert r.status_code == 200 and r.content == BODY
+    assert r.headers["accept-ranges"] == "bytes" and r.headers["content-length"] == str(len(BODY))
+    assert r.headers["etag"] and r.headers["last-modified"]
+
+@pytest.mark.parametrize("rng, start, end", [("bytes=100-199", 100, 199), ("bytes=-10", 10230, 10239), ("bytes=10000-", 10000, 10239)])
+def test_range_is_206_with_content_range(client, url, rng, start, end):
+    r = client.get(url, headers={**auth(), "Range": rng})
+    assert r.status_code == 206
+    assert r.headers["content-range"] == f"bytes {start}-{end}/{len(BODY)}"
+    assert r.headers["content-length"] == str(end - start + 1)
+    assert r.content == BODY[start:end + 1]
+
+def test_unsatisfiable_range_is_416(client, url):
+    r = client.get(url, headers={**auth(), "Range": f"bytes={len(BODY)}-"})
+    assert r.status_code == 416 and r.headers["content-range"] == f"bytes */{len(BODY)}"
+
+def test_if_none_match(client, url):
+    etag = client.get(url, headers=auth()).headers["etag"]
+    for inm in (etag, f'"other", {etag}', "*", f"W/{etag}", f'W/"other",W/{etag}'):
+        r = client.get(url, headers={**auth(), "If-None-Match": inm})
+        assert r.status_code == 304 and r.content == b"" and r.headers["etag"] == etag
+    assert client.get(url, headers={**auth(), "If-None-Match": '"other"'}).status_code == 200
+
+def test_if_range(client, url):
+    etag = client.get(url, headers=auth()).headers["etag"]
+    r = client.get(url, headers={**auth(), "Range": "bytes=0-9", "If-Range": etag})
+    assert r.status_code == 206 and r.content == BODY[:10]
+    r = client.get(url, headers={**auth(), "Range": "bytes=0-9", "If-Range": '"stale"'})
+    assert r.status_code == 200 and r.content == BODY  # changed since: the whole object
+    r = client.get(url, headers={**auth(), "Range": "bytes=0-9", "If-Range": f"W/{etag}"})
+    assert r.status_code == 200  # If-Range compares strongly
+
+def test_download_is_owner_only(client, url):
+    assert client.get(url, headers=auth("sara")).status_code == 403
+    assert client.get(url, headers=auth("admin")).status_code == 200
@@ -0,0 +1,45 @@
+# tests/test_metrics.py
+from __future__ import annotations
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import re
+import time
+
+from app import metrics
+from app.metrics import Registry
+
+def test_render_counters_gauges_and_histograms():
+    reg = Registry()
+    reg.declare("c_total", "counter", "A counter.")
+    reg.declare("h_seconds", "histogram", "A histogram.", (0.1, 1))
+    reg.add_collector(lambda: [("c_total", {"src": "db"}, 7)])
+    reg.apply("inc", "c_total", 2, (("path", 'a"b'),))
+    for v in (0.05, 0.5, 5):
+        reg.apply("observe", "h_seconds", v, ())
+    text = reg.render()
+    assert 'c_total{path="a\\"b"} 2\nc_total{src="db"} 7\n' in text
+    assert 'h_seconds_bucket{le="0.1"} 1\nh_seconds_bucket{le="1"} 2\nh_seconds_bucket{le="+Inf"} 3\n' in text
+    assert "h_seconds_sum 5.55\nh_seconds_count 3\n" in text
+
+def _value(text: str, series: str) -> float:
+    m = re.search(rf"^{re.escape(series)} (\S+)$", text, re.M)
+    return float(m.group(1)) if m else 0.0
+
+def test_metrics_scrape_covers_requests_and_worker_processes(client):
+    fwd = metrics.get_forwarder()
+    fwd.start()  # the API's startup does this
+    series = 'transcoder_ffmpeg_runs_total{op="scrape-test",outcome="ok"}'
+    before = _value(client.get("/metrics").text, series)
+
+    assert client.get("/health").status_code == 200
+    with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context("spawn"),
+                             initializer=metrics.install, initargs=(fwd,)) as pool:
+        pool.submit(metrics.inc, "transcoder_ffmpeg_runs_total", 3, op="scrape-test", outcome="ok").result()
+
+    deadline = time.monotonic() + 10
+    text = client.get("/metrics").text
+    while _value(text, series) < before + 3 and time.monotonic() < deadline:
+        time.sleep(0.05)  # forwarded asynchronously, drained by the API's thread
+        text = client.get("/metrics").text
+    assert _value(text, series) == before + 3
+    assert _value(text, 'transcoder_http_request_duration_seconds_count{method="GET",route="/health",status="200"}') >= 1
@@ -0,0 +1,37 @@
+# tests/test_models.py
+from __future__ import annotations
+
+from sqlalchemy import inspect, text
+
+from app.models import Base, Job, SessionLocal, Video, engine, init_db
+
+# The schema as first shipped, before any column or index was added
+BASELINE = [
+    """CREATE TABLE videos (
+        id INTEGER NOT NULL PRIMARY KEY, owner VARCHAR(64) NOT NULL, filename VARCHAR(512) NOT NULL,
+        orig_name VARCHAR(255) NOT NULL, size_bytes INTEGER NOT NULL, duration_sec FLOAT, created_at DATETIME NOT NULL)""",
+    """CREATE TABLE jobs (
+        id INTEGER NOT NULL PRIMARY KEY, owner VARCHAR(64) NOT NULL, video_id INTEGER NOT NULL REFERENCES videos (id),
+        status VARCHAR(16) NOT NULL, spec_json TEXT NOT NULL, outputs_json TEXT, error TEXT,
+        started_at DATETIME, finished_at DATETIME)""",
+    "INSERT INTO videos VALUES (1, 'kimia', 'uploads/a.mp4', 'a.mp4', 10, 2.0, '2025-01-01 00:00:00')",
+    "INSERT INTO jobs VALUES (1, 'kimia', 1, 'done', '[]', '[]', NULL, NULL, NULL)",
+]
+
+def test_init_db_upgrades_baseline_schema():
+    Base.metadata.drop_all(engine)
+    with engine.begin() as conn:
+        for stmt in BASELINE:
+            conn.execute(text(stmt))
+
+    init_db()
+    init_db()  # idempotent
+
+    insp = inspect(engine)
+    for table in (Video.__table__, Job.__table__):
+        assert {c["name"] for c in insp.get_columns(table.name)} == set(table.columns.keys())
+        assert {i["name"] for i in insp.get_indexes(table.name)} >= {i.name for i in table.indexes}
+    with SessionLocal() as db:
+        job = db.get(Job, 1)
+        assert (job.attempts, job.priority, job.stop_reason) == (0, 0, None)
+        assert db.get(Video, 1).content_hash is None
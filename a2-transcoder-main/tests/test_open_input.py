@@ -0,0 +1,98 @@
+# tests/test_open_input.py
+"""jobs._open_input: how a job's source reaches ffmpeg for each INPUT_HANDOFF."""
+from __future__ import annotations
+from pathlib import Path
+import errno
+import os
+import subprocess
+
+import pytest
+
+from app import jobs
+from app.ffmpeg_runner import transcode
+from app.services import input_cache
+from app.services.storage import local_path, put_bytes, put_file
+from tests.conftest import requires_ffmpeg
+
+KEY = "uploads/handoff.mp4"
+BODY = b"not really a video" * 100
+
+@pytest.fixture
+def stored():
+    put_bytes(KEY, BODY, "video/mp4")
+    return Path(local_path(KEY))
+
+@pytest.fixture
+def remote(monkeypatch):
+    """The object has no local path, as on the s3 backend."""
+    monkeypatch.setattr(jobs, "local_path", lambda key: None)
+    monkeypatch.setattr(jobs, "presign_get", lambda key, ttl=300: None)
+
+def _handoff(monkeypatch, handoff: str) -> None:
+    monkeypatch.setattr(jobs, "INPUT_HANDOFF", handoff)
+
+def test_local_object_is_hardlinked(stored):
+    src, release, stdin = jobs._open_input(KEY, ".mp4", "parallel")
+    assert src != stored and src.suffix == ".mp4" and stdin is None
+    assert os.stat(src).st_ino == os.stat(stored).st_ino  # same inode: no copy
+    release()
+    assert not src.exists() and stored.read_bytes() == BODY
+
+def test_local_object_across_filesystems_is_read_in_place(stored, monkeypatch):
+    def cross_device(src, dst):
+        raise OSError(errno.EXDEV, "Invalid cross-device link")
+    monkeypatch.setattr(jobs.os, "link", cross_device)
+    src, release, stdin = jobs._open_input(KEY, ".mp4", "parallel")
+    assert src == stored and stdin is None
+    release()
+    assert stored.exists()  # not ours to remove
+
+def test_copy_handoff_copies(stored, monkeypatch):
+    _handoff(monkeypatch, "copy")
+    src, release, stdin = jobs._open_input(KEY, ".mp4", "parallel")
+    assert src.read_bytes() == BODY and os.stat(src).st_ino != os.stat(stored).st_ino and stdin is None
+    release()
+    assert not src.exists()
+
+def test_remote_object_comes_from_the_input_cache(stored, remote, monkeypatch):
+    monkeypatch.setattr(input_cache, "ENABLED", True)
+    src, release, stdin = jobs._open_input(KEY, ".mp4", "parallel")
+    try:
+        assert src.parent == input_cache.CACHE_DIR and src.read_bytes() == BODY and stdin is None
+    finally:
+        release()
+
+def test_remote_object_by_presigned_url(stored, remote, monkeypatch):
+    _handoff(monkeypatch, "url")
+    monkeypatch.setattr(jobs, "presign_get", lambda key, ttl=300: f"https://bucket.example/{key}?sig=1")
+    src, _release, stdin = jobs._open_input(KEY, ".mp4", "parallel")
+    assert src == f"https://bucket.example/{KEY}?sig=1" and stdin is None
+
+@pytest.mark.parametrize("handoff", ["url", "pipe"])
+def test_remote_object_falls_back_to_a_copy(stored, remote, monkeypatch, handoff):
+    _handoff(monkeypatch, handoff)  # no URL to give; parallel mode can't share one stdin
+    src, release, stdin = jobs._open_input(KEY, ".mp4", "parallel")
+    assert isinstance(src, Path) and src.read_bytes() == BODY and stdin is None
+    release()
+    assert not src.exists()
+
+@pytest.mark.parametrize("mode", ["single", "cascade"])
+def test_remote_object_piped_to_single_decode_modes(stored, remote, monkeypatch, mode):
+    _handoff(monkeypatch, "pipe")
+    src, _release, stdin = jobs._open_input(KEY, ".mp4", mode)
+    assert src == "pipe:0" and b"".join(stdin) == BODY
+
+@requires_ffmpeg
+def test_piped_input_transcodes(source_720p, tmp_path, remote, monkeypatch):
+    mkv = tmp_path / "src.mkv"  # streamable: an MP4 with its moov at the end can't be read from a pipe
+    subprocess.run(["ffmpeg", "-y", "-hide_banner", "-loglevel", "error", "-i", str(source_720p), "-c", "copy", str(mkv)],
+                   check=True)
+    put_file("uploads/piped.mkv", str(mkv), "video/x-matroska")
+    _handoff(monkeypatch, "pipe")
+    src, release, stdin = jobs._open_input("uploads/piped.mkv", ".mkv", "single")
+    try:
+        out = transcode(src, tmp_path / "out", [{"width": 320, "height": 180, "crf": 30, "suffix": "180p"}],
+                        intensity="low", mode="single", stdin=stdin, duration=2.0)
+    finally:
+        release()
+    assert len(out) == 1 and Path(out[0]["path"]).stat().st_size > 0
@@ -0,0 +1,74 @@
+# tests/test_pagination.py
+from __future__ import annotations
+from typing import List
+
+import pytest
+
+from app.models import Job, Video
+from app.pagination import NEXT_CURSOR_HEADER, decode_cursor, encode_cursor
+from tests.conftest import auth
+
+def test_cursor_round_trip():
+    assert decode_cursor(encode_cursor(12345)) == 12345
+
+@pytest.mark.parametrize("cursor", ["", "!!", "bm90IGpzb24", encode_cursor(1)[:-2], "eyJpZCI6IngifQ", "eyJpZCI6dHJ1ZX0", "WzFd"])
+def test_foreign_cursors_are_rejected(cursor):
+    with pytest.raises(ValueError):
+        decode_cursor(cursor)
+
+def _jobs(db, owners: List[str], **values) -> List[int]:
+    video = Video(owner="kimia", filename="uploads/a.mp4", orig_name="a.mp4", size_bytes=10)
+    db.add(video)
+    db.flush()
+    jobs = [Job(owner=owner, video_id=video.id, status=values.get("status", "queued"), spec_json="[]") for owner in owners]
+    db.add_all(jobs)
+    db.commit()
+    return [j.id for j in jobs]
+
+def _walk(client, url: str, user: str = "kimia", **params) -> List[List[int]]:
+    pages, cursor = [], None
+    while True:
+        r = client.get(url, params={**params, "cursor": cursor} if cursor else params, headers=auth(user))
+        assert r.status_code == 200
+        pages.append([item["id"] for item in r.json()])
+        cursor = r.headers.get(NEXT_CURSOR_HEADER)
+        if not cursor:
+            return pages
+
+def test_jobs_pages_newest_first_without_gaps(client, db):
+    ids = _jobs(db, ["kimia", "sara"] * 5)
+    mine, theirs = ids[0::2][::-1], ids[1::2][::-1]
+    assert _walk(client, "/jobs", limit=2) == [mine[0:2], mine[2:4], mine[4:5]]
+    assert _walk(client, "/jobs", limit=5) == [mine]  # an exact fit has no next page
+    assert _walk(client, "/jobs", user="admin", limit=4, owner="sara") == [theirs[:4], theirs[4:]]
+
+def test_jobs_cursor_survives_inserts_and_filters(client, db):
+    ids = _jobs(db, ["kimia"] * 4)
+    r = client.get("/jobs?limit=2", headers=auth())
+    cursor = r.headers[NEXT_CURSOR_HEADER]
+    _jobs(db, ["kimia"] * 3)  # newer rows don't shift the next page
+    r = client.get("/jobs", params={"limit": 2, "cursor": cursor, "offset": 100}, headers=auth())
+    assert [j["id"] for j in r.json()] == [ids[1], ids[0]]  # offset is ignored with a cursor
+    assert NEXT_CURSOR_HEADER not in r.headers
+    _jobs(db, ["kimia"], status="done")
+    assert len(client.get("/jobs?status=done", headers=auth()).json()) == 1
+
+def test_legacy_offset_still_works_on_the_first_page(client, db):
+    ids = _jobs(db, ["kimia"] * 5)
+    r = client.get("/jobs?limit=2&offset=2", headers=auth())
+    assert [j["id"] for j in r.json()] == [ids[2], ids[1]]
+    assert decode_cursor(r.headers[NEXT_CURSOR_HEADER]) == ids[1]
+
+def test_invalid_cursor_is_400(client, db):
+    for url in ("/jobs", "/videos-sql"):
+        r = client.get(url, params={"cursor": "garbage!"}, headers=auth())
+        assert r.status_code == 400 and r.json()["detail"] == "Invalid cursor"
+
+def test_videos_sql_pages(client, db):
+    videos = [Video(owner=owner, filename=f"uploads/{n}.mp4", orig_name=f"{n}.mp4", size_bytes=1)
+              for n, owner in enumerate(["kimia", "kimia", "sara", "kimia"])]
+    db.add_all(videos)
+    db.commit()
+    mine = [v.id for v in reversed(videos) if v.owner == "kimia"]
+    assert _walk(client, "/videos-sql", limit=2) == [mine[:2], mine[2:]]
+    assert sum(_walk(client, "/videos-sql", user="admin", limit=1), []) == [v.id for v in reversed(videos)]
@@ -0,0 +1,89 @@
+# tests/test_result_cache.py
+from __future__ import annotations
+from datetime import datetime, timedelta
+
+from app.models import CacheObjects, TranscodeCache
+from app.services import result_cache
+from app.services.storage import exists, put_bytes
+
+H = "ab" * 32
+LADDER = [{"width": 1280, "height": 720, "crf": 20, "suffix": "720p"},
+          {"width": 640, "height": 360, "crf": 24, "suffix": "360p"}]
+
+def test_cache_key_ignores_rung_order_and_unrelated_fields():
+    key = result_cache.cache_key(H, LADDER, "high")
+    assert result_cache.cache_key(H, list(reversed(LADDER)), "HIGH") == key
+    assert result_cache.cache_key(H, [{**r, "intensity": "low"} for r in LADDER], "high") == key
+    # packaging runs its own ladder whatever the mode
+    hls = result_cache.cache_key(H, LADDER, "high", packaging="hls")
+    assert result_cache.cache_key(H, LADDER, "high", mode="cascade", packaging="hls") == hls
+
+def test_cache_key_changes_with_what_changes_the_bytes():
+    key = result_cache.cache_key(H, LADDER, "high")
+    others = {
+        result_cache.cache_key("cd" * 32, LADDER, "high"),
+        result_cache.cache_key(H, LADDER, "low"),
+        result_cache.cache_key(H, LADDER, "high", mode="cascade"),
+        result_cache.cache_key(H, LADDER, "high", mode="single"),
+        result_cache.cache_key(H, LADDER, "high", packaging="hls"),
+        result_cache.cache_key(H, LADDER, "high", thumbnails={"poster": "jpg"}),
+        result_cache.cache_key(H, [{**LADDER[0], "crf": 21}, LADDER[1]], "high"),
+        result_cache.cache_key(H, [{**LADDER[0], "fitted": True}, LADDER[1]], "high"),
+    }
+    assert key not in others and len(others) == 8
+
+def test_lookup_and_store(db):
+    key = result_cache.cache_key(H, LADDER, "high")
+    assert result_cache.lookup(db, key) is None
+    outputs = [{"key": "outputs/job_1/a_720p.mp4", "name": "a_720p.mp4", "size_bytes": 10, "url": "https://x"}]
+    result_cache.store(db, key, H, 1, outputs)
+    hit = result_cache.lookup(db, key)
+    assert hit == [{"key": "outputs/job_1/a_720p.mp4", "name": "a_720p.mp4", "size_bytes": 10}]  # no stale URL
+    assert db.get(TranscodeCache, key).hits == 1
+
+def _outputs(job_id: int, size: int = 10) -> list:
+    put_bytes(f"outputs/job_{job_id}/a.mp4", b"x" * size)
+    return [{"key": f"outputs/job_{job_id}/a.mp4", "name": "a.mp4", "size_bytes": size}]
+
+def test_evict_deletes_objects_no_entry_holds(db, monkeypatch):
+    monkeypatch.setattr(result_cache, "MAX_BYTES", 10 ** 6)
+    for i in range(3):
+        result_cache.store(db, str(i), H, i, _outputs(i))
+    result_cache.store(db, "3", H, 2, _outputs(2))  # a second entry on job 2's objects
+    now = datetime.utcnow()
+    for i, row in enumerate(db.query(TranscodeCache).order_by(TranscodeCache.cache_key)):
+        row.last_used_at = now + timedelta(seconds=i)
+    db.commit()
+    assert result_cache.usage(db) == (4, 30)
+
+    assert result_cache.evict(db, max_bytes=15) == 2
+    assert [r.cache_key for r in db.query(TranscodeCache).order_by(TranscodeCache.cache_key)] == ["2", "3"]
+    assert [exists(f"outputs/job_{i}/a.mp4") for i in range(3)] == [False, False, True]
+    assert (db.get(CacheObjects, "outputs/job_2/").refs, result_cache.usage(db)) == (2, (2, 10))
+
+    assert result_cache.evict(db, max_bytes=0) == 2  # the last holder goes, then the objects
+    assert not exists("outputs/job_2/a.mp4") and db.query(CacheObjects).count() == 0
+
+def test_restore_moves_the_reference(db):
+    result_cache.store(db, "k", H, 1, _outputs(1))
+    result_cache.store(db, "k", H, 2, _outputs(2))
+    assert not exists("outputs/job_1/a.mp4") and exists("outputs/job_2/a.mp4")
+    assert [(o.prefix, o.refs) for o in db.query(CacheObjects)] == [("outputs/job_2/", 1)]
+
+def test_a_package_counts_every_segment(db):
+    put_bytes("outputs/job_5/stream/seg_0.m4s", b"x" * 90)
+    manifest = {"key": "outputs/job_5/stream/master.m3u8", "name": "stream/master.m3u8", "size_bytes": 10,
+                "type": "hls", "package_bytes": 100}
+    result_cache.store(db, "pkg", H, 5, [manifest])
+    assert result_cache.usage(db) == (1, 100)
+    result_cache.evict(db, max_bytes=0)
+    assert not exists("outputs/job_5/stream/seg_0.m4s")
+
+def test_evicting_an_entry_from_before_refcounting_keeps_its_objects(db):
+    put_bytes("outputs/job_9/a.mp4", b"x" * 10)
+    db.add(TranscodeCache(cache_key="old", content_hash=H, job_id=9, size_bytes=10,
+                          outputs_json='[{"key": "outputs/job_9/a.mp4", "name": "a.mp4"}]'))
+    db.commit()
+    result_cache.store(db, "new", H, 1, _outputs(1))
+    assert result_cache.evict(db, max_bytes=0) == 2
+    assert exists("outputs/job_9/a.mp4") and not exists("outputs/job_1/a.mp4")
@@ -0,0 +1,129 @@
+# tests/test_run_job.py
+"""_run_job's error paths, run in-process against a claimed job."""
+from __future__ import annotations
+from datetime import datetime, timedelta
+import json
+
+import pytest
+from botocore.exceptions import EndpointConnectionError
+
+from app import jobs, metrics
+from app.job_queue import claim
+from app.models import Job, SessionLocal, TranscodeCache, Video
+from app.services.storage import put_file
+from tests.conftest import requires_ffmpeg
+
+WORKER = "test-worker"
+
+def _claimed(db, options_json=None, spec_json='[{"width": 640, "height": 360}]') -> int:
+    # duration set, so a deadline in the options is read
+    v = Video(owner="kimia", filename="uploads/missing.mp4", orig_name="a.mp4", size_bytes=10, duration_sec=2.0)
+    db.add(v)
+    db.flush()
+    db.add(Job(owner="kimia", video_id=v.id, status="queued", spec_json=spec_json, options_json=options_json))
+    db.commit()
+    job_id = claim(db, WORKER)
+    assert job_id is not None
+    return job_id
+
+def _job(job_id: int) -> Job:
+    with SessionLocal() as s:
+        return s.get(Job, job_id)
+
+def _finished(outcome: str) -> float:
+    fam = metrics.REGISTRY._families["transcoder_jobs_finished_total"]
+    return fam.values.get((("outcome", outcome),), 0.0)
+
+@pytest.mark.parametrize("options_json", ["{not json", '{"deadline_at": "tomorrow"}', "[]",
+                                          '{"timeout_seconds": "soon"}'])
+def test_malformed_options_fail_without_retry(db, options_json):
+    job_id = _claimed(db, options_json=options_json)
+    before = _finished("failed")
+
+    jobs._run_job(job_id, WORKER)
+
+    job = _job(job_id)
+    assert job.status == "failed" and job.error.startswith("Invalid job spec or options")
+    assert job.lease_owner is None and job.next_attempt_at is None
+    assert _finished("failed") == before + 1
+
+def test_malformed_spec_fails_without_retry(db):
+    job_id = _claimed(db, spec_json='{"width": 640}')
+    jobs._run_job(job_id, WORKER)
+    assert _job(job_id).status == "failed"
+
+@pytest.mark.parametrize("error", [EndpointConnectionError(endpoint_url="https://s3.example"), OSError("disk full")])
+def test_input_errors_are_retried(db, monkeypatch, error):
+    def broken(*_args):
+        raise error
+    monkeypatch.setattr(jobs, "_open_input", broken)
+    job_id = _claimed(db)
+    before = _finished("error")
+
+    jobs._run_job(job_id, WORKER)
+
+    job = _job(job_id)
+    assert job.status == "queued" and job.next_attempt_at is not None  # backoff before the next attempt
+    assert job.attempts == 1 and job.lease_owner is None and str(error) in job.error
+    assert _finished("error") == before + 1
+
+def test_missing_input_fails(db):
+    job_id = _claimed(db)
+    jobs._run_job(job_id, WORKER)
+    job = _job(job_id)
+    assert job.status == "failed" and job.error == "Input object missing: uploads/missing.mp4"
+
+@requires_ffmpeg
+@pytest.mark.parametrize("mode", ["single", "cascade", "parallel"])
+def test_deadline_encodes_the_ladder_whole(db, monkeypatch, source_720p, mode):
+    calls, samples = [], []
+    transcode = jobs.transcode
+    monkeypatch.setattr(jobs, "transcode", lambda src, out, specs, **kw: calls.append(len(specs)) or transcode(src, out, specs, **kw))
+    monkeypatch.setattr(jobs, "_record_throughput", lambda *args: samples.append(args))
+    put_file("uploads/deadline.mp4", str(source_720p), "video/mp4")
+    v = Video(owner="kimia", filename="uploads/deadline.mp4", orig_name="d.mp4", size_bytes=1, duration_sec=2.0, fps=25.0)
+    db.add(v)
+    db.flush()
+    options = {"mode": mode, "intensity": "low", "max_intensity": "high",
+               "deadline_at": (datetime.utcnow() + timedelta(minutes=10)).isoformat()}
+    db.add(Job(owner="kimia", video_id=v.id, status="queued", options_json=json.dumps(options),
+               spec_json='[{"width": 640, "height": 360, "crf": 30}, {"width": 320, "height": 180, "crf": 30}]'))
+    db.commit()
+    job_id = claim(db, WORKER)
+
+    jobs._run_job(job_id, WORKER)
+
+    assert _job(job_id).status == "done"
+    assert calls == [2]  # one transcode of both rungs, not one per rung
+    assert [(intensity, m) for intensity, m, _work, _secs in samples] == [("high", mode)]  # one whole-ladder sample
+
+@requires_ffmpeg
+@pytest.mark.parametrize("packaging, broken", [("mp4", "_180p.mp4"), ("hls", "media_1.m3u8")])
+def test_a_failed_upload_does_not_finish_the_job(db, monkeypatch, source_720p, packaging, broken):
+    upload = jobs._upload_output
+
+    def flaky(p, job_id, rel=None):
+        if p.name.endswith(broken):
+            raise OSError("connection reset while uploading")
+        return upload(p, job_id, rel)
+
+    monkeypatch.setattr(jobs, "_upload_output", flaky)
+    put_file("uploads/src.mp4", str(source_720p), "video/mp4")
+    v = Video(owner="kimia", filename="uploads/src.mp4", orig_name="src.mp4", size_bytes=1, duration_sec=2.0,
+              fps=25.0, content_hash="ab" * 32)
+    db.add(v)
+    db.flush()
+    db.add(Job(owner="kimia", video_id=v.id, status="queued",
+               options_json=json.dumps({"mode": "single", "intensity": "low", "packaging": packaging}),
+               spec_json='[{"width": 320, "height": 180, "crf": 30, "suffix": "180p"}, '
+                         '{"width": 640, "height": 360, "crf": 30, "suffix": "360p"}]'))
+    db.commit()
+    job_id = claim(db, WORKER)
+
+    jobs._run_job(job_id, WORKER)
+
+    job = _job(job_id)
+    assert job.status == "queued" and job.next_attempt_at is not None  # retried, not done
+    assert "connection reset" in job.error and job.outputs_json is None
+    with SessionLocal() as s:
+        assert s.query(TranscodeCache).count() == 0  # nothing to reuse either
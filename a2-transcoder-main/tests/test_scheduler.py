@@ -0,0 +1,66 @@
+# tests/test_scheduler.py
+from __future__ import annotations
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+import threading
+import time
+
+import pytest
+
+from app import jobs, scheduler
+from app.job_queue import Dispatcher
+from app.scheduler import CoreBudget
+
+@pytest.mark.parametrize("size, intensity, total, expected", [
+    ((640, 360), "high", 16, 2),     # 0.23 MP: ceil(1 + 0.46)
+    ((1920, 1080), "high", 16, 6),   # 2.07 MP: ceil(1 + 4.15)
+    ((1920, 1080), "low", 16, 4),    # faster presets keep fewer threads busy
+    ((3840, 2160), "max", 64, 16),   # capped at MAX_THREADS_PER_ENCODE
+    ((3840, 2160), "high", 4, 4),    # never more than the budget
+])
+def test_threads_for(size, intensity, total, expected):
+    assert CoreBudget(total).threads_for(*size, intensity) == expected
+
+def test_acquire_waits_for_cores_released_by_another_encode():
+    budget = CoreBudget(4)
+    assert budget.acquire(99) == 4  # clamped to the budget
+    budget.release(4)
+    assert budget.acquire(3) == 3 and budget.acquire(1) == 1
+    got = []
+    waiter = threading.Thread(target=lambda: got.append(budget.acquire(2)))
+    waiter.start()
+    deadline = time.monotonic() + 5
+    while budget.stats()["queue_depth"] != 1 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert budget.stats() == {"total_cores": 4, "used_cores": 4, "utilization": 1.0, "running_encoders": 2,
+                              "queue_depth": 1}
+    budget.release(3)
+    waiter.join(timeout=5)
+    assert got == [2] and budget.stats()["used_cores"] == 3
+
+def test_slot_gives_cores_back_when_the_encode_raises():
+    budget = CoreBudget(2)
+    with pytest.raises(RuntimeError):
+        with budget.slot(2):
+            raise RuntimeError("ffmpeg failed")
+    assert budget.stats()["used_cores"] == 0 and budget.stats()["running_encoders"] == 0
+
+def test_a_rebuilt_pool_gets_a_fresh_budget(monkeypatch):
+    monkeypatch.setattr(scheduler, "_BUDGET", None)
+    dispatcher = Dispatcher(lambda job_id, worker_id: None, max_workers=1, initializer=jobs._init_worker,
+                            initargs=jobs._pool_initargs)
+    pool = dispatcher._pool = dispatcher._new_pool()
+    old = scheduler.get_budget()
+    old.acquire(old.total)  # held by an encode in a worker that is about to die
+
+    dead: Future = Future()
+    dead.set_exception(BrokenProcessPool("a worker died"))
+    dispatcher._slots.acquire()
+    dispatcher._done(dead, pool)
+    try:
+        assert dispatcher._pool is not pool
+        assert scheduler.get_budget() is not old and scheduler.get_budget().stats()["used_cores"] == 0
+        assert dispatcher._pool._initargs[0] is scheduler.get_budget()  # what the new workers install
+    finally:
+        pool.shutdown()
+        dispatcher._pool.shutdown()
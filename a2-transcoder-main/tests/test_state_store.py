@@ -0,0 +1,138 @@
+# tests/test_state_store.py
+from __future__ import annotations
+import sqlite3
+import time
+
+import pytest
+from sqlalchemy.exc import IntegrityError, OperationalError
+
+from app import state_store
+from app.models import Job, SessionLocal, Video
+from app.state_store import Counters, JobUpdates, write
+
+def _locked() -> OperationalError:
+    return OperationalError("UPDATE jobs ...", {}, sqlite3.OperationalError("database is locked"))
+
+@pytest.fixture(autouse=True)
+def counters(monkeypatch) -> Counters:
+    fresh = Counters()
+    monkeypatch.setattr(state_store, "_COUNTERS", fresh)
+    return fresh
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    slept = []
+    monkeypatch.setattr(state_store.time, "sleep", slept.append)
+    return slept
+
+def _flaky(failures):
+    calls = []
+
+    def fn(db):
+        calls.append(db)
+        if failures:
+            raise failures.pop(0)
+        return "ok"
+    return fn, calls
+
+def test_write_retries_lock_errors_with_growing_backoff(db, counters, sleeps):
+    fn, calls = _flaky([_locked(), _locked(), _locked()])
+    assert write(fn) == "ok"
+    assert len(calls) == 4 and len({id(s) for s in calls}) == 4  # a fresh session per attempt
+    assert [lo <= d <= 2 * lo for d, lo in zip(sleeps, (0.02, 0.04, 0.08))] == [True] * 3  # jittered, doubling
+    snap = counters.snapshot()
+    assert (snap["lock_retries"], snap["writes"], snap["write_failures"]) == (3, 1, 0)
+
+def test_write_gives_up_after_its_retries(db, counters, sleeps):
+    fn, calls = _flaky([_locked() for _ in range(5)])
+    with pytest.raises(OperationalError):
+        write(fn, retries=2)
+    assert len(calls) == 3 and counters.snapshot()["write_failures"] == 1
+
+@pytest.mark.parametrize("error", [IntegrityError("INSERT", {}, sqlite3.IntegrityError("UNIQUE")), ValueError("bug")])
+def test_write_does_not_retry_other_errors(db, counters, sleeps, error):
+    fn, calls = _flaky([error])
+    with pytest.raises(type(error)):
+        write(fn)
+    assert len(calls) == 1 and not sleeps and counters.snapshot()["write_failures"] == 1
+
+def _jobs(db, n: int):
+    v = Video(owner="kimia", filename="uploads/a.mp4", orig_name="a.mp4", size_bytes=10)
+    db.add(v)
+    db.flush()
+    jobs = [Job(owner="kimia", video_id=v.id, status="running", spec_json="[]") for _ in range(n)]
+    db.add_all(jobs)
+    db.commit()
+    return [j.id for j in jobs]
+
+def _progress(job_id: int):
+    with SessionLocal() as s:
+        return s.get(Job, job_id).progress_json
+
+def test_updates_coalesce_per_job_into_one_flush(db, counters):
+    a, b = _jobs(db, 2)
+    updates = JobUpdates(interval=3600)
+    for n in range(5):
+        updates.put(a, progress_json=f"a{n}")
+    updates.put(b, progress_json="b0")
+    assert _progress(a) is None  # nothing written before the flush
+    assert updates.flush() == 2 and updates.flush() == 0
+    assert (_progress(a), _progress(b)) == ("a4", "b0")
+    snap = counters.snapshot()
+    assert (snap["coalesced"], snap["flushes"], snap["flushed_rows"], snap["writes"]) == (4, 1, 2, 1)
+
+def test_a_failed_flush_is_retried_and_newer_values_win(db, monkeypatch):
+    (a,) = _jobs(db, 1)
+    updates = JobUpdates(interval=3600)
+    updates.put(a, progress_json="old", error="kept")
+    real = state_store.write
+
+    def broken(fn):
+        updates.put(a, progress_json="new")  # arrives while the failing batch is out
+        raise _locked()
+
+    monkeypatch.setattr(state_store, "write", broken)
+    with pytest.raises(OperationalError):
+        updates.flush()
+    monkeypatch.setattr(state_store, "write", real)
+    assert updates.flush() == 1
+    with SessionLocal() as s:
+        job = s.get(Job, a)
+        assert (job.progress_json, job.error) == ("new", "kept")
+
+def test_a_put_during_a_flush_lands_in_the_next_batch(db, monkeypatch):
+    (a,) = _jobs(db, 1)
+    updates = JobUpdates(interval=3600)
+    updates.put(a, progress_json="first")
+    real = state_store.write
+
+    def racing(fn):
+        updates.put(a, progress_json="second")  # after the batch was taken, before it commits
+        return real(fn)
+
+    monkeypatch.setattr(state_store, "write", racing)
+    updates.flush()
+    monkeypatch.setattr(state_store, "write", real)
+    assert _progress(a) == "first"
+    updates.flush()
+    assert _progress(a) == "second"  # not overwritten by the older batch
+
+def test_close_flushes_and_stops_the_flusher(db):
+    (a,) = _jobs(db, 1)
+    updates = JobUpdates(interval=3600)
+    updates.put(a, progress_json="last")
+    thread = updates._thread
+    updates.close()
+    assert _progress(a) == "last"
+    thread.join(timeout=5)
+    assert not thread.is_alive()
+
+def test_background_flusher_writes_without_an_explicit_flush(db):
+    (a,) = _jobs(db, 1)
+    updates = JobUpdates(interval=0.01)
+    updates.put(a, progress_json="soon")
+    deadline = time.monotonic() + 5
+    while _progress(a) != "soon" and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert _progress(a) == "soon" and updates._thread.is_alive()  # it loops until closed
+    updates.close()
@@ -0,0 +1,128 @@
+# tests/test_storage.py
+from __future__ import annotations
+from typing import Iterator
+import hashlib
+import io
+import os
+
+import pytest
+from botocore.exceptions import ClientError
+
+from app import s3_utils
+from app.services import storage
+from app.services.storage import exists, get_stream, put_stream, stat
+
+MiB = 1024 * 1024
+
+def _payload(size: int) -> bytes:
+    return (hashlib.sha256(b"seed").digest() * (size // 32 + 1))[:size]
+
+def _chunks(data: bytes, *sizes: int) -> Iterator[bytes]:
+    """data cut into pieces of the given sizes, repeating, with an empty chunk thrown in."""
+    i = n = 0
+    while i < len(data):
+        step = sizes[n % len(sizes)]
+        yield data[i:i + step]
+        yield b""
+        i, n = i + step, n + 1
+
+def _read(key: str, byte_range=None) -> bytes:
+    stream, _ct = get_stream(key, byte_range=byte_range)
+    return b"".join(stream)
+
+@pytest.mark.parametrize("src", ["file", "iterator"])
+def test_put_stream_local(src, monkeypatch):
+    monkeypatch.setattr(storage, "CHUNK_SIZE", 1000)
+    data = _payload(10_500)
+    size, sha = put_stream("uploads/stream.bin", io.BytesIO(data) if src == "file" else _chunks(data, 7, 4096, 333))
+    assert (size, sha) == (len(data), hashlib.sha256(data).hexdigest())
+    assert _read("uploads/stream.bin") == data
+    assert _read("uploads/stream.bin", (1000, 2999)) == data[1000:3000]
+    assert not os.path.exists(storage._safe_temp_path("uploads/stream.bin") + ".part")
+
+def test_failed_put_stream_leaves_nothing_behind():
+    def broken() -> Iterator[bytes]:
+        yield b"x" * 100
+        raise IOError("client went away")
+
+    with pytest.raises(IOError):
+        put_stream("uploads/broken.bin", broken())
+    assert not exists("uploads/broken.bin")
+    assert not os.path.exists(storage._safe_temp_path("uploads/broken.bin") + ".part")
+
+@pytest.fixture
+def s3(monkeypatch):
+    """A mocked bucket behind the s3 backend."""
+    moto = pytest.importorskip("moto")
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    monkeypatch.delenv("AWS_SESSION_TOKEN", raising=False)
+    monkeypatch.delenv("S3_ENDPOINT", raising=False)
+    monkeypatch.setenv("S3_BUCKET", "transcoder-test")
+    monkeypatch.setattr(storage, "_BACKEND", "s3")
+    with moto.mock_aws():
+        s3_utils._s3.cache_clear()
+        client = s3_utils.client()
+        client.create_bucket(Bucket="transcoder-test", CreateBucketConfiguration={"LocationConstraint": s3_utils._region()})
+        yield client
+    s3_utils._s3.cache_clear()
+
+def test_put_stream_s3_small_object_is_one_put(s3):
+    data = _payload(1000)
+    assert put_stream("uploads/small.bin", _chunks(data, 300)) == (1000, hashlib.sha256(data).hexdigest())
+    assert _read("uploads/small.bin") == data
+
+def test_put_stream_s3_multipart(s3, monkeypatch):
+    monkeypatch.setattr(storage, "S3_TRANSFER_CONCURRENCY", 2)
+    data = _payload(2 * storage.S3_PART_SIZE + 123)
+    size, sha = put_stream("uploads/big.bin", _chunks(data, MiB, 777), "video/mp4")
+    assert (size, sha) == (len(data), hashlib.sha256(data).hexdigest())
+    head = s3.head_object(Bucket="transcoder-test", Key="uploads/big.bin")
+    assert "-" in head["ETag"] and head["ContentType"] == "video/mp4"  # a multipart ETag
+    assert stat("uploads/big.bin")["size"] == len(data)
+
+    monkeypatch.setattr(storage, "S3_PARALLEL_GET_THRESHOLD", MiB)  # read back as parallel ranged GETs
+    assert _read("uploads/big.bin") == data
+    lo, hi = storage.S3_PART_SIZE - 10, 2 * storage.S3_PART_SIZE + 5
+    assert _read("uploads/big.bin", (lo, hi)) == data[lo:hi + 1]
+
+def test_failed_multipart_upload_is_aborted(s3):
+    def broken() -> Iterator[bytes]:
+        yield _payload(storage.S3_PART_SIZE + 1)
+        raise IOError("client went away")
+
+    with pytest.raises(IOError):
+        put_stream("uploads/broken.bin", broken())
+    assert not exists("uploads/broken.bin")
+    assert not s3.list_multipart_uploads(Bucket="transcoder-test").get("Uploads")
+
+def test_delete_prefix_s3(s3):
+    for name in ("a.mp4", "stream/seg_0.m4s", "stream/master.m3u8"):
+        put_stream(f"outputs/job_1/{name}", [b"x"])
+    put_stream("outputs/job_10/a.mp4", [b"x"])
+    assert storage.delete_prefix("outputs/job_1/") == 3
+    assert [o["Key"] for o in s3.list_objects_v2(Bucket="transcoder-test")["Contents"]] == ["outputs/job_10/a.mp4"]
+    with pytest.raises(ValueError):
+        storage.delete_prefix("outputs/job_1")
+
+def test_parallel_ranged_gets_are_pinned_to_one_version(s3, monkeypatch):
+    monkeypatch.setattr(storage, "S3_PARALLEL_GET_THRESHOLD", MiB)
+    monkeypatch.setattr(storage, "S3_TRANSFER_CONCURRENCY", 1)  # one part ahead of the reader
+    data = _payload(3 * storage.S3_PART_SIZE)
+    put_stream("uploads/pinned.bin", [data])
+    etag = s3.head_object(Bucket="transcoder-test", Key="uploads/pinned.bin")["ETag"]
+    gets = []
+    s3.meta.events.register("before-parameter-build.s3.GetObject", lambda params, **kw: gets.append(dict(params)))
+
+    assert _read("uploads/pinned.bin") == data
+    ranged = [g for g in gets if "Range" in g]
+    assert len(ranged) == 3 and all(g["IfMatch"] == etag for g in ranged)
+
+    stream, _ct = get_stream("uploads/pinned.bin")
+    first = next(stream)
+    put_stream("uploads/pinned.bin", [_payload(3 * storage.S3_PART_SIZE + 1)])  # replaced mid-read
+    with pytest.raises(ClientError) as e:
+        for _chunk in stream:
+            pass
+    assert e.value.response["Error"]["Code"] in {"PreconditionFailed", "412"}
+    assert first == data[:len(first)]  # what was read came from the old version only
@@ -0,0 +1,44 @@
+# tests/test_upload.py
+from __future__ import annotations
+import hashlib
+import os
+
+from app.models import Video
+from app.services.storage import _safe_temp_path, exists
+from tests.conftest import auth, requires_ffmpeg
+
+def _upload(client, data: bytes, name: str = "clip.mp4", user: str = "kimia") -> dict:
+    r = client.post("/videos/upload", headers=auth(user), files={"file": (name, data, "video/mp4")})
+    assert r.status_code == 200, r.text
+    return r.json()
+
+def _stored() -> set:
+    return set(os.listdir(os.path.dirname(_safe_temp_path("uploads/x"))))
+
+@requires_ffmpeg
+def test_identical_upload_reuses_the_stored_object(client, db, source_720p):
+    data = source_720p.read_bytes()
+    before = _stored()
+    first = _upload(client, data)
+    assert (first["size_bytes"], first["sha256"], first["deduplicated"]) == (len(data), hashlib.sha256(data).hexdigest(), False)
+
+    second = _upload(client, data, name="again.mp4", user="sara")  # across owners: same bytes, same object
+    assert second["deduplicated"] and second["stored_name"] == first["stored_name"]
+    assert second["media"] == first["media"] and second["orig_name"] == "again.mp4"  # the twin's probe
+    assert _stored() - before == {os.path.basename(first["stored_name"])}  # the copy was dropped
+
+    videos = db.query(Video).order_by(Video.id).all()
+    assert [(v.owner, v.filename) for v in videos] == [("kimia", first["stored_name"]), ("sara", first["stored_name"])]
+
+def test_different_bytes_are_stored_separately(client, db):
+    first, second = _upload(client, b"one" * 100), _upload(client, b"two" * 100)
+    assert not first["deduplicated"] and not second["deduplicated"]
+    assert first["stored_name"] != second["stored_name"]
+    assert exists(first["stored_name"]) and exists(second["stored_name"])
+
+def test_twin_whose_object_is_gone_is_not_reused(client, db):
+    data = b"lost" * 100
+    first = _upload(client, data)
+    os.remove(_safe_temp_path(first["stored_name"]))
+    second = _upload(client, data)
+    assert not second["deduplicated"] and exists(second["stored_name"])